@@ -2025,6 +2025,7 @@ If you use HTTPS proxy, set in format https://ip:port, or https://username:passw
             layout.prop(self, "use_timers")
             layout.prop(self, "experimental_features")
             layout.prop(self, "categories_fix")
+            layout.operator("wm.blenderkit_export_trace", text="Export trace")
 
         addon_updater_ops.update_settings_ui(self, context)
 
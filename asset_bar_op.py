@@ -888,6 +888,7 @@ class BlenderKitAssetBarOperator(BL_UI_OT_draw_operator):
             ui_props = bpy.context.window_manager.blenderkitUI
             ui_props.active_index = search_index  # + self.scroll_offset
 
+            search.request_full_thumbnail(asset_data)
             set_thumb_check(self.tooltip_image,asset_data,thumb_type='thumbnail')
             get_tooltip_data(asset_data)
             an = asset_data['name']
@@ -1003,17 +1004,18 @@ class BlenderKitAssetBarOperator(BL_UI_OT_draw_operator):
         sr = global_vars.DATA.get('search results')
         if not sr:
             return
+        asset_indices = sr.index_of_base_id(asset_id)
         for asset_button in self.asset_buttons:
-            if asset_button.asset_index < len(sr):
-                asset_data = sr[asset_button.asset_index]
-                if asset_data['assetBaseId'] == asset_id:
-                    # print(asset_button.asset_index)
-                    set_thumb_check(asset_button, asset_data, thumb_type = 'thumbnail_small')
+            if asset_button.asset_index in asset_indices:
+                set_thumb_check(asset_button, sr[asset_button.asset_index], thumb_type = 'thumbnail_small')
 
     def update_images(self):
         sr = global_vars.DATA.get('search results')
         if not sr:
             return
+        # results far from the visible ones give up their heavy fields
+        sr.set_viewport(self.scroll_offset, self.scroll_offset + len(self.asset_buttons))
+        visible_assets = []
         for asset_button in self.asset_buttons:
             if asset_button.visible:
                 asset_button.asset_index = asset_button.button_index + self.scroll_offset
@@ -1024,7 +1026,7 @@ class BlenderKitAssetBarOperator(BL_UI_OT_draw_operator):
                     asset_data = sr[asset_button.asset_index]
                     if asset_data is None:
                         continue
-                      
+                    visible_assets.append(asset_data['assetBaseId'])
 
                     # show indices for debug purposes
                     # asset_button.text = str(asset_button.asset_index)
@@ -1049,6 +1051,7 @@ class BlenderKitAssetBarOperator(BL_UI_OT_draw_operator):
                 asset_button.validation_icon.visible = False
                 if utils.profile_is_validator():
                     asset_button.red_alert.visible = False
+        search.report_visible_assets(visible_assets)
 
     def scroll_update(self, always =False):
         sr = global_vars.DATA.get('search results')
@@ -0,0 +1,140 @@
+"""Holds asyncio event loop of the add-on, running on its own thread, so network calls never block Blender's UI.
+
+Coroutines are submitted from the main thread with submit(), their results are handed back to the main thread
+through a queue processed by handle_results() on every tick of the timer.
+Blocking calls (e.g. requests with token refresh in rerequests) run in the loop's bounded thread pool with run_blocking().
+"""
+
+import asyncio
+import concurrent.futures
+import queue
+import sys
+import threading
+
+import aiohttp
+
+
+BLOCKING_WORKERS = 4
+"""Threads running blocking calls, e.g. ratings and comments requests."""
+STOP_TIMEOUT = 5
+"""Seconds to wait for the loop to close its session and stop."""
+
+loop: asyncio.AbstractEventLoop | None = None
+executor: concurrent.futures.ThreadPoolExecutor | None = None
+thread: threading.Thread | None = None
+session: aiohttp.ClientSession | None = None
+"""Session shared by all requests to the daemon, only to be used on the loop."""
+results = queue.Queue()
+"""Done futures with their callbacks, waiting to be handled on the main thread."""
+
+
+def is_running() -> bool:
+  return loop is not None and loop.is_running()
+
+
+def start():
+  """Start the event loop on a daemon thread and create the shared session."""
+
+  global loop, executor, thread
+  if is_running():
+    return
+
+  if sys.platform == 'win32':
+    loop = asyncio.ProactorEventLoop()
+  else:
+    loop = asyncio.new_event_loop()
+  executor = concurrent.futures.ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix='blenderkit-blocking')
+  loop.set_default_executor(executor)
+  started = threading.Event()
+  thread = threading.Thread(target=run_loop, args=(loop, started), name='blenderkit-async-loop', daemon=True)
+  thread.start()
+  started.wait()
+  asyncio.run_coroutine_threadsafe(create_session(), loop).result(STOP_TIMEOUT)
+
+
+def run_loop(event_loop: asyncio.AbstractEventLoop, started: threading.Event):
+  asyncio.set_event_loop(event_loop)
+  event_loop.call_soon(started.set)
+  event_loop.run_forever()
+  event_loop.close()
+
+
+async def create_session():
+  global session
+  # connections are kept alive between requests, the daemon is on localhost so system proxies must not apply
+  session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=16), trust_env=False)
+
+
+async def close_session():
+  global session
+  if session is not None:
+    await session.close()
+  session = None
+
+
+def stop():
+  """Cancel running coroutines, close the session and stop the loop."""
+
+  global loop, executor, thread
+  if not is_running():
+    return
+
+  async def shutdown():
+    for task in asyncio.all_tasks():
+      if task is not asyncio.current_task():
+        task.cancel()
+    await close_session()
+
+  try:
+    asyncio.run_coroutine_threadsafe(shutdown(), loop).result(STOP_TIMEOUT)
+  except Exception as e:
+    print(f'Async loop did not shut down cleanly: {e}')
+  executor.shutdown(wait=False, cancel_futures=True)
+  loop.call_soon_threadsafe(loop.stop)
+  thread.join(STOP_TIMEOUT)
+  loop = None
+  executor = None
+  thread = None
+
+
+def submit(coroutine, callback=None) -> concurrent.futures.Future:
+  """Run the coroutine on the loop. If given, callback(result) is called on the main thread once it is done.
+  Exceptions of the coroutine are printed, the callback is then not called.
+  """
+
+  future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+  future.add_done_callback(lambda f: results.put((f, callback)))
+  return future
+
+
+def run_blocking(func, *args, callback=None) -> concurrent.futures.Future:
+  """Run blocking function in the bounded thread pool of the loop, instead of starting a thread for it."""
+
+  async def run():
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+  return submit(run(), callback)
+
+
+def run_in_background(func, *args):
+  """Run blocking function off the main thread: in the thread pool of the loop if it runs, otherwise in a new thread."""
+
+  if is_running():
+    return run_blocking(func, *args)
+  thread = threading.Thread(target=func, args=args, daemon=True)
+  thread.start()
+
+
+def handle_results():
+  """Call callbacks of finished coroutines, must be called on the main thread."""
+
+  while not results.empty():
+    future, callback = results.get()
+    if future.cancelled():
+      continue
+    error = future.exception()
+    if error is not None:
+      print(f'BlenderKit background request failed: {type(error).__name__}: {error}')
+      continue
+    if callback is not None:
+      callback(future.result())
@@ -17,12 +17,11 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import logging
-import threading
 
 # mainly update functions and callbacks for ratings properties, here to avoid circular imports.
 import bpy
 
-from . import global_vars, paths, rerequests, search, tasks_queue, utils
+from . import async_loop, global_vars, paths, rerequests, search, tasks_queue, utils
 
 
 bk_logger = logging.getLogger('blenderkit')
@@ -95,15 +94,13 @@ def upload_comment_flag_thread(asset_id='', comment_id='', flag='like', api_key=
 def send_comment_flag_to_thread(asset_id='', comment_id='', flag='like', api_key=None):
   '''Sens rating into thread rating, main purpose is for tasks_queue.
   One function per property to avoid lost data due to stashing.'''
-  thread = threading.Thread(target=upload_comment_flag_thread, args=(asset_id, comment_id, flag, api_key))
-  thread.start()
+  async_loop.run_in_background(upload_comment_flag_thread, asset_id, comment_id, flag, api_key)
 
 
 def send_comment_to_thread(asset_id, comment_id, comment, api_key):
   '''Sens rating into thread rating, main purpose is for tasks_queue.
   One function per property to avoid lost data due to stashing.'''
-  thread = threading.Thread(target=upload_comment_thread, args=(asset_id, comment_id, comment, api_key))
-  thread.start()
+  async_loop.run_in_background(upload_comment_thread, asset_id, comment_id, comment, api_key)
 
 # def send_comment_delete_to_thread(asset_id='', comment_id='', flag='like', api_key=None):
 #   '''Sens rating into thread rating, main purpose is for tasks_queue.
@@ -129,8 +126,7 @@ def get_comments_local(asset_id):
 
 
 def get_comments_thread(asset_id, api_key):
-  thread = threading.Thread(target=get_comments, args=([asset_id, api_key]), daemon=True)
-  thread.start()
+  async_loop.run_in_background(get_comments, asset_id, api_key)
 
 
 def get_comments(asset_id, api_key):
@@ -215,8 +211,7 @@ def check_notifications_read():
 
 def get_notifications_thread(api_key, all_count=1000):
   if api_key!='':
-    thread = threading.Thread(target=get_notifications, args=([api_key, all_count]), daemon=True)
-    thread.start()
+    async_loop.run_in_background(get_notifications, api_key, all_count)
 
 
 def get_notifications(api_key, all_count=1000):
@@ -256,8 +251,7 @@ def get_notifications(api_key, all_count=1000):
 
 
 def mark_notification_read_thread(api_key, notification_id):
-  thread = threading.Thread(target=mark_notification_read, args=([api_key, notification_id]), daemon=True)
-  thread.start()
+  async_loop.run_in_background(mark_notification_read, api_key, notification_id)
 
 
 def mark_notification_read(api_key, notification_id):
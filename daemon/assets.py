@@ -1,15 +1,18 @@
 """Holds functionality for asset manipulation and download."""
 
 import asyncio
+import copy
 import json
 import os
 import shutil
 import sys
-import tempfile
+import time
 
 import aiohttp
 import globals
+import metrics
 import tasks
+import tracing
 from aiohttp import web
 
 import utils
@@ -74,66 +77,384 @@ async def do_asset_download(request: web.Request, task: tasks.Task):
   2. gets download URL for an asset
   3. checks whether asset exists locally
   4. gets file_path for the file
-  5. downloads the file
-  6. unpacks the file
+  5. if the same file is already downloading, follows that download, otherwise
+  6. waits for a slot in the scheduler and downloads the file
+  7. unpacks the file
+
+  When cancelled, the partially downloaded file is deleted (unless other tasks follow the download) and the task reported as cancelled.
+  """
+
+  file_path = None
+  downloaded = False
+  leading = False
+  started = tracing.now()
+  try:
+    with metrics.timer('blenderkit_get_download_url_seconds'), tracing.span('get_download_url', task.task_id):
+      got_url = await get_download_url(request.app["SESSION_API_REQUESTS"], task)
+    if not got_url:
+      return  # the task already errored
+
+    # This check happens only after get_download_url becase we need it to know what is the file name on hard drive.
+    with tracing.span('check_existing', task.task_id):
+      exists = await check_existing(task)
+    if exists:
+      task.finished('Asset found on hard drive')
+      return
+
+    file_path = get_download_filepaths(task)[0]
+    task.data['resolution'] = get_res_file(task.data)[1]
+    key = (task.data['asset_data']['assetBaseId'], task.data['resolution'], file_path)
+
+    unpacked = False
+    flight = globals.downloads_in_flight.get(key)
+    while flight is not None:
+      with tracing.span('follow_download', task.task_id, leader=flight[0].task_id):
+        outcome = await follow_download(task, *flight)
+      if outcome['downloaded']:
+        downloaded = True
+        unpacked = outcome['unpacked']
+        break
+      # the leading download failed or was cancelled, take it over (or follow whoever took it over first)
+      flight = globals.downloads_in_flight.get(key)
+
+    if not downloaded:
+      outcome = {'downloaded': False, 'unpacked': False}
+      done = asyncio.get_running_loop().create_future()
+      globals.downloads_in_flight[key] = (task, done)
+      leading = True
+      try:
+        task.change_progress(0, "Waiting in queue")
+        queued_at = time.perf_counter()
+        queued_span = tracing.now()
+        async with globals.scheduler.slot(task) as priority:
+          metrics.observe('blenderkit_download_queue_seconds', time.perf_counter() - queued_at, priority=priority)
+          tracing.add_span('queue', queued_span, tracing.now(), task.task_id, priority=priority)
+          with metrics.timer('blenderkit_download_body_seconds'), tracing.span('download', task.task_id):
+            outcome['downloaded'] = await download_file(request.app["SESSION_ASSETS"], file_path, task)
+        if not outcome['downloaded']:
+          return
+        downloaded = True
+        # TODO: check if resolution is written correctly into assetdata hanging on actual appended object in scene and probably remove the following line?
+
+        task.data['asset_data']['resolution'] = task.data['resolution']
+        if task.data['PREFS']['unpack_files']:
+          task.change_progress(100, 'Unpacking files')
+          with metrics.timer('blenderkit_unpack_seconds'), tracing.span('unpack', task.task_id):
+            await send_to_bg(task.data, file_path, command='unpack', wait=True)
+          outcome['unpacked'] = True
+      finally:
+        del globals.downloads_in_flight[key]
+        done.set_result(outcome)
+
+    task.data['asset_data']['resolution'] = task.data['resolution']
+    if task.data['PREFS']['unpack_files'] and not unpacked and not leading:
+      task.change_progress(100, 'Unpacking files')
+      with metrics.timer('blenderkit_unpack_seconds'), tracing.span('unpack', task.task_id):
+        await send_to_bg(task.data, file_path, command='unpack', wait=True)
+
+    task.change_progress(100, 'Appending asset')
+    task.finished('Asset downloaded and ready')
+  except asyncio.CancelledError:
+    if leading and not downloaded and len(globals.download_followers.get(task.task_id, [])) == 0:
+      await globals.io_executor.run(delete_unfinished_file, file_path)
+    task.cancelled('Download cancelled')
+    raise
+  finally:
+    tracing.add_span('asset_download', started, tracing.now(), task.task_id, status=task.status)
+
+
+async def follow_download(task: tasks.Task, leader: tasks.Task, done: asyncio.Future) -> dict:
+  """Wait for the download of the same file started by another task, progress of the leader is mirrored to the task.
+
+  Returns the outcome of the leading download: {'downloaded': bool, 'unpacked': bool}.
   """
 
-  await get_download_url(request.app["SESSION_API_REQUESTS"], task)
+  followers = globals.download_followers.setdefault(leader.task_id, [])
+  followers.append(task)
+  task.change_progress(leader.progress, leader.message)
+  try:
+    return await asyncio.shield(done)
+  finally:
+    followers.remove(task)
+    if len(followers) == 0:
+      del globals.download_followers[leader.task_id]
+
+
+def mirror_to_followers(task: tasks.Task):
+  """Copy progress of a leading download to the tasks following it."""
+
+  for follower in globals.download_followers.get(task.task_id, ()):
+    follower.change_progress(task.progress, task.message)
+
+
+def get_part_paths(file_path: str) -> tuple[str, str]:
+  """Get path of the partial download and path of the JSON file with its info (expected length and validator)."""
+
+  part_path = file_path + globals.PART_SUFFIX
+  return part_path, part_path + '.json'
+
+
+def read_part_info(file_path: str) -> dict:
+  """Read info of the partial download of the file. Returns empty dict if there is no usable partial download."""
+
+  part_path, info_path = get_part_paths(file_path)
+  if not os.path.isfile(part_path) or not os.path.isfile(info_path):
+    return {}
+  try:
+    with open(info_path, 'r', encoding='utf-8') as f:
+      return json.load(f)
+  except Exception as e:
+    print(f'Could not read info of partial download {info_path}: {e}')
+    return {}
 
-  # This check happens only after get_download_url becase we need it to know what is the file name on hard drive.
-  if await check_existing(task):
-    task.finished('Asset found on hard drive')
-    return
 
-  file_path = get_download_filepaths(task)[0]
-  task.change_progress(0, "Waiting in queue")
-  await download_file(request.app["SESSION_ASSETS"], file_path, task)
-  # TODO: check if resolution is written correctly into assetdata hanging on actual appended object in scene and probably remove the following line?
+def write_part_info(file_path: str, info: dict) -> None:
+  """Persist info of the partial download, so it can be resumed also after the daemon restarts."""
 
-  task.data['asset_data']['resolution'] = task.data['resolution']
-  if task.data['PREFS']['unpack_files']:
-    task.change_progress(100, 'Unpacking files')
-    await send_to_bg(task.data, file_path, command='unpack', wait=True)
+  info_path = get_part_paths(file_path)[1]
+  with open(info_path, 'w', encoding='utf-8') as f:
+    json.dump(info, f)
 
-  task.change_progress(100, 'Appending asset')
-  task.finished('Asset downloaded and ready')
 
+async def download_file(session: aiohttp.ClientSession, file_path, task: tasks.Task) -> bool:
+  """Download the asset file, resuming the transfer when the connection drops.
+
+  Data are written into `<file_path>.part` which is renamed to file_path only when complete,
+  so a half-written file is never mistaken for a downloaded asset.
+  Returns True if the file was downloaded, False if the task failed.
+  """
 
-async def download_file(session: aiohttp.ClientSession, file_path, task: tasks.Task):
-  with open(file_path, "wb") as file:
-    res_file_info, task.data['resolution'] = get_res_file(task.data)
-    async with session.get(res_file_info['url']) as resp:
+  res_file_info, task.data['resolution'] = get_res_file(task.data)
+  part_path, info_path = get_part_paths(file_path)
+  for attempt in range(globals.RESUME_RETRIES + 1):
+    try:
+      if not await download_file_part(session, res_file_info['url'], file_path, task):
+        return False
+      break
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+      if attempt == globals.RESUME_RETRIES:
+        task.error(f'Download failed: {e}')
+        return False
+      task.change_progress(task.progress, f"Connection lost, resuming download ({attempt + 1}/{globals.RESUME_RETRIES})")
+      await asyncio.sleep(min(2 ** attempt, 30))
+
+  await globals.io_executor.run(os.replace, part_path, file_path)
+  await globals.io_executor.run(os.remove, info_path)
+  return True
+
+
+async def download_file_part(session: aiohttp.ClientSession, url: str, file_path: str, task: tasks.Task) -> bool:
+  """Download the rest of the file into its part file. Uses Range request if a partial download with a validator exists.
+
+  Raises aiohttp.ClientPayloadError if the connection ended before the whole file was received.
+  Returns False if the download failed for other reason and the task was set to error.
+  """
+
+  part_path = get_part_paths(file_path)[0]
+  info = await globals.io_executor.run(read_part_info, file_path)
+  if info.get('segments'):
+    return await download_segments(session, url, file_path, task, info)
+
+  offset = 0
+  headers = {}
+  validator = info.get('etag') or info.get('last_modified')
+  if validator:
+    offset = await globals.io_executor.run(os.path.getsize, part_path)
+    if offset == info['length']:
+      return True
+    if 0 < offset < info['length']:
+      headers['Range'] = f'bytes={offset}-'
+      headers['If-Range'] = validator
+    else:
+      offset = 0
+
+  async with session.get(url, headers=headers) as resp:
+    if resp.status == 206:
+      if not resp.headers.get('Content-Range', '').startswith(f'bytes {offset}-'):
+        # unexpected range, forget the partial download and start over
+        await globals.io_executor.run(os.remove, get_part_paths(file_path)[1])
+        raise aiohttp.ClientPayloadError(f"Unexpected Content-Range: {resp.headers.get('Content-Range')}")
+      file_size = info['length']
+    elif resp.status == 200:
+      # server sent the whole file - resource changed or range not supported
+      offset = 0
       total_length = resp.headers.get('Content-Length')
       if total_length is None:  # no content length header
         print('no content length: ', resp.content)
         task.error('no content length')
-        delete_unfinished_file(file_path)
-        return
-
-      # bk_logger.debug(total_length)
-      # if int(total_length) < 1000:  # means probably no file returned.
-      # tasks_queue.add_task((reports.add_report, (response.content, 20, colors.RED)))
-      #
-      #   tcom.report = response.content
+        await globals.io_executor.run(delete_unfinished_file, file_path)
+        return False
       file_size = int(total_length)
-      fsmb = file_size // (1024 * 1024)
-      fskb = file_size % 1024
-      if fsmb == 0:
-        t = '%iKB' % fskb
-      else:
-        t = ' %iMB' % fsmb
-      task.change_progress(progress=0, message=f"Downloading {t} {task.data['resolution']}")
-      downloaded = 0
+      info = {
+        'length': file_size,
+        'etag': resp.headers.get('ETag'),
+        'last_modified': resp.headers.get('Last-Modified'),
+      }
+      if can_download_segments(resp, file_size):
+        # drop this stream, the file is downloaded by several range requests at once instead
+        resp.close()
+        info['segments'] = split_segments(file_size, globals.segment_count)
+        await globals.io_executor.run(preallocate_file, part_path, file_size)
+        await globals.io_executor.run(write_part_info, file_path, info)
+        return await download_segments(session, url, file_path, task, info)
+      await globals.io_executor.run(write_part_info, file_path, info)
+    else:
+      task.error(f'Download error: {resp.status}')
+      return False
 
+    # bk_logger.debug(total_length)
+    # if int(total_length) < 1000:  # means probably no file returned.
+    # tasks_queue.add_task((reports.add_report, (response.content, 20, colors.RED)))
+    #
+    #   tcom.report = response.content
+    t = format_size(file_size)
+    downloaded = offset
+    task.change_progress(progress=int(100 * downloaded / file_size), message=f"Downloading {t} {task.data['resolution']}")
+
+    # chunks are collected and written in bigger blocks by the I/O pool, so the event loop never waits for the disk
+    file = await globals.io_executor.run(open, part_path, "ab" if offset > 0 else "wb")
+    chunks = []
+    buffered = 0
+    try:
       async for chunk in resp.content.iter_chunked(4096 * 32):
         # for rdata in response.iter_content(chunk_size=4096 * 32):  # crashed here... why? investigate:
         downloaded += len(chunk)
+        metrics.inc('blenderkit_bytes_total', len(chunk), session='assets')
+        await globals.bandwidth.consume('assets', len(chunk))
         progress = int(100 * downloaded / file_size)
         task.change_progress(progress=progress, message=f"Downloading {t} {task.data['resolution']}")
-        file.write(chunk)
-        # if globals.tasks[data['task_id']].get('kill'):
-        #   delete_unfinished_file(file_path)
-        #   return
+        chunks.append(chunk)
+        buffered += len(chunk)
+        if buffered >= globals.WRITE_BUFFER:
+          block, chunks, buffered = chunks, [], 0
+          await globals.io_executor.run(file.writelines, block)
+    except asyncio.CancelledError:
+      # abort the stream, so the connection is closed and its slot in the connector freed right away
+      resp.close()
+      raise
+    finally:
+      # write what was received also when the connection dropped, so the download resumes from the right offset
+      await globals.io_executor.run(write_and_close, file, chunks)
+
+  if downloaded < file_size:
+    raise aiohttp.ClientPayloadError(f'Connection closed after {downloaded} of {file_size} bytes')
+  return True
+
+
+def format_size(file_size: int) -> str:
+  fsmb = file_size // (1024 * 1024)
+  fskb = file_size % 1024
+  if fsmb == 0:
+    return '%iKB' % fskb
+  return ' %iMB' % fsmb
+
+
+def can_download_segments(resp: aiohttp.ClientResponse, file_size: int) -> bool:
+  """Check whether the file is big enough and the server supports range requests with a validator, so it can be downloaded in segments."""
+
+  if globals.segment_count < 2 or file_size < globals.segment_threshold:
+    return False
+  if resp.headers.get('Accept-Ranges', '').lower() != 'bytes':
+    return False
+  return resp.headers.get('ETag') is not None or resp.headers.get('Last-Modified') is not None
+
+
+def split_segments(file_size: int, count: int) -> list:
+  """Split the file into segments [start, end, bytes written], end is inclusive as in Range header."""
+
+  size = -(-file_size // count)
+  return [[start, min(start + size, file_size) - 1, 0] for start in range(0, file_size, size)]
+
+
+def preallocate_file(path: str, size: int) -> None:
+  with open(path, 'wb') as file:
+    file.truncate(size)
+
+
+def write_at(file, offset: int, chunks: list) -> None:
+  file.seek(offset)
+  file.writelines(chunks)
+
+
+async def download_segments(session: aiohttp.ClientSession, url: str, file_path: str, task: tasks.Task, info: dict) -> bool:
+  """Download the missing parts of the segments concurrently, each one written at its offset in the preallocated part file.
+
+  Bytes written in each segment are persisted in the part info, so an interrupted download resumes every segment where it stopped.
+  Raises aiohttp.ClientPayloadError if a segment is not complete. If the file changed on the server, the part info is removed,
+  so the next attempt starts over.
+  """
+
+  part_path, info_path = get_part_paths(file_path)
+  file_size = info['length']
+  validator = info.get('etag') or info.get('last_modified')
+  t = format_size(file_size)
+  downloaded = sum(segment[2] for segment in info['segments'])
+  info_lock = asyncio.Lock()
+  invalid = False
+
+  async def save_info():
+    async with info_lock:
+      if not invalid:
+        await globals.io_executor.run(write_part_info, file_path, copy.deepcopy(info))
+
+  async def invalidate():
+    nonlocal invalid
+    async with info_lock:
+      if not invalid:
+        invalid = True
+        await globals.io_executor.run(os.remove, info_path)
+
+  async def fetch(segment: list):
+    nonlocal downloaded
+    start, end = segment[0] + segment[2], segment[1]
+    if start > end:
+      return
+    headers = {'Range': f'bytes={start}-{end}', 'If-Range': validator}
+    async with session.get(url, headers=headers) as resp:
+      if resp.status != 206 or not resp.headers.get('Content-Range', '').startswith(f'bytes {start}-'):
+        # the file changed on the server or ranges are not honored anymore, start over
+        resp.close()
+        await invalidate()
+        raise aiohttp.ClientPayloadError(f'Segment {start}-{end} got status {resp.status}, restarting download')
+
+      file = await globals.io_executor.run(open, part_path, 'r+b')
+      chunks = []
+      buffered = 0
+      try:
+        async for chunk in resp.content.iter_chunked(4096 * 32):
+          downloaded += len(chunk)
+          metrics.inc('blenderkit_bytes_total', len(chunk), session='assets')
+          await globals.bandwidth.consume('assets', len(chunk))
+          task.change_progress(progress=int(100 * downloaded / file_size), message=f"Downloading {t} {task.data['resolution']}")
+          chunks.append(chunk)
+          buffered += len(chunk)
+          if buffered >= globals.WRITE_BUFFER:
+            block, chunks, buffered = chunks, [], 0
+            await globals.io_executor.run(write_at, file, segment[0] + segment[2], block)
+            segment[2] += sum(len(c) for c in block)
+            await save_info()
+      except asyncio.CancelledError:
+        resp.close()
+        raise
+      finally:
+        await globals.io_executor.run(write_at, file, segment[0] + segment[2], chunks)
+        await globals.io_executor.run(file.close)
+        segment[2] += buffered
+        await save_info()
+
+    if segment[0] + segment[2] <= segment[1]:
+      raise aiohttp.ClientPayloadError(f'Connection closed after {segment[2]} bytes of segment {segment[0]}-{segment[1]}')
+
+  task.change_progress(progress=int(100 * downloaded / file_size), message=f"Downloading {t} {task.data['resolution']}")
+  fetches = [asyncio.ensure_future(fetch(segment)) for segment in info['segments']]
+  try:
+    await asyncio.gather(*fetches)
+  finally:
+    # when one segment fails, stop the others, and let all of them write what they received before a retry
+    for f in fetches:
+      f.cancel()
+    await asyncio.gather(*fetches, return_exceptions=True)
+  return True
 
 
 def report_download_finished(data):
@@ -154,7 +475,7 @@ async def get_download_url(session: aiohttp.ClientSession, task: tasks.Task):
   res_file_info, resolution = get_res_file(task.data)
 
   async with session.get(res_file_info['downloadUrl'], params=req_data, headers=headers) as resp:
-    await resp.text()
+    metrics.inc('blenderkit_bytes_total', len(await resp.read()), session='api_requests')
     if resp == None:
       task.error('Connection error')
       return False
@@ -173,9 +494,8 @@ async def get_download_url(session: aiohttp.ClientSession, task: tasks.Task):
       # r1 = 'All materials and brushes are available for free. Only users registered to Standard plan can use all models.'
     elif resp.status >= 500:
       task.error('Server error')
-
-  # add_error_report(data, text=report_text)
-  task.change_progress(-1, report_text)
+    else:
+      task.error(f'Could not get download URL - {resp.status}.')
 
   return False
 
@@ -234,8 +554,6 @@ def get_download_filepaths(task):
       if sys.platform == 'win32' and len(asset_folder_path) > windows_path_limit:
         task.error(error_message)
         continue
-      if not os.path.exists(asset_folder_path):
-        os.makedirs(asset_folder_path)
 
       file_name = os.path.join(asset_folder_path, n)
       file_names.append(file_name)
@@ -249,9 +567,9 @@ def get_download_filepaths(task):
 
 
 async def send_to_bg(data, fpath, command='generate_resolutions', wait=True):
-  """Send various tasks to a new blender instance that runs and closes after finishing the task.
+  """Send various tasks to a background instance of Blender from the warm worker pool.
 
-  This function waits until the process finishes.
+  This function waits until the job finishes, unless wait is False - then the job runs on and its future is returned.
   The function tries to set the same bpy.app.debug_value in the instance of Blender that is run.
   
   Parameters
@@ -262,7 +580,7 @@ async def send_to_bg(data, fpath, command='generate_resolutions', wait=True):
 
   Returns
   -------
-  None
+  Result of the job {'ok': bool, 'error': str}, or future of the result if not waiting.
   """
 
   process_data = {
@@ -271,31 +589,37 @@ async def send_to_bg(data, fpath, command='generate_resolutions', wait=True):
     'asset_data': data['asset_data'],
     'command': command,
   }
-  binary_path = data['PREFS']['binary_path']
-  tempdir = tempfile.mkdtemp()
-  datafile = os.path.join(tempdir + 'resdata.json')
-  script_path = os.path.dirname(os.path.realpath(__file__))
-  with open(datafile, 'w', encoding='utf-8') as s:
-    json.dump(process_data, s, ensure_ascii=False, indent=4)
-
-  args = [
-    "--background",
-    "-noaudio",
-    # "--no-addons",
-    fpath,
-    "--python", os.path.join(script_path, "..", "resolutions_bg.py"),
-    "--", datafile
-  ]
-  proc = await asyncio.create_subprocess_exec(binary_path, *args, creationflags=utils.get_process_flags())
-  # stdout = asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
-  if wait:
-    stdout, stderr = await proc.communicate()
-
-  return proc
-
-
-async def copy_asset(fp1, fp2):
-  """Synchronize the asset between folders, including it's texture subdirectories."""
+  job = globals.worker_pool.run(data['PREFS']['binary_path'], process_data)
+  if not wait:
+    return asyncio.ensure_future(job)
+
+  try:
+    result = await job
+  except (ConnectionError, OSError, ValueError) as e:
+    result = {'ok': False, 'error': str(e)}
+  if not result.get('ok'):
+    print(f"Background {command} of {fpath} failed: {result.get('error')}")
+  return result
+
+
+def write_and_close(file, chunks: list) -> None:
+  """Write the remaining chunks and close the file."""
+
+  try:
+    file.writelines(chunks)
+  finally:
+    file.close()
+
+
+def make_asset_dirs(file_paths: list) -> None:
+  """Create the folders of the asset files."""
+
+  for file_path in file_paths:
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+
+def copy_asset(fp1, fp2):
+  """Synchronize the asset between folders, including it's texture subdirectories. Blocking, run it in the bulk I/O pool."""
 
   if 1:
     # bk_logger.debug('copy asset')
@@ -328,31 +652,36 @@ async def check_existing(task) -> bool:
     return False  # this is because of some very old files where asset data had no files structure.
 
   file_paths = get_download_filepaths(task)
+  await globals.io_executor.run(make_asset_dirs, file_paths)
+  exist = [await globals.io_executor.run(os.path.isfile, file_path) for file_path in file_paths]
 
   # bk_logger.debug('check if file already exists' + str(file_names))
   if len(file_paths) == 2:
     # TODO this should check also for failed or running downloads.
     # If download is running, assign just the running thread. if download isn't running but the file is wrong size,
     #  delete file and restart download (or continue downoad? if possible.)
-    if os.path.isfile(file_paths[0]):  # and not os.path.isfile(file_names[1])
-      await copy_asset(file_paths[0], file_paths[1])
-    elif not os.path.isfile(file_paths[0]) and os.path.isfile(
-            file_paths[1]):  # only in case of changed settings or deleted/moved global dict.
-      await copy_asset(file_paths[1], file_paths[0])
+    if exist[0]:  # and not os.path.isfile(file_names[1])
+      await globals.io_executor.run_bulk(copy_asset, file_paths[0], file_paths[1])
+    elif exist[1]:  # only in case of changed settings or deleted/moved global dict.
+      await globals.io_executor.run_bulk(copy_asset, file_paths[1], file_paths[0])
+      exist[0] = True
 
-  if len(file_paths) > 0 and os.path.isfile(file_paths[0]):
+  if len(file_paths) > 0 and exist[0]:
     return True
 
   return False
 
 
 def delete_unfinished_file(file_path: str) -> None:
-  """Delete downloaded file if it wasn't finished. If the folder it's containing is empty, it also removes the directory."""
-
-  try:
-    os.remove(file_path)
-  except Exception as e:
-    print(e)
+  """Delete downloaded file if it wasn't finished, including its partial download. If the folder it's containing is empty, it also removes the directory."""
+
+  for path in (file_path, *get_part_paths(file_path)):
+    if not os.path.exists(path):
+      continue
+    try:
+      os.remove(path)
+    except Exception as e:
+      print(e)
   asset_dir = os.path.dirname(file_path)
-  if len(os.listdir(asset_dir)) == 0:
+  if os.path.isdir(asset_dir) and len(os.listdir(asset_dir)) == 0:
     os.rmdir(asset_dir)
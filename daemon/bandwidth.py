@@ -0,0 +1,137 @@
+"""Holds bandwidth shaping of the daemon's downloads with token buckets per traffic class."""
+
+import asyncio
+import time
+
+
+TRAFFIC_CLASSES = ('api_requests', 'small_thumbs', 'big_thumbs', 'assets')
+"""Traffic classes, same as the persistent sessions of the daemon."""
+BURST = 0.5
+"""Seconds of traffic a full bucket holds, so short bursts are not delayed."""
+ACTIVE_WINDOW = 1.0
+"""Seconds after its last download a class counts as active, active classes keep their rate for themselves."""
+
+
+class TokenBucket():
+  """Bucket of tokens (bytes) refilled at `rate` per second, holding at most `rate * BURST`.
+
+  Taking more tokens than there are puts the bucket into debt, so chunks bigger than the bucket pass too,
+  the next taker then waits until the debt is paid off.
+  """
+
+  def __init__(self, rate: float = 0):
+    self.rate = rate
+    self.tokens = rate * BURST
+    self.updated = time.monotonic()
+
+  def set_rate(self, rate: float):
+    self.refill()
+    self.rate = rate
+    self.tokens = min(self.tokens, self.capacity())
+
+  def capacity(self) -> float:
+    return self.rate * BURST
+
+  def refill(self, rate: float | None = None):
+    now = time.monotonic()
+    rate = self.rate if rate is None else rate
+    self.tokens = min(self.tokens + (now - self.updated) * rate, rate * BURST)
+    self.updated = now
+
+  def wait_time(self, rate: float | None = None) -> float:
+    """Get seconds until the bucket has tokens again."""
+
+    rate = self.rate if rate is None else rate
+    if self.tokens > 0:
+      return 0
+    if rate <= 0:
+      return ACTIVE_WINDOW  # no capacity to borrow now, check again once other classes may have gone idle
+    return -self.tokens / rate
+
+
+class BandwidthShaper():
+  """Limits download rate of each traffic class and of all classes together.
+
+  Each class has its own rate (0 is unlimited) and `total` caps all classes together (0 is unlimited).
+  With borrowing enabled, a class which used up its own tokens may use idle capacity: the rates of classes
+  which did not download anything for ACTIVE_WINDOW seconds and the part of `total` not given to any class.
+  So a bulk asset download gets the whole link while the UI is idle, but thumbnails and searches get their share
+  as soon as they need it.
+  """
+
+  def __init__(self, rates: dict[str, float] = {}, total: float = 0, borrow: bool = True):
+    self.buckets = {cls: TokenBucket(rates.get(cls, 0)) for cls in TRAFFIC_CLASSES}
+    self.total = TokenBucket(total)
+    self.spare = TokenBucket()
+    self.borrow = borrow
+    self.last_active = {cls: 0.0 for cls in TRAFFIC_CLASSES}
+    self.waiting = {cls: 0 for cls in TRAFFIC_CLASSES}
+
+  def configure(self, rates: dict | None = None, total: float | None = None, borrow: bool | None = None):
+    """Change limits at runtime, rates are in bytes per second."""
+
+    if rates is not None:
+      for cls, rate in rates.items():
+        if cls in self.buckets:
+          self.buckets[cls].set_rate(max(float(rate), 0))
+    if total is not None:
+      self.total.set_rate(max(float(total), 0))
+    if borrow is not None:
+      self.borrow = bool(borrow)
+
+  def get_config(self) -> dict:
+    return {
+      'rates': {cls: bucket.rate for cls, bucket in self.buckets.items()},
+      'total': self.total.rate,
+      'borrow': self.borrow,
+      'waiting': dict(self.waiting),
+    }
+
+  def spare_rate(self) -> float:
+    """Get rate which can be borrowed: capacity of the link minus the rates kept by active classes."""
+
+    rates = [bucket.rate for bucket in self.buckets.values()]
+    capacity = self.total.rate if self.total.rate > 0 else sum(rates)
+    now = time.monotonic()
+    kept = sum(bucket.rate for cls, bucket in self.buckets.items() if now - self.last_active[cls] < ACTIVE_WINDOW)
+    return max(capacity - kept, 0)
+
+  async def consume(self, cls: str, size: int):
+    """Account `size` downloaded bytes to the class, waits while the class is over its limit.
+
+    Called after each received chunk, waiting stops reading from the connection, so TCP slows the sender down.
+    """
+
+    bucket = self.buckets[cls]
+    self.last_active[cls] = time.monotonic()
+    if bucket.rate <= 0 and self.total.rate <= 0:
+      return
+
+    self.waiting[cls] += 1
+    try:
+      while True:
+        bucket.refill()
+        self.total.refill()
+        spare_rate = self.spare_rate()
+        self.spare.refill(spare_rate)
+        total_ok = self.total.rate <= 0 or self.total.tokens > 0
+        if total_ok and (bucket.rate <= 0 or bucket.tokens > 0):
+          if bucket.rate > 0:
+            bucket.tokens -= size
+          break
+        if total_ok and self.borrow and bucket.rate > 0 and self.spare.tokens > 0:
+          self.spare.tokens -= size
+          break
+
+        wait = bucket.wait_time() if bucket.rate > 0 else 0
+        if self.borrow and bucket.rate > 0:
+          wait = min(wait, self.spare.wait_time(spare_rate))
+        if not total_ok:
+          wait = max(wait, self.total.wait_time())
+        await asyncio.sleep(max(wait, 0.001))
+        self.last_active[cls] = time.monotonic()
+    finally:
+      self.waiting[cls] -= 1
+
+    if self.total.rate > 0:
+      self.total.tokens -= size
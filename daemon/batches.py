@@ -0,0 +1,62 @@
+"""Holds batches of downloads and searches submitted together on /batch."""
+
+import tasks
+
+
+class Batch():
+  """Aggregates tasks submitted in one batch into one task of type 'batch', reported to the app like any other task.
+
+  Progress of the batch task is the average progress of its items, done items count as 100.
+  The batch task finishes when all items finished, errored or were cancelled, its result then counts the outcomes
+  and holds messages of the errored items.
+  """
+
+  def __init__(self, task: tasks.Task):
+    self.task = task
+    self.items: dict[str, tasks.Task] = {}  # task_id: item task
+    self.progress: dict[str, int] = {}  # task_id: progress of items still running
+    self.outcomes = {status: 0 for status in tasks.TERMINAL_STATUSES}
+    self.errors: dict[str, str] = {}  # task_id: error message
+
+  def add(self, item: tasks.Task):
+    item.data['batch_id'] = self.task.task_id
+    self.items[item.task_id] = item
+    self.progress[item.task_id] = 0
+
+  def item_changed(self, item: tasks.Task):
+    """Update the aggregate progress with the change of the item."""
+
+    if item.task_id not in self.progress:
+      return  # already done
+    if item.status in tasks.TERMINAL_STATUSES:
+      del self.progress[item.task_id]
+      self.outcomes[item.status] += 1
+      if item.status == 'error':
+        self.errors[item.task_id] = item.message
+    elif item.progress == self.progress[item.task_id]:
+      return
+    else:
+      self.progress[item.task_id] = item.progress
+
+    total = len(self.items)
+    done = total - len(self.progress)
+    progress = int((done * 100 + sum(self.progress.values())) / total)
+    message = f'{done} of {total} done'
+    if len(self.progress) > 0:
+      self.task.change_progress(progress, message)
+      return
+
+    self.task.result = {**self.outcomes, 'errors': self.errors}
+    self.task.progress = 100
+    if self.outcomes['finished'] == total:
+      self.task.finished(message)
+    elif self.outcomes['cancelled'] == total:
+      self.task.cancelled('Batch cancelled')
+    else:
+      self.task.error(f"{message}, {self.outcomes['error']} failed, {self.outcomes['cancelled']} cancelled")
+
+  def cancel(self):
+    """Cancel all items which are still running."""
+
+    for task_id in list(self.progress):
+      self.items[task_id].cancel()
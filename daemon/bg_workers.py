@@ -0,0 +1,198 @@
+"""Holds pool of background Blender processes running unpack and resolution jobs.
+
+Also imported by the add-on (for RESULT_PREFIX), so it must not import modules of the daemon.
+"""
+
+import asyncio
+import json
+import os
+import time
+
+
+RESULT_PREFIX = 'BLENDERKIT_JOB_RESULT '
+"""Prefix of the stdout line with the result of a job, other lines are regular output of Blender."""
+PING_TIMEOUT = 10
+"""Seconds an idle worker has to answer the health check before it is replaced."""
+STOP_TIMEOUT = 5
+"""Seconds a worker has to quit after its stdin is closed before it is killed."""
+
+
+class BlenderWorker():
+  """Background Blender process running `resolutions_bg.py --worker`, which runs jobs sent as JSON lines to its stdin."""
+
+  def __init__(self, binary_path: str, script_path: str):
+    self.binary_path = binary_path
+    self.script_path = script_path
+    self.process: asyncio.subprocess.Process | None = None
+    self.jobs_done = 0
+    self.last_used = time.time()
+    self.killed = False
+
+  async def start(self, creationflags: int = 0):
+    self.process = await asyncio.create_subprocess_exec(
+      self.binary_path,
+      "--background",
+      "-noaudio",
+      "--python", self.script_path,
+      "--", "--worker",
+      stdin=asyncio.subprocess.PIPE,
+      stdout=asyncio.subprocess.PIPE,
+      limit=2 ** 20,
+      creationflags=creationflags,
+    )
+
+  def is_alive(self) -> bool:
+    return self.process is not None and self.process.returncode is None and not self.killed
+
+  async def run(self, job: dict) -> dict:
+    """Send the job to the worker and wait for its result: {'ok': bool, 'error': str}.
+
+    Output of Blender is passed to stdout of the daemon. Raises ConnectionError if the worker died.
+    If the output can't be read (a line over the stream limit, a malformed result), the worker is killed and the job fails.
+    Health checks (ping) don't count into jobs_done.
+    """
+
+    self.process.stdin.write(json.dumps(job).encode() + b'\n')
+    await self.process.stdin.drain()
+    while True:
+      try:
+        line = await self.process.stdout.readline()
+        if line == b'':
+          raise ConnectionError(f'Blender worker exited with code {await self.process.wait()}')
+        text = line.decode(errors='replace').rstrip()
+        if text.startswith(RESULT_PREFIX):
+          result = json.loads(text[len(RESULT_PREFIX):])
+          if job.get('command') != 'ping':
+            self.jobs_done += 1
+          self.last_used = time.time()
+          return result
+      except (ValueError, asyncio.LimitOverrunError) as e:  # JSONDecodeError is a ValueError
+        self.kill()
+        return {'ok': False, 'error': f'unreadable output of Blender worker: {e}'}
+      print(text)
+
+  async def ping(self) -> bool:
+    """Check the worker is alive and responding."""
+
+    if not self.is_alive():
+      return False
+    try:
+      result = await asyncio.wait_for(self.run({'command': 'ping'}), PING_TIMEOUT)
+    except (asyncio.TimeoutError, ConnectionError, OSError):
+      return False
+    return result.get('ok', False)
+
+  async def stop(self):
+    """Let the worker finish by closing its stdin, kill it if it does not quit in time."""
+
+    if not self.is_alive():
+      return
+    try:
+      self.process.stdin.close()
+      await asyncio.wait_for(self.process.wait(), STOP_TIMEOUT)
+    except (asyncio.TimeoutError, OSError):
+      self.kill()
+
+  def kill(self):
+    if self.is_alive():
+      self.process.kill()
+    self.killed = True
+
+
+class WorkerPool():
+  """Keeps background Blender workers warm, so jobs don't pay the startup of Blender.
+
+  At most `size` workers run at once, further jobs wait. Workers are kept per Blender binary.
+  A worker is health checked before it gets a job, recycled after `max_jobs` jobs,
+  stopped after `idle_timeout` seconds without a job and killed when its job is cancelled or fails.
+  """
+
+  def __init__(self, size: int = 2, max_jobs: int = 20, idle_timeout: float = 300, creationflags: int = 0):
+    self.size = size
+    self.max_jobs = max_jobs
+    self.idle_timeout = idle_timeout
+    self.idle: dict[str, list[BlenderWorker]] = {}  # binary path: idle workers
+    self.running = 0
+    self.condition = asyncio.Condition()
+    self.script_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "resolutions_bg.py")
+    self.creationflags = creationflags
+
+  def configure(self, size: int | None = None, max_jobs: int | None = None, idle_timeout: float | None = None):
+    if size is not None:
+      self.size = max(int(size), 1)
+    if max_jobs is not None:
+      self.max_jobs = max(int(max_jobs), 1)
+    if idle_timeout is not None:
+      self.idle_timeout = float(idle_timeout)
+
+  def get_config(self) -> dict:
+    return {
+      'size': self.size,
+      'max_jobs': self.max_jobs,
+      'idle_timeout': self.idle_timeout,
+      'running': self.running,
+      'idle': sum(len(workers) for workers in self.idle.values()),
+    }
+
+  async def run(self, binary_path: str, job: dict) -> dict:
+    """Run the job on a warm worker (or a new one if none is idle) and return its result."""
+
+    async with self.condition:
+      await self.condition.wait_for(lambda: self.running < self.size)
+      self.running += 1
+    worker = None
+    try:
+      worker = await self._get_worker(binary_path)
+      result = await worker.run(job)
+      if not worker.is_alive():
+        return result  # killed because its output could not be read
+    except BaseException:
+      if worker is not None:
+        worker.kill()
+      raise
+    finally:
+      async with self.condition:
+        self.running -= 1
+        self.condition.notify()
+
+    if worker.jobs_done >= self.max_jobs:
+      await worker.stop()
+    else:
+      self.idle.setdefault(binary_path, []).append(worker)
+    return result
+
+  async def evict_idle(self):
+    """Stop workers idle for longer than idle_timeout."""
+
+    now = time.time()
+    for binary_path, workers in list(self.idle.items()):
+      for worker in [w for w in workers if now - w.last_used > self.idle_timeout]:
+        workers.remove(worker)
+        await worker.stop()
+      if len(workers) == 0:
+        del self.idle[binary_path]
+
+  def shutdown(self):
+    for workers in self.idle.values():
+      for worker in workers:
+        worker.kill()
+    self.idle.clear()
+
+  async def _get_worker(self, binary_path: str) -> BlenderWorker:
+    workers = self.idle.get(binary_path, [])
+    while len(workers) > 0:
+      worker = workers.pop()
+      if await worker.ping():
+        return worker
+      worker.kill()
+
+    # keep the number of processes within size, idle workers of other Blender binaries make room
+    idle = [w for workers in self.idle.values() for w in workers]
+    if len(idle) > 0 and len(idle) + self.running > self.size:
+      oldest = min(idle, key=lambda w: w.last_used)
+      self.idle[oldest.binary_path].remove(oldest)
+      await oldest.stop()
+
+    worker = BlenderWorker(binary_path, self.script_path)
+    await worker.start(self.creationflags)
+    return worker
@@ -2,35 +2,41 @@
 
 import argparse
 import asyncio
+import json
 import os
-import ssl
+import socket
 import sys
+import tempfile
 import time
 import uuid
-from ssl import Purpose
+from typing import TYPE_CHECKING
 
 import aiohttp
-import assets
-import certifi
 import globals
+import metrics
 import tasks
+import tracing
 from aiohttp import web, web_request
 
-import search
+if TYPE_CHECKING:
+  import assets
+  import batches
+  import delta_reports
+  import search
 
 
 async def download_asset(request: web_request.Request):
   """Handle request for download of asset."""
 
   data = await request.json()
-  task_id = str(uuid.uuid4())
+  task_id = data.get('task_id') or str(uuid.uuid4())  # the add-on generates task_id when it doesn't wait for the response
   data['task_id'] = task_id #mozna k nicemu
 
   app_id = data['app_id']
   del data['app_id']
   
   task = tasks.Task(data, task_id, app_id, 'asset_download', message='Looking for asset')
-  globals.tasks.append(task)
+  globals.tasks.add(task)
   task.async_task = asyncio.ensure_future(assets.do_asset_download(request, task))
   
   return web.json_response({'task_id': task_id})
@@ -40,13 +46,95 @@ async def search_assets(request: web_request.Request):
   """Handle request for download of asset."""
 
   data = await request.json()
-  task_id = str(uuid.uuid4())
+  task_id = data.get('task_id') or str(uuid.uuid4())
   data['task_id'] = task_id #mozna k nicemu
   asyncio.ensure_future(search.do_search(request, data, task_id))
 
   return web.json_response({'task_id': task_id})
 
 
+async def batch(request: web_request.Request):
+  """Handle request for many downloads and searches at once, e.g. when populating a scene from a manifest.
+
+  Posted JSON: {'app_id': ..., 'downloads': [data], 'searches': [data], 'shared': data}
+  Every item is the same data as posted to /download_asset or /search_asset, keys of `shared` (e.g. PREFS)
+  are added to all items, so they are sent only once. Downloads have 'background' priority unless they set their own.
+  Download URLs are resolved for all items right away, while the scheduler lets the downloads through,
+  so resolving the next URLs overlaps the running downloads.
+
+  The client may choose the batch_id ('task_id') and task_ids of the items ('task_id' of each item), like for single tasks.
+  Responds with the batch_id and task_ids of the items in the order of the request. Progress of the whole batch
+  is reported as a task of type 'batch' with the batch_id as its task_id, items are reported as usual and carry the batch_id in their data.
+  """
+
+  data = await request.json()
+  app_id = data['app_id']
+  shared = data.get('shared', {})
+  batch_task = tasks.Task({}, data.get('task_id') or str(uuid.uuid4()), app_id, 'batch', message='Starting batch')
+  current = batches.Batch(batch_task)
+
+  items = []
+  for item_data in data.get('downloads', []):
+    item_data = {'priority': 'background', **shared, **item_data}
+    task = tasks.Task(item_data, item_data.get('task_id') or str(uuid.uuid4()), app_id, 'asset_download', message='Looking for asset')
+    items.append((task, assets.do_asset_download(request, task)))
+  for item_data in data.get('searches', []):
+    task = tasks.Task({**shared, **item_data}, item_data.get('task_id') or str(uuid.uuid4()), app_id, 'batch_search', message='Searching assets')
+    items.append((task, search.do_batch_search(request, task)))
+  if len(items) == 0:
+    return web.json_response({'error': 'Batch has no downloads or searches'}, status=400)
+
+  for task, _ in items:
+    current.add(task)
+  globals.batches[batch_task.task_id] = current
+  globals.tasks.add(batch_task)
+  for task, coroutine in items:
+    task.data['task_id'] = task.task_id
+    globals.tasks.add(task)
+    task.async_task = asyncio.ensure_future(run_batch_item(task, coroutine))
+
+  return web.json_response({
+    'batch_id': batch_task.task_id,
+    'downloads': [task.task_id for task, _ in items if task.task_type == 'asset_download'],
+    'searches': [task.task_id for task, _ in items if task.task_type == 'batch_search'],
+  })
+
+
+async def run_batch_item(task: tasks.Task, coroutine):
+  """Run item of a batch, make sure it ends in a terminal status, so the batch always finishes."""
+
+  try:
+    await coroutine
+  except asyncio.CancelledError:
+    if task.status not in tasks.TERMINAL_STATUSES:
+      task.cancelled('Cancelled')
+  except Exception as e:
+    print(f'Batch item {task.task_id} failed: {e}')
+    task.error(f'{type(e).__name__}: {e}')
+  else:
+    if task.status not in tasks.TERMINAL_STATUSES:
+      task.error('Task ended without result')
+
+
+async def download_thumbnail(request: web_request.Request):
+  """Handle request for download of a single thumbnail."""
+
+  data = await request.json()
+  task_id = data.get('task_id') or str(uuid.uuid4())
+  await search.download_thumbnail(request, data, task_id)
+
+  return web.json_response({'task_id': task_id})
+
+
+async def thumbnails_visible(request: web_request.Request):
+  """Handle report of assets visible in the asset bar, their thumbnails are downloaded first."""
+
+  data = await request.json()
+  search.get_thumbnail_queue(request.app, data['app_id']).set_visible(data['assetBaseIds'])
+
+  return web.Response(text="ok")
+
+
 async def index(request: web_request.Request):
   """Report PID of server as Index page, can be used as is-alive endpoint."""
 
@@ -55,41 +143,307 @@ async def index(request: web_request.Request):
 
 
 async def kill_download(request):
-  """Handle request for kill of task with the task_id."""
+  """Handle request for kill of task with the task_id.
+  The download is cancelled, its partial file removed and the task reported with status cancelled.
+  If the task_id is a batch_id, all running items of the batch are cancelled.
+  """
 
   data = await request.json()
 
-  for i, task in enumerate(globals.tasks):
-    if data['task_id'] == task.task_id:
-      #globals.tasks[i].cancel() #needs to handle cleaning when download is cancelled
-      del globals.tasks[i]
-      break
+  task = globals.tasks.get(data['task_id'])
+  if task is not None:
+    task.cancel()
+  current = globals.batches.get(data['task_id'])
+  if current is not None:
+    current.cancel()
 
   return web.Response(text="ok")
 
 
-async def report(request: web_request.Request):
-  """Report progress of all tasks for a given app_id. Clears list of tasks."""
+def register_app(app_id):
+  """Remember the app as active, so the daemon knows whom it serves."""
 
   globals.last_report_time = time.time()
+  if app_id not in globals.active_apps:
+    globals.active_apps.append(app_id)
 
-  data = await request.json()
-  #check if the app was already active
-  if data['app_id'] not in globals.active_apps:
-    globals.active_apps.append(data['app_id'])
 
-  reports = list()
-  for task in globals.tasks:
-    if task.app_id != data['app_id']:
-      continue
+def collect_reports(app_id) -> tuple[list, list]:
+  """Get serialized reports of all tasks for the given app_id and the finished, errored or cancelled tasks which can be removed once the reports are delivered."""
 
+  reports = list()
+  done_tasks = list()
+  for task in globals.tasks.for_app(app_id):
     reports.append(task.to_seriazable_object())
-    if task.status == "finished":
-      globals.tasks.remove(task)
+    if task.status in tasks.TERMINAL_STATUSES:
+      done_tasks.append(task)
+
+  return reports, done_tasks
+
+
+def get_app_reports(app_id) -> 'delta_reports.AppReports':
+  """Get state of delta reports of the app, create it if it doesn't exist yet."""
+
+  app_reports = globals.app_reports.get(app_id)
+  if app_reports is None:
+    app_reports = globals.app_reports[app_id] = delta_reports.AppReports()
+  return app_reports
+
+
+def remove_tasks(tsks: list):
+  """Remove delivered tasks from the registry of tasks."""
+
+  for task in tsks:
+    globals.tasks.remove(task)
+
+
+def on_task_change(task: tasks.Task):
+  """Keep the registry up to date, mirror progress to coalesced downloads and to the batch of the task
+  and wake up the report stream of the app which owns the task.
+  """
+
+  globals.tasks.task_changed(task)
+  assets.mirror_to_followers(task)
+  current = globals.batches.get(task.data.get('batch_id'))
+  if current is not None:
+    current.item_changed(task)
+    if current.task.status in tasks.TERMINAL_STATUSES:
+      del globals.batches[current.task.task_id]
+  event = globals.report_events.get(task.app_id)
+  if event is not None:
+    event.set()
+
+
+async def report(request: web_request.Request):
+  """Report progress of all tasks for a given app_id. Clears list of tasks.
+
+  If the request has 'ack' (number of the last report the app processed, 0 if none), the response is
+  {'seq': number of this report, 'tasks': [full snapshot or changed fields of a task]} with only the tasks changed
+  since the acknowledged report, see delta_reports.AppReports. Otherwise it is a list of full snapshots of all tasks.
+  """
+
+  data = await request.json()
+  register_app(data['app_id'])
+
+  if 'ack' in data:
+    app_reports = get_app_reports(data['app_id'])
+    app_reports.ack(data['ack'])
+    seq, reports, done_tasks = app_reports.collect(globals.tasks.for_app(data['app_id']))
+    remove_tasks(done_tasks)
+    return web.json_response({'seq': seq, 'tasks': reports})
+
+  reports, done_tasks = collect_reports(data['app_id'])
+  remove_tasks(done_tasks)
 
   return web.json_response(reports)
 
 
+async def report_stream(request: web_request.Request):
+  """Stream reports of all tasks for a given app_id as newline delimited JSON.
+
+  Every line is a list of reports, same as the response of /report, pushed as soon as any task of the app changes.
+  Empty lines are sent as a heartbeat when nothing happens. Finished, errored and cancelled tasks are removed once their report is written.
+  If the request has 'delta': True, the first line has full snapshots of all tasks and further lines only the changes, see delta_reports.AppReports.
+  """
+
+  data = await request.json()
+  app_id = data['app_id']
+  register_app(app_id)
+  delta = data.get('delta', False)
+  if delta:
+    get_app_reports(app_id).reset()
+
+  event = asyncio.Event()
+  event.set()  # send the tasks which are already waiting
+  globals.report_events[app_id] = event
+
+  response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+  await response.prepare(request)
+  try:
+    while True:
+      try:
+        await asyncio.wait_for(event.wait(), timeout=globals.STREAM_HEARTBEAT)
+        await asyncio.sleep(globals.STREAM_COALESCE)
+      except asyncio.TimeoutError:
+        pass
+      event.clear()
+      globals.last_report_time = time.time()
+
+      if delta:
+        _, reports, done_tasks = get_app_reports(app_id).collect(globals.tasks.for_app(app_id), acked=True)
+      else:
+        reports, done_tasks = collect_reports(app_id)
+      if len(reports) == 0:
+        await response.write(b'\n')
+        remove_tasks(done_tasks)  # delivered by an earlier report
+        continue
+
+      await response.write(json.dumps(reports).encode() + b'\n')
+      remove_tasks(done_tasks)
+  except ConnectionResetError:
+    pass
+  finally:
+    if globals.report_events.get(app_id) is event:
+      del globals.report_events[app_id]
+
+  return response
+
+
+def int_values(value: dict) -> dict:
+  return {str(key): int(item) for key, item in value.items()}
+
+
+def float_values(value: dict) -> dict:
+  return {str(key): float(item) for key, item in value.items()}
+
+
+def strict_bool(value) -> bool:
+  if not isinstance(value, bool):
+    raise ValueError(f'expected true or false, got {value!r}')
+  return value
+
+
+CONFIG_KEYS = {
+  'scheduler': {'limits': int_values, 'total_limit': int, 'app_weights': int_values},
+  'search_cache': {'ttl': float, 'stale_ttl': float, 'max_entries': int},
+  'prefetch': {'depth': int},
+  'segments': {'count': int, 'threshold': int},
+  'thumbnail_cache': {'max_size': int},
+  'worker_pool': {'size': int, 'max_jobs': int, 'idle_timeout': float},
+  'bandwidth': {'rates': float_values, 'total': float, 'borrow': strict_bool},
+}
+"""Keys accepted in each section of posted configuration with functions converting their values."""
+
+
+def parse_config(data) -> dict:
+  """Get posted configuration with all values converted, raises ValueError for unknown sections, keys or bad values.
+  Everything is converted before anything is applied, so invalid configuration leaves the daemon unchanged.
+  """
+
+  if not isinstance(data, dict):
+    raise ValueError('Configuration must be an object')
+  parsed = {}
+  for section, values in data.items():
+    if section not in CONFIG_KEYS:
+      raise ValueError(f'Unknown configuration section {section!r}')
+    if not isinstance(values, dict):
+      raise ValueError(f'Configuration section {section!r} must be an object')
+    unknown = [key for key in values if key not in CONFIG_KEYS[section]]
+    if unknown:
+      raise ValueError(f'Unknown keys {unknown} in configuration section {section!r}, expected some of {list(CONFIG_KEYS[section])}')
+    parsed[section] = {}
+    for key, value in values.items():
+      if value is None:
+        continue
+      try:
+        parsed[section][key] = CONFIG_KEYS[section][key](value)
+      except (TypeError, ValueError, AttributeError) as e:
+        raise ValueError(f'Invalid value of {section}.{key}: {e}')
+  return parsed
+
+
+def apply_config(data: dict):
+  """Change configuration of daemon services, data must be converted by parse_config() first."""
+
+  if 'scheduler' in data:
+    globals.scheduler.configure(**data['scheduler'])
+  if 'search_cache' in data:
+    globals.search_cache.configure(**data['search_cache'])
+  if 'prefetch' in data:
+    globals.prefetch_depth = max(data['prefetch'].get('depth', globals.prefetch_depth), 0)
+  if 'segments' in data:
+    globals.segment_count = max(data['segments'].get('count', globals.segment_count), 1)
+    globals.segment_threshold = max(data['segments'].get('threshold', globals.segment_threshold), 0)
+  if 'thumbnail_cache' in data:
+    globals.thumbnail_cache.configure(**data['thumbnail_cache'])
+  if 'worker_pool' in data:
+    globals.worker_pool.configure(**data['worker_pool'])
+  if 'bandwidth' in data:
+    globals.bandwidth.configure(**data['bandwidth'])
+
+
+async def config(request: web_request.Request):
+  """Get (GET) or change (POST) runtime configuration of the daemon. Only the posted keys are changed.
+
+  scheduler - concurrency of asset downloads: {'limits': {class: n}, 'total_limit': n, 'app_weights': {app_id: weight}}
+  search_cache - caching of search responses: {'ttl': seconds, 'stale_ttl': seconds, 'max_entries': n}
+  prefetch - look-ahead of search results: {'depth': number of next pages, 0 disables prefetching}
+  segments - segmented download of big asset files: {'count': concurrent range requests, 1 disables it, 'threshold': bytes}
+  thumbnail_cache - downloaded thumbnails: {'max_size': bytes}
+  worker_pool - background Blender workers: {'size': n, 'max_jobs': jobs before a worker is recycled, 'idle_timeout': seconds}
+  bandwidth - download rates in bytes per second, 0 is unlimited: {'rates': {class: rate}, 'total': rate of all classes, 'borrow': bool}
+  Unknown sections or keys and values of wrong types are rejected with 400, nothing is changed then.
+  """
+
+  if request.method == 'POST':
+    try:
+      data = await request.json()
+    except ValueError:
+      return web.json_response({'error': 'Configuration is not valid JSON'}, status=400)
+    try:
+      parsed = parse_config(data)
+    except ValueError as e:
+      return web.json_response({'error': str(e)}, status=400)
+    apply_config(parsed)
+
+  return web.json_response({
+    'scheduler': globals.scheduler.get_config(),
+    'search_cache': globals.search_cache.get_config(),
+    'prefetch': {'depth': globals.prefetch_depth},
+    'segments': {'count': globals.segment_count, 'threshold': globals.segment_threshold},
+    'thumbnail_cache': globals.thumbnail_cache.get_config(),
+    'worker_pool': globals.worker_pool.get_config(),
+    'bandwidth': globals.bandwidth.get_config(),
+  })
+
+
+
+SESSIONS = {
+  'api_requests': 'SESSION_API_REQUESTS',
+  'small_thumbs': 'SESSION_SMALL_THUMBS',
+  'big_thumbs': 'SESSION_BIG_THUMBS',
+  'assets': 'SESSION_ASSETS',
+}
+"""Labels of the persistent sessions in metrics."""
+
+
+def update_gauges(app: web.Application):
+  """Compute gauges describing the current state: tasks, connection pools and the download scheduler."""
+
+  metrics.clear_gauge('blenderkit_tasks')
+  counts = {}
+  for task in globals.tasks:
+    counts[(task.task_type, task.status)] = counts.get((task.task_type, task.status), 0) + 1
+  for (task_type, status), count in counts.items():
+    metrics.set_gauge('blenderkit_tasks', count, type=task_type, status=status)
+
+  for label, key in SESSIONS.items():
+    connector = app[key].connector
+    waiters = getattr(connector, '_waiters', {})
+    metrics.set_gauge('blenderkit_connector_limit', connector.limit, session=label)
+    metrics.set_gauge('blenderkit_connector_in_use', len(getattr(connector, '_acquired', ())), session=label)
+    metrics.set_gauge('blenderkit_connector_waiting', sum(len(w) for w in waiters.values()), session=label)
+
+  for cls, running in globals.scheduler.running.items():
+    metrics.set_gauge('blenderkit_scheduler_running', running, priority=cls)
+    metrics.set_gauge('blenderkit_scheduler_waiting', sum(len(q) for q in globals.scheduler.queues[cls].values()), priority=cls)
+
+
+async def get_metrics(request: web_request.Request):
+  """Get metrics of the daemon in Prometheus text format, or as JSON with ?format=json."""
+
+  update_gauges(request.app)
+  if request.query.get('format') == 'json':
+    return web.json_response(metrics.to_json())
+  return web.Response(text=metrics.to_prometheus(), content_type='text/plain')
+
+
+async def get_trace(request: web_request.Request):
+  """Get spans of tasks as Chrome trace JSON. Only spans of one task with ?task_id=..."""
+
+  return web.json_response(tracing.to_chrome_trace(tracing.get_events(request.query.get('task_id'))))
+
+
 class Shutdown(web.View):
   """Shedules shutdown of the server."""
 
@@ -102,7 +456,42 @@ class Shutdown(web.View):
     sys.exit()
 
 
+def shaping_trace(traffic_class: str) -> aiohttp.TraceConfig:
+  """Get trace config accounting bodies read at once (resp.read(), resp.json()) to the traffic class of the session.
+  Streamed bodies are accounted chunk by chunk in the download loops.
+  """
+
+  async def on_response_chunk_received(session, context, params):
+    await globals.bandwidth.consume(traffic_class, len(params.chunk))
+
+  trace_config = aiohttp.TraceConfig()
+  trace_config.on_response_chunk_received.append(on_response_chunk_received)
+  return trace_config
+
+
+def import_features():
+  """Import the modules handling downloads, searches, batches and reports. Called on startup of the server after the services
+  are created, so they don't delay the listening socket. Modules needed before that (tasks, metrics, tracing) are imported above.
+  """
+
+  global assets, batches, delta_reports, search
+  import assets
+  import batches
+  import delta_reports
+  import search
+
+
 async def persistent_sessions(app):
+  globals.create_services()
+  import_features()
+  mark_startup_phase('services')
+
+  # imported on first use, so they don't delay startup of the server before the sessions are made
+  import ssl
+  from ssl import Purpose
+
+  import certifi
+
   sslcontext = ssl.SSLContext(protocol=ssl.PROTOCOL_TLS_CLIENT)
   
   if app['PROXY_CA_CERTS'] != '':
@@ -118,17 +507,18 @@ async def persistent_sessions(app):
   else:
     trust_env = False
 
-  conn_api_requests = aiohttp.TCPConnector(ssl=sslcontext, limit=64)
-  app['SESSION_API_REQUESTS'] = session_api_requests = aiohttp.ClientSession(connector=conn_api_requests, trust_env=trust_env)
+  conn_api_requests = aiohttp.TCPConnector(ssl=sslcontext, limit=globals.CONNECTOR_LIMITS['api_requests'])
+  app['SESSION_API_REQUESTS'] = session_api_requests = aiohttp.ClientSession(connector=conn_api_requests, trust_env=trust_env, trace_configs=[shaping_trace('api_requests')])
 
-  conn_small_thumbs = aiohttp.TCPConnector(ssl=sslcontext, limit=16)
-  app['SESSION_SMALL_THUMBS'] = session_small_thumbs = aiohttp.ClientSession(connector=conn_small_thumbs, trust_env=trust_env)
+  conn_small_thumbs = aiohttp.TCPConnector(ssl=sslcontext, limit=globals.CONNECTOR_LIMITS['small_thumbs'])
+  app['SESSION_SMALL_THUMBS'] = session_small_thumbs = aiohttp.ClientSession(connector=conn_small_thumbs, trust_env=trust_env, trace_configs=[shaping_trace('small_thumbs')])
   
-  conn_big_thumbs = aiohttp.TCPConnector(ssl=sslcontext, limit=4)
-  app['SESSION_BIG_THUMBS'] = session_big_thumbs = aiohttp.ClientSession(connector=conn_big_thumbs, trust_env=trust_env)
+  conn_big_thumbs = aiohttp.TCPConnector(ssl=sslcontext, limit=globals.CONNECTOR_LIMITS['big_thumbs'])
+  app['SESSION_BIG_THUMBS'] = session_big_thumbs = aiohttp.ClientSession(connector=conn_big_thumbs, trust_env=trust_env, trace_configs=[shaping_trace('big_thumbs')])
 
-  conn_assets = aiohttp.TCPConnector(ssl=sslcontext, limit=2)
-  app['SESSION_ASSETS'] = session_assets = aiohttp.ClientSession(connector=conn_assets, trust_env=trust_env)
+  conn_assets = aiohttp.TCPConnector(ssl=sslcontext, limit=globals.CONNECTOR_LIMITS['assets'])
+  app['SESSION_ASSETS'] = session_assets = aiohttp.ClientSession(connector=conn_assets, trust_env=trust_env, trace_configs=[shaping_trace('assets')])
+  mark_startup_phase('sessions')
 
   yield
   await asyncio.gather(
@@ -144,6 +534,8 @@ async def persistent_sessions(app):
     conn_assets.close(),
     session_assets.close(),
   )
+  globals.io_executor.shutdown()
+  globals.worker_pool.shutdown()
 
 async def should_i_live(app: web.Application):
   while True:
@@ -157,12 +549,103 @@ async def report_blender_quit(request: web_request.Request):
   data = await request.json()
   if data['app_id'] in globals.active_apps:
     globals.active_apps.remove(data['app_id'])
+  globals.app_reports.pop(data['app_id'], None)
   if len(globals.active_apps)==0:
     print('no more apps to serve, exiting Daemon')
     sys.exit() #we should handle this more nicely
 
+async def evict_tasks(app: web.Application):
+  """Periodically evict old finished and errored tasks which were never reported, e.g. because the app quit.
+  Also stops background Blender workers idle for too long.
+  """
+
+  while True:
+    await asyncio.sleep(globals.EVICTION_INTERVAL)
+    globals.tasks.evict()
+    await globals.worker_pool.evict_idle()
+
+async def sync_thumbnail_cache(app: web.Application):
+  """Periodically write changes of the thumbnail index to disk, merged with changes of other daemons.
+  Less often, thumbnails deleted from disk are dropped from the index.
+  """
+
+  last_check = time.monotonic()
+  while True:
+    await asyncio.sleep(globals.THUMBNAIL_INDEX_SYNC)
+    if time.monotonic() - last_check > globals.THUMBNAIL_INDEX_CHECK:
+      last_check = time.monotonic()
+      await globals.thumbnail_cache.check()
+    if globals.thumbnail_cache.dirty:
+      await globals.thumbnail_cache.sync()
+
+async def measure_loop_lag(app: web.Application):
+  """Periodically measure how late the event loop wakes up, high lag means something blocks the loop."""
+
+  while True:
+    start = time.perf_counter()
+    await asyncio.sleep(globals.LOOP_LAG_INTERVAL)
+    metrics.observe('blenderkit_event_loop_lag_seconds', max(time.perf_counter() - start - globals.LOOP_LAG_INTERVAL, 0))
+
 async def start_background_tasks(app: web.Application):
   app['should_i_live'] = asyncio.create_task(should_i_live(app))
+  app['evict_tasks'] = asyncio.create_task(evict_tasks(app))
+  app['sync_thumbnail_cache'] = asyncio.create_task(sync_thumbnail_cache(app))
+  app['measure_loop_lag'] = asyncio.create_task(measure_loop_lag(app))
+
+def mark_startup_phase(phase: str):
+  """Record duration of the startup phase which just ended. Phases follow each other from the launch by the add-on."""
+
+  global startup_mark
+  now = time.time()
+  globals.startup_phases[phase] = round(now - startup_mark, 4)
+  metrics.set_gauge('blenderkit_startup_seconds', now - startup_mark, phase=phase)
+  startup_mark = now
+
+async def write_ready_file(app: web.Application):
+  """Tell the add-on the server is ready by writing the ready file, the add-on waits for it instead of probing the server.
+  The socket is listening since the start, requests sent before the server serves them wait in its backlog.
+  """
+
+  mark_startup_phase('ready')
+  print(f'Daemon ready, startup phases (seconds): {globals.startup_phases}')
+  if app['READY_FILE'] == '':
+    return
+  tmp_path = f"{app['READY_FILE']}.{os.getpid()}.tmp"
+  with open(tmp_path, 'w', encoding='utf-8') as f:
+    json.dump({'pid': os.getpid(), 'port': app['PORT'], 'phases': globals.startup_phases}, f)
+  os.replace(tmp_path, app['READY_FILE'])
+
+async def remove_ready_file(app: web.Application):
+  if app['READY_FILE'] != '' and os.path.exists(app['READY_FILE']):
+    os.remove(app['READY_FILE'])
+
+def listen_unix_socket(port: str) -> socket.socket | None:
+  """Listen also on a Unix domain socket (Linux and macOS), readable only by the user. Returns None where not supported."""
+
+  if os.name != 'posix' or not hasattr(socket, 'AF_UNIX'):
+    return None
+  socket_path = os.path.join(tempfile.gettempdir(), f'blenderkit-daemon-{port}.sock')
+  try:
+    if os.path.exists(socket_path):
+      os.remove(socket_path)  # left by a daemon which did not exit cleanly, the TCP port is ours so no daemon uses it
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    sock.listen(128)
+  except OSError as e:
+    print(f'Could not listen on Unix socket {socket_path}: {e}')
+    return None
+  return sock
+
+async def advertise_unix_socket(request: web_request.Request, response: web.StreamResponse):
+  """Tell clients about the Unix socket in every response, so they can switch to it without asking."""
+
+  if request.app['UNIX_SOCKET'] != '':
+    response.headers['X-Unix-Socket'] = request.app['UNIX_SOCKET']
+
+async def remove_unix_socket(app: web.Application):
+  if app['UNIX_SOCKET'] != '' and os.path.exists(app['UNIX_SOCKET']):
+    os.remove(app['UNIX_SOCKET'])
 
 
 if __name__ == "__main__":
@@ -171,23 +654,57 @@ if __name__ == "__main__":
   parser.add_argument('--proxy-which', type=str, default="SYSTEM")
   parser.add_argument('--proxy-address', type=str, default="")
   parser.add_argument('--proxy-ca-certs', type=str, default="")
+  parser.add_argument('--ready-file', type=str, default="", help="file written when the server is ready")
+  parser.add_argument('--started-at', type=float, default=None, help="time when the add-on launched the daemon")
   args = parser.parse_args()
 
+  startup_mark = args.started_at if args.started_at is not None else time.time()
+  mark_startup_phase('interpreter_and_imports')
+
+  # listen right away, so connections made while the server starts wait in the backlog instead of being refused
+  sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  if os.name == 'posix':
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+  sock.bind(('127.0.0.1', int(args.port)))
+  sock.listen(128)
+  sockets = [sock]
+  unix_sock = listen_unix_socket(args.port)
+  if unix_sock is not None:
+    sockets.append(unix_sock)
+
   server = web.Application()
   server['PROXY_WHICH'] = args.proxy_which
   server['PROXY_ADDRESS'] = args.proxy_address
   server['PROXY_CA_CERTS'] = args.proxy_ca_certs
+  server['READY_FILE'] = args.ready_file
+  server['PORT'] = args.port
+  server['UNIX_SOCKET'] = unix_sock.getsockname() if unix_sock is not None else ''
+
+  tasks.Task.on_change = on_task_change
+  tracing.process_name = 'daemon'
 
   server.cleanup_ctx.append(persistent_sessions)
   server.add_routes([
     web.get('/', index),
     web.get('/report', report),
+    web.get('/report_stream', report_stream),
     web.get('/kill_download', kill_download),
     web.post('/download_asset', download_asset),
+    web.post('/batch', batch),
     web.post('/search_asset', search_assets),
+    web.post('/download_thumbnail', download_thumbnail),
+    web.post('/thumbnails_visible', thumbnails_visible),
+    web.get('/config', config),
+    web.post('/config', config),
+    web.get('/metrics', get_metrics),
+    web.get('/trace', get_trace),
     web.view('/shutdown', Shutdown),
     web.view('/report_blender_quit', report_blender_quit),
   ])
 
   server.on_startup.append(start_background_tasks)
-  web.run_app(server, host='127.0.0.1', port=args.port)
+  server.on_startup.append(write_ready_file)
+  server.on_cleanup.append(remove_ready_file)
+  server.on_cleanup.append(remove_unix_socket)
+  server.on_response_prepare.append(advertise_unix_socket)
+  web.run_app(server, sock=sockets)
@@ -0,0 +1,74 @@
+"""Holds state of delta reports, which send an app only the fields of tasks changed since its last acknowledged report."""
+
+import tasks
+
+
+MAX_UNACKED = 32
+"""How many unacknowledged reports are remembered, changes sent in older ones are sent again."""
+
+
+class AppReports():
+  """Remembers which version of each task the app has, so reports carry only what changed.
+
+  The first report of a task is its full snapshot (tasks.Task.to_seriazable_object), later reports carry the changed fields (tasks.Task.to_delta).
+  Polled reports are numbered, the app acknowledges the last report it processed in its next poll.
+  The report stream acknowledges a report once it is written, the app resets the state whenever it reconnects.
+  Tasks in a terminal status are removed from the registry once the app acknowledged their last version.
+  """
+
+  def __init__(self):
+    self.seq = 0
+    self.sent: dict[int, dict[str, int]] = {}  # seq: {task_id: version} of unacknowledged reports
+    self.acked: dict[str, int] = {}  # task_id: version the app has
+
+  def reset(self):
+    """Forget what the app has, the next report sends full snapshots of all tasks."""
+
+    self.sent.clear()
+    self.acked.clear()
+
+  def ack(self, seq: int):
+    """Mark the report `seq` and all reports before it as processed by the app. Acknowledging 0 resets the state."""
+
+    if seq == 0:
+      self.reset()
+      return
+    for sent_seq in [s for s in self.sent if s <= seq]:
+      for task_id, version in self.sent.pop(sent_seq).items():
+        if version > self.acked.get(task_id, -1):
+          self.acked[task_id] = version
+
+  def collect(self, app_tasks: list[tasks.Task], acked: bool = False) -> tuple[int, list, list]:
+    """Get number of the report, the reports of changed tasks and tasks which can be removed from the registry.
+
+    With `acked` the report counts as processed right away (report stream), otherwise it waits for ack().
+    """
+
+    reports = []
+    versions = {}
+    done_tasks = []
+    for task in app_tasks:
+      version = self.acked.get(task.task_id)
+      if version == task.version:
+        if task.status in tasks.TERMINAL_STATUSES:
+          done_tasks.append(task)
+        continue
+      reports.append(task.to_seriazable_object() if version is None else task.to_delta(version))
+      versions[task.task_id] = task.version
+
+    # forget tasks which left the registry (reported, evicted or dropped)
+    live = {task.task_id for task in app_tasks}
+    for task_id in [t for t in self.acked if t not in live]:
+      del self.acked[task_id]
+
+    self.seq += 1
+    if acked:
+      self.acked.update(versions)
+      done_tasks.extend(t for t in app_tasks if t.status in tasks.TERMINAL_STATUSES and t.task_id in versions)
+    elif len(versions) > 0:
+      self.sent[self.seq] = versions
+      for old_seq in sorted(self.sent)[:-MAX_UNACKED]:
+        del self.sent[old_seq]
+    for task in done_tasks:
+      self.acked.pop(task.task_id, None)
+    return self.seq, reports, done_tasks
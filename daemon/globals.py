@@ -1,13 +1,112 @@
 """Holds global variables used by modules of daemon server."""
 
 import time
+from typing import TYPE_CHECKING
 
 import tasks as tsks
+import utils
 
+if TYPE_CHECKING:
+  import bandwidth as bndwdth
+  import bg_workers
+  import io_executor as io_exec
+  import scheduler as schdlr
+  import search_cache as srch_cache
+  import thumbnail_cache as thumb_cache
 
-tasks: list[tsks.Task] = []
+
+tasks: tsks.TaskRegistry = tsks.TaskRegistry()
 """Server-wide variable holding all running tasks on the daemon-server."""
 
+thumbnail_queues: dict = {}
+"""Thumbnail download queues of apps, keyed by app_id."""
+
+prefetches: dict = {}
+"""Running prefetches of next search pages, keyed by app_id."""
+
+downloads_in_flight: dict = {}
+"""Running asset downloads keyed by (assetBaseId, resolution, file path), values are (leading task, future with the outcome)."""
+
+batches: dict = {}
+"""Running batches of downloads and searches, keyed by batch_id."""
+
+download_followers: dict = {}
+"""Tasks waiting for a download of the same file, keyed by task_id of the leading task."""
+
+app_reports: dict = {}
+"""State of delta reports of apps, keyed by app_id."""
+
+report_events: dict = {}
+"""Events of the connected report streams, keyed by app_id. Set when a task of the app changes."""
+
+startup_phases: dict = {}
+"""Seconds spent in the startup phases of the daemon, in order of the phases."""
+
 last_report_time: float = time.time()
 TIMEOUT: int = 300
-active_apps=[]
\ No newline at end of file
+EVICTION_INTERVAL: float = 30.0
+"""Seconds between evictions of old finished and errored tasks from the registry."""
+LOOP_LAG_INTERVAL: float = 1.0
+"""Seconds between measurements of the event loop lag reported on /metrics."""
+STREAM_HEARTBEAT: float = 5.0
+"""Seconds after which an empty line is sent to the idle report stream, so both sides can detect a dead connection."""
+STREAM_COALESCE: float = 0.05
+"""Seconds to wait after a task change before pushing, so bursts of progress updates are sent as one report."""
+PART_SUFFIX: str = '.part'
+"""Suffix of files being downloaded, renamed to the final name when complete."""
+RESUME_RETRIES: int = 5
+"""How many times an interrupted download is resumed before the task fails."""
+WRITE_BUFFER: int = 1024 * 1024
+"""Bytes of a downloaded asset collected in memory before they are written to disk in one call to the I/O pool."""
+CONNECTOR_LIMITS: dict[str, int] = {
+  'api_requests': 64,
+  'small_thumbs': 16,
+  'big_thumbs': 4,
+  'assets': 16,
+}
+"""Limits of simultaneous connections for each of the persistent sessions. Asset downloads are further limited by the scheduler."""
+
+scheduler: 'schdlr.Scheduler | None' = None
+"""Decides which asset download gets the connection next, can be configured at runtime on /config."""
+io_executor: 'io_exec.IOExecutor | None' = None
+"""Thread pools for blocking filesystem work, bulk copies of assets have their own pool."""
+search_cache: 'srch_cache.SearchCache | None' = None
+"""Cache of search responses, can be configured at runtime on /config."""
+worker_pool: 'bg_workers.WorkerPool | None' = None
+"""Warm background Blender processes running unpack jobs, can be configured at runtime on /config."""
+bandwidth: 'bndwdth.BandwidthShaper | None' = None
+"""Rate limits of downloads per traffic class, unlimited by default, can be configured at runtime on /config."""
+thumbnail_cache: 'thumb_cache.ThumbnailCache | None' = None
+"""Index of downloaded thumbnails with a size budget, can be configured at runtime on /config."""
+THUMBNAIL_INDEX_SYNC: float = 30.0
+"""Seconds between writes of the thumbnail index to disk."""
+THUMBNAIL_INDEX_CHECK: float = 300.0
+"""Seconds between checks that thumbnails in the index are still on disk."""
+segment_count: int = 4
+"""How many concurrent range requests download one big asset file, can be configured at runtime on /config. 1 disables segmented downloads."""
+segment_threshold: int = 32 * 1024 * 1024
+"""Bytes from which asset files are downloaded in segments, can be configured at runtime on /config."""
+prefetch_depth: int = 1
+"""How many next pages of search results are prefetched, can be configured at runtime on /config."""
+active_apps=[]
+
+
+def create_services():
+  """Import the service modules and create the services above. Called on startup of the server with the event loop running,
+  so the listening socket is open before they load and their asyncio primitives are made on the loop which uses them.
+  """
+
+  global scheduler, io_executor, search_cache, worker_pool, bandwidth, thumbnail_cache
+  import bandwidth as bndwdth
+  import bg_workers
+  import io_executor as io_exec
+  import scheduler as schdlr
+  import search_cache as srch_cache
+  import thumbnail_cache as thumb_cache
+
+  scheduler = schdlr.Scheduler(limits={'interactive': 2, 'resolution': 1, 'background': 1}, total_limit=3)
+  io_executor = io_exec.IOExecutor(workers=4, bulk_workers=1)
+  search_cache = srch_cache.SearchCache(io_executor)
+  worker_pool = bg_workers.WorkerPool(size=2, max_jobs=20, creationflags=utils.get_process_flags())
+  bandwidth = bndwdth.BandwidthShaper()
+  thumbnail_cache = thumb_cache.ThumbnailCache(io_executor)
@@ -0,0 +1,46 @@
+"""Holds thread pools running blocking filesystem work, so it does not stall the event loop."""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class IOExecutor():
+  """Runs blocking filesystem calls in bounded thread pools.
+
+  Short operations (writes of downloaded chunks, makedirs, removals) and bulk operations (copying whole assets)
+  have separate pools, so copying a multi-GB asset never delays writes of other downloads.
+  At most `max_pending` calls wait in each pool, further callers wait on the event loop (backpressure).
+
+  A call always runs to the end, even if the awaiting task is cancelled meanwhile: the cancellation is delivered
+  only after the call finished, so e.g. a file is never deleted while a chunk is still being written into it.
+  """
+
+  def __init__(self, workers: int = 4, bulk_workers: int = 1, max_pending: int = 64):
+    self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='blenderkit-io')
+    self.bulk_executor = ThreadPoolExecutor(max_workers=bulk_workers, thread_name_prefix='blenderkit-io-bulk')
+    self.pending = asyncio.Semaphore(max_pending)
+    self.bulk_pending = asyncio.Semaphore(max_pending)
+
+  async def run(self, func, *args, **kwargs):
+    """Run short blocking call in the I/O pool and return its result."""
+
+    return await self._run(self.executor, self.pending, func, *args, **kwargs)
+
+  async def run_bulk(self, func, *args, **kwargs):
+    """Run long blocking call (e.g. copying an asset) in the bulk I/O pool and return its result."""
+
+    return await self._run(self.bulk_executor, self.bulk_pending, func, *args, **kwargs)
+
+  def shutdown(self):
+    self.executor.shutdown(wait=False, cancel_futures=True)
+    self.bulk_executor.shutdown(wait=False, cancel_futures=True)
+
+  async def _run(self, executor: ThreadPoolExecutor, pending: asyncio.Semaphore, func, *args, **kwargs):
+    async with pending:
+      future = asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args, **kwargs))
+      try:
+        return await asyncio.shield(future)
+      except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
@@ -0,0 +1,131 @@
+"""Holds counters, gauges and histograms describing the daemon, exported on /metrics.
+
+Module level functions record into one server-wide registry, so any module can record without passing it around.
+"""
+
+import contextlib
+import math
+import time
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, math.inf)
+"""Upper bounds (in seconds) of histogram buckets."""
+
+
+class Histogram():
+  """Counts observed values in cumulative buckets, like Prometheus histograms."""
+
+  def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+    self.buckets = buckets
+    self.counts = [0] * len(buckets)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value: float):
+    self.sum += value
+    self.count += 1
+    for i, bound in enumerate(self.buckets):
+      if value <= bound:
+        self.counts[i] += 1
+        break
+
+  def to_dict(self) -> dict:
+    cumulative = 0
+    buckets = {}
+    for bound, count in zip(self.buckets, self.counts):
+      cumulative += count
+      buckets['+Inf' if bound == math.inf else str(bound)] = cumulative
+    return {'buckets': buckets, 'sum': self.sum, 'count': self.count}
+
+
+counters: dict[tuple, float] = {}
+gauges: dict[tuple, float] = {}
+histograms: dict[tuple, Histogram] = {}
+
+
+def _key(name: str, labels: dict) -> tuple:
+  return (name, tuple(sorted(labels.items())))
+
+
+def inc(name: str, value: float = 1, **labels):
+  """Increase the counter."""
+
+  key = _key(name, labels)
+  counters[key] = counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+  gauges[_key(name, labels)] = value
+
+
+def clear_gauge(name: str):
+  """Remove the gauge with all its labels, used before recomputing gauges whose label sets change."""
+
+  for key in [key for key in gauges if key[0] == name]:
+    del gauges[key]
+
+
+def observe(name: str, value: float, **labels):
+  """Record the value into the histogram."""
+
+  key = _key(name, labels)
+  histogram = histograms.get(key)
+  if histogram is None:
+    histogram = histograms[key] = Histogram()
+  histogram.observe(value)
+
+
+@contextlib.contextmanager
+def timer(name: str, **labels):
+  """Record duration of the with block into the histogram, also when the block raises or is cancelled."""
+
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    observe(name, time.perf_counter() - start, **labels)
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+  labels = labels + extra
+  if len(labels) == 0:
+    return ''
+  return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+def to_prometheus() -> str:
+  """Export all metrics in Prometheus text format."""
+
+  lines = []
+  for kind, values in (('counter', counters), ('gauge', gauges)):
+    typed = set()
+    for (name, labels), value in sorted(values.items(), key=lambda item: item[0]):
+      if name not in typed:
+        lines.append(f'# TYPE {name} {kind}')
+        typed.add(name)
+      lines.append(f'{name}{_format_labels(labels)} {value}')
+
+  typed = set()
+  for (name, labels), histogram in sorted(histograms.items(), key=lambda item: item[0]):
+    if name not in typed:
+      lines.append(f'# TYPE {name} histogram')
+      typed.add(name)
+    for bound, count in histogram.to_dict()['buckets'].items():
+      lines.append(f'{name}_bucket{_format_labels(labels, (("le", bound),))} {count}')
+    lines.append(f'{name}_sum{_format_labels(labels)} {histogram.sum}')
+    lines.append(f'{name}_count{_format_labels(labels)} {histogram.count}')
+
+  return '\n'.join(lines) + '\n'
+
+
+def to_json() -> dict:
+  """Export all metrics as JSON serializable dict: {name: [{'labels': {...}, 'value': ...}]}."""
+
+  result = {}
+  for values in (counters, gauges):
+    for (name, labels), value in values.items():
+      result.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+  for (name, labels), histogram in histograms.items():
+    result.setdefault(name, []).append({'labels': dict(labels), 'value': histogram.to_dict()})
+
+  return result
@@ -0,0 +1,141 @@
+"""Holds the scheduler deciding which asset download can use the connection next."""
+
+import asyncio
+import contextlib
+from collections import OrderedDict, deque
+
+import tasks
+
+
+PRIORITY_CLASSES = ('interactive', 'resolution', 'background')
+"""Priority classes of downloads, from the highest priority.
+interactive - asset dragged or clicked by the user, resolution - swap of resolutions, background - prefetch and batch jobs.
+"""
+
+
+class Scheduler():
+  """Grants download slots to tasks.
+
+  Every priority class has its own concurrency limit and there is a total limit for all classes together.
+  When a slot frees up, the highest priority class with a waiting task and free capacity gets it.
+  Within a class, apps take turns by weighted round robin, so one app queuing a bulk job doesn't starve the others.
+  """
+
+  def __init__(self, limits: dict[str, int], total_limit: int):
+    self.limits = {cls: limits.get(cls, 1) for cls in PRIORITY_CLASSES}
+    self.total_limit = total_limit
+    self.app_weights: dict = {}
+    self.running = {cls: 0 for cls in PRIORITY_CLASSES}
+    self.queues: dict[str, OrderedDict] = {cls: OrderedDict() for cls in PRIORITY_CLASSES}  # app_id: deque of (task, future), in turn order
+    self.turns: dict = {}  # (class, app_id): slots granted in the current turn of the app
+
+  @staticmethod
+  def classify(task: tasks.Task) -> str:
+    """Get priority class of the task. Explicit 'priority' in task data wins, otherwise it is guessed from the task."""
+
+    priority = task.data.get('priority')
+    if priority in PRIORITY_CLASSES:
+      return priority
+    if task.data.get('replace_resolution'):
+      return 'resolution'
+    return 'interactive'
+
+  def configure(self, limits: dict | None = None, total_limit: int | None = None, app_weights: dict | None = None):
+    """Change limits at runtime. Waiting tasks are dispatched right away if the limits grew."""
+
+    if limits is not None:
+      for cls, limit in limits.items():
+        if cls in self.limits:
+          self.limits[cls] = max(int(limit), 1)
+    if total_limit is not None:
+      self.total_limit = max(int(total_limit), 1)
+    if app_weights is not None:
+      # app_ids are stored as strings, since JSON object keys are always strings
+      self.app_weights.update({str(app_id): max(int(weight), 1) for app_id, weight in app_weights.items()})
+    self._dispatch()
+
+  def get_config(self) -> dict:
+    """Get current limits and state of the queues."""
+
+    return {
+      'limits': self.limits,
+      'total_limit': self.total_limit,
+      'app_weights': self.app_weights,
+      'running': self.running,
+      'waiting': {cls: sum(len(q) for q in self.queues[cls].values()) for cls in PRIORITY_CLASSES},
+    }
+
+  async def acquire(self, task: tasks.Task) -> str:
+    """Wait until the task gets a slot. Returns the priority class, which has to be passed to release()."""
+
+    cls = self.classify(task)
+    future = asyncio.get_running_loop().create_future()
+    entry = (task, future)
+    self.queues[cls].setdefault(task.app_id, deque()).append(entry)
+    self._dispatch()
+    try:
+      await future
+    except asyncio.CancelledError:
+      if future.done() and not future.cancelled():
+        self.release(cls)  # slot was granted right before the cancellation
+      else:
+        self._discard(cls, entry)
+      raise
+
+    return cls
+
+  def release(self, cls: str):
+    """Give back the slot of a finished task."""
+
+    self.running[cls] -= 1
+    self._dispatch()
+
+  @contextlib.asynccontextmanager
+  async def slot(self, task: tasks.Task):
+    """Hold a download slot for the duration of the with block."""
+
+    cls = await self.acquire(task)
+    try:
+      yield cls
+    finally:
+      self.release(cls)
+
+  def _discard(self, cls: str, entry: tuple):
+    app_queue = self.queues[cls].get(entry[0].app_id)
+    if app_queue is None or entry not in app_queue:
+      return
+    app_queue.remove(entry)
+    if len(app_queue) == 0:
+      del self.queues[cls][entry[0].app_id]
+      self.turns.pop((cls, entry[0].app_id), None)
+
+  def _dispatch(self):
+    while sum(self.running.values()) < self.total_limit:
+      for cls in PRIORITY_CLASSES:
+        if len(self.queues[cls]) > 0 and self.running[cls] < self.limits[cls]:
+          future = self._pop_next(cls)
+          if future.done():  # cancelled meanwhile
+            break
+          self.running[cls] += 1
+          future.set_result(True)
+          break
+      else:
+        return
+
+  def _pop_next(self, cls: str) -> asyncio.Future:
+    """Pop the next waiting task of the class. Apps take turns, each one gets as many slots in a row as is its weight."""
+
+    app_queues = self.queues[cls]
+    app_id, app_queue = next(iter(app_queues.items()))
+    _, future = app_queue.popleft()
+    turn = self.turns.get((cls, app_id), 0) + 1
+    if len(app_queue) == 0:
+      del app_queues[app_id]
+      self.turns.pop((cls, app_id), None)
+    elif turn >= self.app_weights.get(str(app_id), 1):
+      app_queues.move_to_end(app_id)
+      self.turns.pop((cls, app_id), None)
+    else:
+      self.turns[(cls, app_id)] = turn
+
+    return future
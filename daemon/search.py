@@ -7,7 +7,10 @@ import uuid
 import aiohttp
 import assets
 import globals
+import metrics
+import search_results
 import tasks
+import tracing
 from aiohttp import web
 
 import utils
@@ -22,116 +25,305 @@ def report_image_finished(data, filepath, done=True):
                              'done': done}
 
 
+def write_image(image_path: str, chunks: list) -> None:
+  """Write the image under a temporary name and rename it when complete."""
+
+  part_path = image_path + globals.PART_SUFFIX
+  with open(part_path, 'wb') as file:
+    file.writelines(chunks)
+  os.replace(part_path, image_path)
+
+
+def remove_file(path: str) -> None:
+  if os.path.exists(path):
+    os.remove(path)
+
+
 async def download_image(session: aiohttp.ClientSession, task: tasks.Task):
-  """Download a single image and report to addon."""
+  """Download a single image and report to addon. The image is written under a temporary name, so a partial image is never loaded."""
 
   image_url = task.data["image_url"]
   image_path = task.data["image_path"]
-  async with session.get(image_url) as resp:
-    if resp and resp.status == 200:
-      with open(image_path, 'wb') as file:
+  part_path = image_path + globals.PART_SUFFIX
+  try:
+    async with session.get(image_url) as resp:
+      if resp and resp.status == 200:
+        traffic_class = 'small_thumbs' if task.data['thumbnail_type'] == 'small' else 'big_thumbs'
+        chunks = []
         async for chunk in resp.content.iter_chunked(4096 * 32):
-          file.write(chunk)
-      task.finished("thumbnail downloaded")
-    else:
-      task.error(f"thumbnail download error: {resp.status}")
+          chunks.append(chunk)
+          await globals.bandwidth.consume(traffic_class, len(chunk))
+        size = sum(len(chunk) for chunk in chunks)
+        metrics.inc('blenderkit_bytes_total', size, session=traffic_class)
+        await globals.io_executor.run(write_image, image_path, chunks)
+        globals.thumbnail_cache.add(image_path, size)
+        task.finished("thumbnail downloaded")
+      else:
+        task.error(f"thumbnail download error: {resp.status}")
+  except asyncio.CancelledError:
+    await globals.io_executor.run(remove_file, part_path)
+    raise
+  except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+    task.error(f"thumbnail download error: {e}")
 
 
-async def download_image_batch(session: aiohttp.ClientSession, tsks: list[tasks.Task], block: bool = False):
-  """Download batch of images. images are tuples of file path and url."""
-  
-  coroutines = []
-  for task in tsks:
-    coroutine = asyncio.ensure_future(download_image(session, task))
-    coroutines.append(coroutine)
-  
-  if block == True:
-    await asyncio.gather(*coroutines)
+def cancel_task(task: tasks.Task):
+  """Report the thumbnail task as cancelled. Prefetched thumbnails are not registered, so they are not reported."""
+
+  if task in globals.tasks:
+    task.cancelled('thumbnail download cancelled')
+
+
+class ThumbnailQueue():
+  """Downloads thumbnails for one app, visible ones first.
+
+  Thumbnails of results visible in the asset bar (reported by the add-on) jump ahead of the others,
+  thumbnails prefetched for the next pages (task data 'prefetch') go last.
+  Each image is downloaded once, tasks asking for an image which is already downloading finish together with it.
+  When a new search starts, clear() cancels the waiting and running thumbnails of the superseded search.
+  """
+
+  def __init__(self, session: aiohttp.ClientSession, workers: int):
+    self.session = session
+    self.workers = workers
+    self.pending: dict[str, tasks.Task] = {}  # in order of results
+    self.running: dict[str, asyncio.Task] = {}
+    self.paths: dict[str, tasks.Task] = {}  # image_path: pending or running task downloading it
+    self.waiters: dict[str, list[tasks.Task]] = {}  # image_path: tasks waiting for the image downloaded by another task
+    self.visible: set[str] = set()
+
+  def add(self, task: tasks.Task):
+    """Queue the thumbnail task for download."""
+    path = task.data['image_path']
+    queued = self.paths.get(path)
+    if queued is not None:
+      if queued.task_id in self.pending and queued.data.get('prefetch') and not task.data.get('prefetch'):
+        del self.pending[queued.task_id]  # the prefetch is needed now, replace it by the real task
+      else:
+        self.waiters.setdefault(path, []).append(task)
+        return
+
+    self.pending[task.task_id] = task
+    self.paths[path] = task
+    self._start_workers()
+
+  def download_now(self, session: aiohttp.ClientSession, task: tasks.Task):
+    """Start the download right away, e.g. for a tooltip image the user hovers over. It still gets cancelled by clear()."""
+    path = task.data['image_path']
+    if path in self.paths:
+      self.waiters.setdefault(path, []).append(task)
+      return
+    self.paths[path] = task
+    self.running[task.task_id] = asyncio.ensure_future(self._download(session, task))
+
+  def set_visible(self, asset_base_ids: list[str]):
+    self.visible = set(asset_base_ids)
+
+  def clear(self):
+    """Cancel waiting thumbnails and the running downloads."""
+    for task in self.pending.values():
+      cancel_task(task)
+      path = task.data['image_path']
+      del self.paths[path]
+      for waiter in self.waiters.pop(path, []):
+        cancel_task(waiter)
+    self.pending.clear()
+    for async_task in list(self.running.values()):
+      async_task.cancel()
+
+  def _start_workers(self):
+    while len(self.running) < self.workers and len(self.pending) > 0:
+      task = self._pop_next()
+      self.running[task.task_id] = asyncio.ensure_future(self._download(self.session, task))
+
+  def _pop_next(self) -> tasks.Task:
+    best = None
+    for task in self.pending.values():
+      if task.data['assetBaseId'] in self.visible:
+        best = task
+        break
+      if best is None or (best.data.get('prefetch') and not task.data.get('prefetch')):
+        best = task
+    del self.pending[best.task_id]
+    return best
+
+  async def _download(self, session: aiohttp.ClientSession, task: tasks.Task):
+    path = task.data['image_path']
+    try:
+      with tracing.span('thumbnail_download', task.task_id, thumbnail_type=task.data['thumbnail_type']):
+        await download_image(session, task)
+    except asyncio.CancelledError:
+      cancel_task(task)
+      for waiter in self.waiters.pop(path, []):
+        cancel_task(waiter)
+      raise
+    finally:
+      del self.running[task.task_id]
+      if self.paths.get(path) is task:
+        del self.paths[path]
+      self._start_workers()
+
+    for waiter in self.waiters.pop(path, []):
+      if task.status == 'finished':
+        waiter.finished(task.message)
+      else:
+        waiter.error(task.message)
+
+
+def get_thumbnail_queue(app: web.Application, app_id) -> ThumbnailQueue:
+  """Get thumbnail queue of the app, create it if it doesn't exist yet."""
+
+  queue = globals.thumbnail_queues.get(app_id)
+  if queue is None:
+    queue = ThumbnailQueue(app['SESSION_SMALL_THUMBS'], globals.CONNECTOR_LIMITS['small_thumbs'])
+    globals.thumbnail_queues[app_id] = queue
+  return queue
+
+
+def get_search_cache_dir(task: tasks.Task) -> str:
+  """Get directory of the on-disk search cache, it is next to the thumbnail directories in the add-on's temp dir."""
+
+  return os.path.join(os.path.dirname(task.data['tempdir']), 'search_cache')
+
+
+def get_small_thumbnail_data(search_result: dict, index: int, tempdir: str) -> dict:
+  """Get data of the task downloading small thumbnail of the search result."""
+
+  imgname = assets.extract_filename_from_url(search_result['thumbnailSmallUrl'])
+  return {
+    "image_path": os.path.join(tempdir, imgname),
+    "image_url": search_result["thumbnailSmallUrl"],
+    "assetBaseId": search_result['assetBaseId'],
+    "thumbnail_type": "small",
+    "index": index
+  }
 
-async def parse_thumbnails(task: tasks.Task):
-  """Go through results and extract correct filenames."""
+
+async def parse_thumbnails(task: tasks.Task) -> list[tasks.Task]:
+  """Go through results and extract correct filenames. Returns tasks of small thumbnails which need downloading.
+
+  Full size thumbnails are downloaded lazily, when the add-on asks for them on hover.
+  """
 
   small_thumbs_tasks = []
-  full_thumbs_tasks = []
   # END OF PARSING
   # get thumbnails that need downloading
 
   for i, search_result in enumerate(task.result.get('results', [])):
-    imgname = assets.extract_filename_from_url(search_result['thumbnailSmallUrl'])
-    imgpath = os.path.join(task.data['tempdir'], imgname)
-    data = {
-      "image_path": imgpath,
-      "image_url": search_result["thumbnailSmallUrl"],
-      "assetBaseId": search_result['assetBaseId'],
-      "thumbnail_type": "small",
-      "index": i
-    }
-
+    data = get_small_thumbnail_data(search_result, i, task.data['tempdir'])
     task_id = str(uuid.uuid4())
     thumb_task = tasks.Task(data, task_id, task.app_id, "thumbnail_download")
-    globals.tasks.append(thumb_task)
+    globals.tasks.add(thumb_task)
 
-    if os.path.exists(thumb_task.data['image_path']):
+    if globals.thumbnail_cache.contains(thumb_task.data['image_path']):
       thumb_task.finished("thumbnail on disk")
     else:
       small_thumbs_tasks.append(thumb_task)
 
+  return small_thumbs_tasks
 
-    if search_result["assetType"] == 'hdr':
-      large_thumb_url = search_result['thumbnailLargeUrlNonsquared']
-    else:
-      large_thumb_url = search_result['thumbnailMiddleUrl']
-
-    imgname = assets.extract_filename_from_url(large_thumb_url)
-    imgpath = os.path.join(task.data['tempdir'], imgname)
-    data = {
-      "image_path": imgpath,
-      "image_url": large_thumb_url,
-      "assetBaseId": search_result['assetBaseId'],
-      "thumbnail_type": "full",
-      "index": i
-    }
 
-    task_id = str(uuid.uuid4())
-    thumb_task = tasks.Task(data, task_id, task.app_id, "thumbnail_download")
-    globals.tasks.append(thumb_task)
-    if os.path.exists(thumb_task.data['image_path']):
-      thumb_task.finished("thumbnail on disk")
-    else:
-      full_thumbs_tasks.append(thumb_task)
+async def prefetch_pages(request: web.Request, task: tasks.Task, thumbnail_queue: ThumbnailQueue, depth: int):
+  """Speculatively fetch next pages of the search into the search cache and queue their small thumbnails with low priority.
+
+  The prefetched thumbnails are not reported, the add-on gets them from the search of the next page ("thumbnail on disk").
+  """
+
+  headers = utils.get_headers(task.data['PREFS']['api_key'])
+  session = request.app['SESSION_API_REQUESTS']
+  next_url = task.result.get('next')
+  for _ in range(depth):
+    if not next_url:
+      return
+    try:
+      response = await globals.search_cache.fetch(session, next_url, headers, get_search_cache_dir(task))
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+      print(f'Prefetch of next search page failed: {e}')
+      return
 
-  return small_thumbs_tasks, full_thumbs_tasks
+    for i, search_result in enumerate(response.get('results', [])):
+      data = get_small_thumbnail_data(search_result, i, task.data['tempdir'])
+      if globals.thumbnail_cache.contains(data['image_path']):
+        continue
+      data['prefetch'] = True
+      thumbnail_queue.add(tasks.Task(data, str(uuid.uuid4()), task.app_id, "thumbnail_download"))
+    next_url = response.get('next')
+
+
+async def fetch_search(request: web.Request, task: tasks.Task) -> dict | None:
+  """Get search response for the task from the search cache or server. On failure the task errors and None is returned."""
+
+  headers = utils.get_headers(task.data['PREFS']['api_key'])
+  session = request.app['SESSION_API_REQUESTS']
+  try:
+    with metrics.timer('blenderkit_search_seconds'), tracing.span('search', task.task_id):
+      return await globals.search_cache.fetch(session, task.data['urlquery'], headers, get_search_cache_dir(task))
+  except aiohttp.ClientResponseError as e:
+    task.error(f'Search failed: server responded {e.status}')
+  except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+    task.error(f'Search failed: {type(e).__name__} {e}')
+  return None
 
 
 async def do_search(request: web.Request, data: dict, task_id: str):
   """Searches for results and download thumbnails.
   
-  1. Sends search request to BlenderKit server. (Creates search task.)
-  2. Reports the result to the addon. (Search task finished.)
-  3. Gets small and large thumbnails. (Thumbnail tasks.)
-  4. Reports paths to downloaded thumbnails. (Thumbnail task finished.)
+  1. Sends search request to BlenderKit server, or gets the response from cache. (Creates search task.)
+  2. Reports the results parsed into records for the asset bar to the addon. (Search task finished.)
+  3. Queues small thumbnails, thumbnails of the superseded search are dropped. (Thumbnail tasks.)
+  4. Prefetches next pages and their small thumbnails, so scrolling further doesn't wait.
+  5. Reports paths to downloaded thumbnails. (Thumbnail task finished.)
   """
   
   app_id = data['app_id']
   del data['app_id']
   task = tasks.Task(data, task_id, app_id, 'search', message='Searching assets')
-  globals.tasks.append(task)
+  globals.tasks.add(task)
 
-  rdata = {}
-  rdata['results'] = []
-  headers = utils.get_headers(task.data['PREFS']['api_key'])
+  await globals.thumbnail_cache.set_directory(os.path.dirname(task.data['tempdir']))
+  thumbnail_queue = get_thumbnail_queue(request.app, app_id)
+  prefetch = globals.prefetches.pop(app_id, None)
+  if prefetch is not None and not data.get('get_next'):
+    prefetch.cancel()
+  if not data.get('get_next'):
+    thumbnail_queue.clear()
 
-  session = request.app['SESSION_API_REQUESTS']
-  async with session.get(task.data['urlquery'], headers=headers) as resp:
-    await resp.text()
-    response = await resp.json()
+  response = await fetch_search(request, task)
+  if response is None:
+    return
+
+  task.result = search_results.parse_response(response)
+  task.finished('Search results downloaded')
+
+  small_thumbs_tasks = await parse_thumbnails(task)
+  for thumb_task in small_thumbs_tasks:
+    thumbnail_queue.add(thumb_task)
+
+  if globals.prefetch_depth > 0 and response.get('next'):
+    globals.prefetches[app_id] = asyncio.ensure_future(prefetch_pages(request, task, thumbnail_queue, globals.prefetch_depth))
 
-    task.finished('Search results downloaded')
-    task.result = response
-    
-    small_thumbs_tasks, full_thumbs_tasks = await parse_thumbnails(task)
 
-    # thumbnails fetching
-    await download_image_batch(request.app['SESSION_SMALL_THUMBS'], small_thumbs_tasks, block=True)
-    await download_image_batch(request.app['SESSION_BIG_THUMBS'], full_thumbs_tasks)
+async def do_batch_search(request: web.Request, task: tasks.Task):
+  """Get search results for an item of a batch. Unlike do_search it leaves thumbnails and prefetches of the app alone."""
+
+  response = await fetch_search(request, task)
+  if response is None:
+    return
+
+  task.result = response
+  task.finished('Search results downloaded')
+
+
+async def download_thumbnail(request: web.Request, data: dict, task_id: str):
+  """Download single thumbnail right away, used for full size thumbnails shown in tooltips."""
+
+  app_id = data['app_id']
+  del data['app_id']
+  task = tasks.Task(data, task_id, app_id, 'thumbnail_download')
+  globals.tasks.add(task)
+  await globals.thumbnail_cache.set_directory(os.path.dirname(os.path.dirname(data['image_path'])))
+  if globals.thumbnail_cache.contains(data['image_path']):
+    task.finished("thumbnail on disk")
+    return
 
+  get_thumbnail_queue(request.app, app_id).download_now(request.app['SESSION_BIG_THUMBS'], task)
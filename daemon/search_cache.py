@@ -0,0 +1,187 @@
+"""Holds cache of search responses from BlenderKit server."""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import aiohttp
+import metrics
+
+
+def normalize_url(url: str) -> str:
+  """Normalize URL so the same query gives the same key: lowercase scheme and host, sorted query parameters."""
+
+  parts = urlsplit(url)
+  query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+  return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+
+class SearchCache():
+  """Caches search responses in memory (bounded, least recently used are dropped) and on disk.
+
+  Entries are keyed by the normalized query URL and the user's auth scope.
+  Entries younger than `ttl` are served right away, entries younger than `stale_ttl` are served right away
+  and revalidated in background, older entries are revalidated with If-None-Match before they are used.
+  Reads and writes of the disk cache run in the I/O pool. The number of files on disk is counted,
+  the directory is scanned only when it is seen for the first time and when the count goes over `max_disk_entries`.
+  """
+
+  def __init__(self, io_executor, ttl: float = 60, stale_ttl: float = 600, max_entries: int = 100, max_disk_entries: int = 500):
+    self.io_executor = io_executor
+    self.ttl = ttl
+    self.stale_ttl = stale_ttl
+    self.max_entries = max_entries
+    self.max_disk_entries = max_disk_entries
+    self.entries: OrderedDict[str, dict] = OrderedDict()
+    self.revalidating: dict[str, asyncio.Task] = {}
+    self.disk_counts: dict[str, int] = {}  # directory: number of cached files in it
+
+  def configure(self, ttl: float | None = None, stale_ttl: float | None = None, max_entries: int | None = None):
+    if ttl is not None:
+      self.ttl = float(ttl)
+    if stale_ttl is not None:
+      self.stale_ttl = float(stale_ttl)
+    if max_entries is not None:
+      self.max_entries = max(int(max_entries), 1)
+      self._trim()
+
+  def get_config(self) -> dict:
+    return {'ttl': self.ttl, 'stale_ttl': self.stale_ttl, 'max_entries': self.max_entries, 'entries': len(self.entries)}
+
+  @staticmethod
+  def make_key(url: str, authorization: str) -> str:
+    """Get cache key for the URL and auth scope. The credentials are hashed, never stored."""
+
+    scope = hashlib.sha256(authorization.encode()).hexdigest()
+    return hashlib.sha256(f'{normalize_url(url)}|{scope}'.encode()).hexdigest()
+
+  async def get(self, key: str, directory: str) -> dict | None:
+    """Get entry from memory, or from disk if the daemon did not see it yet."""
+
+    entry = self.entries.get(key)
+    if entry is not None:
+      self.entries.move_to_end(key)
+      return entry
+
+    entry = await self.io_executor.run(read_entry, os.path.join(directory, f'{key}.json'))
+    if entry is None:
+      return None
+    self.entries[key] = entry
+    self._trim()
+    return entry
+
+  async def put(self, key: str, entry: dict, directory: str):
+    """Store the entry in memory and on disk, trim the disk cache if it has too many files."""
+
+    self.entries[key] = entry
+    self.entries.move_to_end(key)
+    self._trim()
+
+    if directory not in self.disk_counts:
+      self.disk_counts[directory] = await self.io_executor.run(count_entries, directory)
+    if await self.io_executor.run(write_entry, os.path.join(directory, f'{key}.json'), entry):
+      self.disk_counts[directory] += 1
+    if self.disk_counts[directory] > self.max_disk_entries:
+      self.disk_counts[directory] = await self.io_executor.run(trim_disk, directory, self.max_disk_entries)
+
+  async def fetch(self, session: aiohttp.ClientSession, url: str, headers: dict, directory: str) -> dict:
+    """Get search response for the URL, from the cache if possible."""
+
+    key = self.make_key(url, headers.get('Authorization', ''))
+    entry = await self.get(key, directory)
+    if entry is not None:
+      age = time.time() - entry['stored_at']
+      if age < self.ttl:
+        metrics.inc('blenderkit_search_cache_total', result='hit')
+        return entry['body']
+      if age < self.stale_ttl:
+        metrics.inc('blenderkit_search_cache_total', result='stale')
+        if key not in self.revalidating:
+          self.revalidating[key] = asyncio.ensure_future(self._revalidate(session, url, headers, key, entry, directory))
+        return entry['body']
+
+    return await self.request(session, url, headers, key, entry, directory)
+
+  async def request(self, session: aiohttp.ClientSession, url: str, headers: dict, key: str, entry: dict | None, directory: str) -> dict:
+    """Request the URL from server, conditionally if there is a cached entry with ETag. Only successful responses are stored.
+    Raises aiohttp.ClientResponseError for responses other than 200 (and 304 of a cached entry), their bodies are not search results.
+    """
+
+    request_headers = dict(headers)
+    if entry is not None and entry.get('etag'):
+      request_headers['If-None-Match'] = entry['etag']
+
+    async with session.get(url, headers=request_headers) as resp:
+      if resp.status == 304 and entry is not None:
+        metrics.inc('blenderkit_search_cache_total', result='revalidated')
+        entry['stored_at'] = time.time()
+        await self.put(key, entry, directory)
+        return entry['body']
+
+      metrics.inc('blenderkit_search_cache_total', result='miss')
+      metrics.inc('blenderkit_bytes_total', len(await resp.read()), session='api_requests')
+      if resp.status != 200:
+        raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status, message=resp.reason or '', headers=resp.headers)
+      body = await resp.json()
+      await self.put(key, {'stored_at': time.time(), 'etag': resp.headers.get('ETag'), 'body': body}, directory)
+      return body
+
+  async def _revalidate(self, session, url, headers, key, entry, directory):
+    try:
+      await self.request(session, url, headers, key, entry, directory)
+    except Exception as e:
+      print(f'Revalidation of cached search failed: {e}')
+    finally:
+      del self.revalidating[key]
+
+  def _trim(self):
+    while len(self.entries) > self.max_entries:
+      self.entries.popitem(last=False)
+
+
+def read_entry(path: str) -> dict | None:
+  if not os.path.isfile(path):
+    return None
+  try:
+    with open(path, 'r', encoding='utf-8') as f:
+      return json.load(f)
+  except Exception as e:
+    print(f'Could not read cached search {path}: {e}')
+    return None
+
+
+def write_entry(path: str, entry: dict) -> bool:
+  """Write the entry, returns True if the file is new."""
+
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  new = not os.path.isfile(path)
+  tmp_path = f'{path}.{os.getpid()}.tmp'
+  with open(tmp_path, 'w', encoding='utf-8') as f:
+    json.dump(entry, f)
+  os.replace(tmp_path, path)
+  return new
+
+
+def count_entries(directory: str) -> int:
+  if not os.path.isdir(directory):
+    return 0
+  return sum(1 for e in os.scandir(directory) if e.name.endswith('.json'))
+
+
+def trim_disk(directory: str, max_entries: int) -> int:
+  """Remove the oldest cached files over max_entries, returns the number of files left."""
+
+  files = [e for e in os.scandir(directory) if e.name.endswith('.json')]
+  if len(files) <= max_entries:
+    return len(files)
+  files.sort(key=lambda e: e.stat().st_mtime)
+  for f in files[:len(files) - max_entries]:
+    try:
+      os.remove(f.path)
+    except OSError:
+      pass  # removed by another daemon meanwhile
+  return max_entries
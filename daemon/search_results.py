@@ -0,0 +1,125 @@
+"""Holds parsing of search results into records used by the asset bar and tooltips.
+
+Shared by the daemon and the add-on, so it must not import anything from either of them.
+"""
+
+
+RESOLUTIONS = {
+  'resolution_0_5K': 512,
+  'resolution_1K': 1024,
+  'resolution_2K': 2048,
+  'resolution_4K': 4096,
+  'resolution_8K': 8192,
+}
+"""Sizes of resolution file types in pixels."""
+RECORD_FIELDS = (
+  # asset bar
+  'id',
+  'assetBaseId',
+  'assetType',
+  'name',
+  'displayName',
+  'thumbnailSmallUrl',
+  'thumbnailMiddleUrl',
+  'thumbnailLargeUrlNonsquared',
+  'verificationStatus',
+  'canDownload',
+  'isFree',
+  'isPrivate',
+  'created',
+  # tooltips and asset panels
+  'author',
+  'description',
+  'tags',
+  'category',
+  'license',
+  'score',
+  'ratingsCount',
+  'ratingsAverage',
+  'ratingsMedian',
+  'filesSize',
+  'sourceAppName',
+  'sourceAppVersion',
+  'addonVersion',
+  # download and append
+  'files',
+  'dictParameters',
+)
+"""Fields of search results copied into records, other fields of the server (e.g. 'parameters', the list form of 'dictParameters') never reach the add-on."""
+DEFAULT_BBOX = {
+  'bbox_min': (-.5, -.5, 0),
+  'bbox_max': (.5, .5, 1),
+}
+"""Bounding box of models which don't have it in their parameters."""
+
+
+def extract_filename_from_url(url: str | None) -> str:
+  if url is None:
+    return ''
+  return url.split('/')[-1].split('?')[0]
+
+
+def get_bbox(params: dict) -> dict:
+  if params.get('boundBoxMinX') is None:
+    return dict(DEFAULT_BBOX)
+  return {
+    'bbox_min': (
+      float(params['boundBoxMinX']),
+      float(params['boundBoxMinY']),
+      float(params['boundBoxMinZ'])),
+    'bbox_max': (
+      float(params['boundBoxMaxX']),
+      float(params['boundBoxMaxY']),
+      float(params['boundBoxMaxZ'])),
+  }
+
+
+def parse_result(search_result: dict) -> dict | None:
+  """Get record of the search result with thumbnail names, resolutions and bbox extracted.
+
+  Returns None for results without files. The search result is not modified, it can come from the search cache.
+  The scene dependent 'downloaded' flag is left at 0, the add-on sets it.
+  """
+
+  if len(search_result.get('files', [])) == 0:
+    return None
+
+  if search_result['assetType'] == 'hdr':
+    thumbnail = extract_filename_from_url(search_result['thumbnailLargeUrlNonsquared'])
+  else:
+    thumbnail = extract_filename_from_url(search_result['thumbnailMiddleUrl'])
+  record = {
+    'thumbnail': thumbnail,
+    'thumbnail_small': extract_filename_from_url(search_result['thumbnailSmallUrl']),
+    'downloaded': 0,
+  }
+
+  params = search_result.get('dictParameters', {})
+  if search_result['assetType'] == 'model':
+    record.update(get_bbox(params))
+  elif search_result['assetType'] == 'material':
+    record['texture_size_meters'] = params.get('textureSizeMeters', 1.0)
+
+  # used properties are kept as they are, so the add-on's data is same as on server.
+  record.update((k, v) for k, v in search_result.items() if k in RECORD_FIELDS)
+
+  available_resolutions = [RESOLUTIONS[f['fileType']] for f in search_result['files'] if f['fileType'] in RESOLUTIONS]
+  record['available_resolutions'] = available_resolutions
+  record['max_resolution'] = max(available_resolutions, default=0)
+  # for some reason, the id was still int on some occurances.
+  record['author'] = dict(search_result['author'], id=str(search_result['author']['id']))
+  return record
+
+
+def parse_response(response: dict) -> dict:
+  """Get search response with its results parsed by parse_result(), results without files are left out."""
+
+  records = []
+  for search_result in response.get('results', []):
+    record = parse_result(search_result)
+    if record is not None:
+      records.append(record)
+  parsed = dict(response)
+  parsed['results'] = records
+  parsed['parsed'] = True
+  return parsed
@@ -1,11 +1,34 @@
 import asyncio
 import json
+import time
+from collections import OrderedDict
+
+
+TERMINAL_STATUSES = ('finished', 'error', 'cancelled')
+"""Statuses after which the task won't change anymore."""
+REPORTED_FIELDS = ('message', 'progress', 'status', 'result', 'data')
+"""Fields of the task which can change and are sent in delta reports."""
+PRIVATE_DATA = ('PREFS',)
+"""Keys of task data which stay in the daemon, e.g. PREFS with the API key."""
 
 
 class Task():
-  """Holds all information needed for a task."""
+  """Holds all information needed for a task.
+
+  Every assignment to a reported field bumps the version of the task and remembers it as the version of the field,
+  so a report can carry only the fields changed since the version the app already has.
+  Changes inside `data` are not tracked, data are sent in the first report and again when the task reaches a terminal status.
+  """
+
+  __slots__ = ('data', 'task_id', 'app_id', 'task_type', 'message', 'progress', 'status', 'result', 'async_task', 'version', 'field_versions')
+
+  on_change = None
+  """Optional callable `on_change(task)` called whenever any task changes its state.
+  Set by the daemon server to wake up report streams, stays None in the add-on."""
 
   def __init__(self, data: dict, task_id: str, app_id: str, task_type: str, message: str = "", progress: int = 0, status: str = "created", result: dict = {}):
+    object.__setattr__(self, 'version', 0)
+    object.__setattr__(self, 'field_versions', {})
     self.data = data
     self.task_id = task_id
     self.app_id = app_id
@@ -13,40 +36,162 @@ class Task():
     
     self.message = message
     self.progress = progress
-    self.status = status # created / finished / error
+    self.status = status # created / finished / error / cancelled
     self.result = result
 
     self.async_task: asyncio.Task | None = None
 
+  def __setattr__(self, name, value):
+    object.__setattr__(self, name, value)
+    if name in REPORTED_FIELDS:
+      version = self.version + 1
+      object.__setattr__(self, 'version', version)
+      self.field_versions[name] = version
+      if name == 'status' and value in TERMINAL_STATUSES:
+        self.field_versions['data'] = version
+
   def change_progress(self, progress: int, message: str, status: str = ""):
     self.progress = progress
     self.message = message
     if status != "":
       self.status = status
+    self.changed()
 
   def error(self, message: str, progress: int = -1):
     self.message = message
     self.status = "error"
     if progress != -1:
       self.progress = progress
+    self.changed()
 
   def finished(self, message: str):
     self.message = message
     self.status = "finished"
+    self.changed()
+
+  def changed(self):
+    """Notify the listener (if any) that the task has changed."""
+    if Task.on_change is not None:
+      Task.on_change(self)
+
+  def cancelled(self, message: str):
+    self.message = message
+    self.status = "cancelled"
+    self.changed()
 
   def cancel(self):
+    """Cancel the asyncio task doing the work. The coroutine is responsible for cleaning up and calling cancelled()."""
     if type(self.async_task) == asyncio.Task:
       self.async_task.cancel()
 
   def __str__(self):
     return f'ID={self.task_id}, APP_ID={self.app_id}'
 
+  def public_data(self) -> dict:
+    return {key: value for key, value in self.data.items() if key not in PRIVATE_DATA}
+
   def to_JSON(self) -> str:
-    async_task = self.async_task
-    del self.async_task
-    result = json.dumps(self, default=lambda x: x.__dict__)
-    self.async_task = async_task
-    return result
-
-  def to_seriazable_object(self):
-    return json.loads(self.to_JSON())
+    return json.dumps(self.to_seriazable_object())
+
+  def to_seriazable_object(self) -> dict:
+    """Get full snapshot of the task, as reported to the add-on."""
+    return {
+      'task_id': self.task_id,
+      'app_id': self.app_id,
+      'task_type': self.task_type,
+      'message': self.message,
+      'progress': self.progress,
+      'status': self.status,
+      'result': self.result,
+      'data': self.public_data(),
+      'version': self.version,
+    }
+
+  @classmethod
+  def from_report(cls, report: dict) -> 'Task':
+    """Make task from its full snapshot, used by the add-on."""
+    return cls(report['data'], report['task_id'], report['app_id'], report['task_type'], report['message'], report['progress'], report['status'], report['result'])
+
+  def update_from_report(self, report: dict):
+    """Apply changed fields from a delta report, used by the add-on."""
+    for field in REPORTED_FIELDS:
+      if field in report:
+        setattr(self, field, report[field])
+
+  def to_delta(self, since: int) -> dict:
+    """Get fields changed after the version `since`."""
+    delta = {'task_id': self.task_id, 'version': self.version}
+    for field in REPORTED_FIELDS:
+      if self.field_versions.get(field, 0) > since:
+        delta[field] = self.public_data() if field == 'data' else getattr(self, field)
+    return delta
+
+
+class TaskRegistry():
+  """Holds tasks indexed by task_id and by app_id.
+
+  Tasks in a terminal status (finished, error, cancelled) are removed when reported to the app,
+  or evicted when they were not reported for `ttl` seconds or when there are more than `max_done` of them.
+  """
+
+  def __init__(self, ttl: float = 300, max_done: int = 1000):
+    self.ttl = ttl
+    self.max_done = max_done
+    self._by_id: dict[str, Task] = {}
+    self._by_app: dict = {}
+    self._done: OrderedDict[str, float] = OrderedDict()  # task_id: time of reaching terminal status, oldest first
+
+  def __len__(self):
+    return len(self._by_id)
+
+  def __iter__(self):
+    return iter(list(self._by_id.values()))
+
+  def __contains__(self, task: Task):
+    return task.task_id in self._by_id
+
+  def add(self, task: Task):
+    """Register a new task."""
+    self._by_id[task.task_id] = task
+    self._by_app.setdefault(task.app_id, {})[task.task_id] = task
+    self.task_changed(task)
+
+  def get(self, task_id: str) -> Task | None:
+    return self._by_id.get(task_id)
+
+  def remove(self, task: Task):
+    """Remove the task from the registry. Does nothing if the task is not registered."""
+    self._by_id.pop(task.task_id, None)
+    self._done.pop(task.task_id, None)
+    app_tasks = self._by_app.get(task.app_id)
+    if app_tasks is None:
+      return
+    app_tasks.pop(task.task_id, None)
+    if len(app_tasks) == 0:
+      del self._by_app[task.app_id]
+
+  def for_app(self, app_id) -> list[Task]:
+    """Get all tasks of the app."""
+    return list(self._by_app.get(app_id, {}).values())
+
+  def task_changed(self, task: Task):
+    """Start counting the time-to-live of the task once it reached a terminal status."""
+    if task.status not in TERMINAL_STATUSES or task.task_id in self._done:
+      return
+    if task.task_id not in self._by_id:
+      return
+    self._done[task.task_id] = time.time()
+    if len(self._done) > self.max_done:
+      self.evict()
+
+  def evict(self) -> int:
+    """Remove terminal tasks which are too old or over the count limit. Returns number of evicted tasks."""
+    now = time.time()
+    evicted = 0
+    while len(self._done) > 0:
+      task_id, done_time = next(iter(self._done.items()))
+      if len(self._done) <= self.max_done and now - done_time < self.ttl:
+        break
+      self.remove(self._by_id[task_id])
+      evicted += 1
+    return evicted
@@ -0,0 +1,248 @@
+"""Holds index of downloaded thumbnails with a size budget."""
+
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+
+
+INDEX_NAME = 'thumbnails_index.json'
+LOCK_NAME = 'thumbnails_index.lock'
+LOCK_STALE = 10
+"""Seconds after which a lock left by a crashed process is ignored."""
+
+
+class ThumbnailCache():
+  """Index of downloaded thumbnails with a size budget and least recently used eviction.
+
+  Thumbnails are keyed by their path relative to the temp dir, which is given by the URL of the image.
+  The index is kept in memory and in `thumbnails_index.json` in the temp dir.
+  Daemons (of several Blender instances) sharing the temp dir merge their changes into the index file under a lock file.
+  All filesystem work (scans, the lock, reading and writing the index, removing evicted files) runs in the I/O pool,
+  the in-memory index is only changed on the event loop.
+  """
+
+  def __init__(self, io_executor, max_size: int = 512 * 1024 * 1024):
+    self.io_executor = io_executor
+    self.max_size = max_size
+    self.directory: str | None = None
+    self.entries: OrderedDict[str, dict] = OrderedDict()  # relative path: {'size': bytes, 'used': time}, least recently used first
+    self.size = 0
+    self.synced: set[str] = set()  # keys in the index file at the last sync
+    self.removed: set[str] = set()  # keys evicted since the last sync
+    self.to_delete: list[str] = []  # paths of evicted thumbnails, deleted in the I/O pool on the next sync
+    self.dirty = False
+    self.lock = asyncio.Lock()  # one load or sync at a time
+
+  def configure(self, max_size: int | None = None):
+    if max_size is not None:
+      self.max_size = max(int(max_size), 0)
+      self.dirty = True
+
+  def get_config(self) -> dict:
+    return {'max_size': self.max_size, 'size': self.size, 'entries': len(self.entries)}
+
+  async def set_directory(self, directory: str):
+    """Set the temp dir holding the thumbnail folders. The index is loaded (or built by scanning the folders) on the first call."""
+
+    async with self.lock:
+      if self.directory == directory:
+        return
+      self.directory = directory
+      self.entries.clear()
+      self.synced.clear()
+      self.removed.clear()
+      self.size = 0
+      if not await self.io_executor.run(os.path.isfile, os.path.join(directory, INDEX_NAME)):
+        for key, entry in await self.io_executor.run(scan, directory):
+          self.entries[key] = entry
+        self.size = sum(entry['size'] for entry in self.entries.values())
+      await self._sync()
+
+  def contains(self, path: str) -> bool:
+    """Check whether the thumbnail is downloaded and mark it as recently used.
+    The index is trusted without touching the disk, thumbnails deleted behind the daemon's back are dropped by check().
+    """
+
+    key = self._key(path)
+    entry = self.entries.get(key)
+    if entry is None:
+      return False
+    entry['used'] = time.time()
+    self.entries.move_to_end(key)
+    self.dirty = True
+    return True
+
+  def add(self, path: str, size: int):
+    """Add downloaded thumbnail to the index, evict the least recently used ones if over budget."""
+
+    key = self._key(path)
+    old = self.entries.pop(key, None)
+    if old is not None:
+      self.size -= old['size']
+    self.entries[key] = {'size': size, 'used': time.time()}
+    self.size += size
+    self.removed.discard(key)
+    self.dirty = True
+    self._evict()
+
+  def remove(self, path: str):
+    """Forget the thumbnail, e.g. because its file is missing."""
+
+    entry = self.entries.pop(self._key(path), None)
+    if entry is not None:
+      self.size -= entry['size']
+      self.removed.add(self._key(path))
+      self.dirty = True
+
+  async def check(self):
+    """Drop thumbnails which are no longer on disk (e.g. removed by a temp cleaner) from the index.
+    Lists each thumbnail folder once in the I/O pool instead of checking files one by one.
+    """
+
+    async with self.lock:
+      if self.directory is None:
+        return
+      missing = await self.io_executor.run(find_missing, self.directory, list(self.entries.keys()))
+      for key in missing:
+        self.remove(os.path.join(self.directory, key))
+
+  async def sync(self):
+    """Merge the in-memory index with the index file and write it back.
+
+    Thumbnails added by other processes are taken over, thumbnails evicted by other processes are forgotten.
+    """
+
+    async with self.lock:
+      await self._sync()
+
+  async def _sync(self):
+    if self.directory is None:
+      return
+    snapshot = {key: dict(entry) for key, entry in self.entries.items()}
+    removed, self.removed = self.removed, set()
+    to_delete, self.to_delete = self.to_delete, []
+    self.dirty = False
+    merged = await self.io_executor.run(merge_index, self.directory, snapshot, set(self.synced), removed, to_delete)
+
+    # changes made on the event loop while the index file was merged win
+    for key, entry in self.entries.items():
+      if key not in snapshot or entry['used'] != snapshot[key]['used']:
+        merged[key] = entry
+    for key in self.removed:
+      merged.pop(key, None)
+    self.synced = set(merged.keys())
+    self.entries = OrderedDict(sorted(merged.items(), key=lambda item: item[1]['used']))
+    self.size = sum(entry['size'] for entry in self.entries.values())
+    self._evict()
+
+  def _key(self, path: str) -> str:
+    return os.path.relpath(path, self.directory)
+
+  def _evict(self):
+    while self.size > self.max_size and len(self.entries) > 0:
+      key, entry = self.entries.popitem(last=False)
+      self.size -= entry['size']
+      self.removed.add(key)
+      self.to_delete.append(os.path.join(self.directory, key))
+      self.dirty = True
+
+
+def scan(directory: str) -> list[tuple[str, dict]]:
+  """Build the index from the thumbnail folders, used when there is no index file yet. Returns entries least recently used first."""
+
+  entries = []
+  for folder in os.scandir(directory):
+    if not folder.is_dir() or not folder.name.endswith('_search'):
+      continue
+    for f in os.scandir(folder.path):
+      if not f.is_file() or f.name.endswith('.part'):
+        continue
+      stat = f.stat()
+      entries.append((os.path.relpath(f.path, directory), {'size': stat.st_size, 'used': stat.st_mtime}))
+  return sorted(entries, key=lambda item: item[1]['used'])
+
+
+def find_missing(directory: str, keys: list[str]) -> list[str]:
+  """Get keys of thumbnails which are not on disk. Runs in the I/O pool."""
+
+  folders = {}
+  for key in keys:
+    folders.setdefault(os.path.dirname(key), []).append(key)
+  missing = []
+  for folder, folder_keys in folders.items():
+    try:
+      names = set(os.listdir(os.path.join(directory, folder)))
+    except OSError:
+      names = set()
+    missing.extend(key for key in folder_keys if os.path.basename(key) not in names)
+  return missing
+
+
+def merge_index(directory: str, entries: dict, synced: set, removed: set, to_delete: list) -> dict:
+  """Merge entries with the index file under the lock file, write the result back and return it. Runs in the I/O pool.
+  Also deletes files of evicted thumbnails.
+  """
+
+  for path in to_delete:
+    try:
+      os.remove(path)
+    except OSError:
+      pass  # already removed
+
+  index_path = os.path.join(directory, INDEX_NAME)
+  with IndexLock(os.path.join(directory, LOCK_NAME)):
+    disk = {}
+    if os.path.isfile(index_path):
+      try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+          disk = json.load(f)
+      except Exception as e:
+        print(f'Could not read thumbnail index {index_path}: {e}')
+
+    merged = {}
+    for key, entry in entries.items():
+      if key in synced and key not in disk:
+        continue  # evicted by another process
+      merged[key] = entry
+    for key, entry in disk.items():
+      if key in removed:
+        continue
+      if key in merged:
+        merged[key]['used'] = max(merged[key]['used'], entry['used'])
+      else:
+        merged[key] = entry
+
+    tmp_path = f'{index_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+      json.dump(merged, f)
+    os.replace(tmp_path, index_path)
+  return merged
+
+
+class IndexLock():
+  """Lock file shared by processes writing the index. A lock older than LOCK_STALE seconds is taken over."""
+
+  def __init__(self, path: str):
+    self.path = path
+
+  def __enter__(self):
+    deadline = time.time() + LOCK_STALE
+    while True:
+      try:
+        os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return self
+      except FileExistsError:
+        try:
+          if time.time() - os.path.getmtime(self.path) > LOCK_STALE or time.time() > deadline:
+            os.remove(self.path)
+        except OSError:
+          pass  # released meanwhile
+        time.sleep(0.01)
+
+  def __exit__(self, *args):
+    try:
+      os.remove(self.path)
+    except OSError:
+      pass
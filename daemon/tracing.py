@@ -0,0 +1,73 @@
+"""Holds spans of task stages, exportable as Chrome trace JSON (open in chrome://tracing or ui.perfetto.dev).
+
+Used by both the daemon and the add-on. Spans carry the task_id, so stages of one task done in the daemon
+and in the add-on end up on the same track when the traces of both processes are merged.
+Timestamps are wall clock microseconds, so spans from both processes line up.
+"""
+
+import contextlib
+import os
+import time
+import zlib
+from collections import deque
+
+
+MAX_SPANS = 10000
+"""How many latest spans are kept, older ones are dropped."""
+
+spans: deque = deque(maxlen=MAX_SPANS)
+process_name: str = 'blender'
+"""Name of the process shown in the trace, the daemon sets its own."""
+
+
+def now() -> float:
+  """Get current time in trace units (microseconds)."""
+
+  return time.time() * 1e6
+
+
+def add_span(name: str, start: float, end: float, task_id: str = '', **args):
+  """Record span from start to end (in trace units), used for stages which don't fit into a with block."""
+
+  spans.append({
+    'name': name,
+    'ph': 'X',
+    'ts': start,
+    'dur': max(end - start, 0),
+    'pid': os.getpid(),
+    'tid': track_id(task_id),
+    'args': {'task_id': task_id, **args},
+  })
+
+
+@contextlib.contextmanager
+def span(name: str, task_id: str = '', **args):
+  """Record span of the with block, also when the block raises or is cancelled."""
+
+  start = now()
+  try:
+    yield
+  finally:
+    add_span(name, start, now(), task_id, **args)
+
+
+def track_id(task_id: str) -> int:
+  """Get numeric track of the task, trace viewers expect numbers as thread ids."""
+
+  return zlib.crc32(task_id.encode()) & 0x7fffffff
+
+
+def get_events(task_id: str | None = None) -> list:
+  """Get recorded spans of the task (or all spans) with metadata naming the process and task tracks."""
+
+  events = [s for s in spans if task_id is None or s['args']['task_id'] == task_id]
+  pid = os.getpid()
+  metadata = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': f'{process_name} {pid}'}}]
+  for tid in {s['args']['task_id'] for s in events}:
+    metadata.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': track_id(tid), 'args': {'name': tid or 'untracked'}})
+  return metadata + events
+
+
+def to_chrome_trace(events: list) -> dict:
+  return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
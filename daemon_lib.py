@@ -1,16 +1,57 @@
+import asyncio
+import json
 import os
 import platform
+import queue
+import socket
 import subprocess
 import sys
+import threading
 import time
+import uuid
 from os import environ, path
 
 import aiohttp
 import bpy
 import requests
-
-from . import dependencies, global_vars
-
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, MaxRetryError, NewConnectionError
+
+from . import async_loop, dependencies, global_vars
+from .daemon import tasks, tracing
+
+
+STREAM_READ_TIMEOUT = 15
+"""Seconds without any data (the daemon sends heartbeats every few seconds) after which the report stream is reconnected."""
+DAEMON_START_TIMEOUT = 30
+"""Seconds to wait for a starting daemon to become ready."""
+
+daemon_starting = threading.Event()
+"""Set while the daemon is being started, so the UI can tell the user what it waits for."""
+daemon_start_lock = threading.Lock()
+"""Held while the daemon is being started, so threads needing the daemon at the same time don't start it twice."""
+
+report_stream_queue = queue.Queue()
+"""Lists of reports received from the report stream (or responses of polls on the async loop), waiting to be handled on the main thread.
+None is put in when the stream (re)connects or drops, the daemon then sends full snapshots again."""
+report_cache = {}
+"""Unfinished tasks of this Blender keyed by task_id, reports with changed fields from the daemon are merged into them."""
+report_seq = 0
+"""Number of the last polled report, acknowledged in the next poll. 0 makes the daemon send full snapshots."""
+on_activity = None
+"""Optional callable called on the main thread when a search or download is requested, set by timer to poll fast again."""
+report_stream_connected = threading.Event()
+report_stream_thread = None
+report_stream_stop = None
+report_stream_future = None
+"""Report stream running on the async loop, used instead of report_stream_thread when the loop runs."""
+report_poll_future = None
+"""Poll of reports running on the async loop, at most one at a time."""
+daemon_client = None
+batches = {}
+"""State of batches submitted by this Blender, keyed by batch_id. Updated from reports of the batch and its searches."""
 
 def get_address() -> str:
   """Get address of the daemon."""
@@ -27,65 +68,460 @@ def get_port() -> str:
 
   return str(port)
 
-async def get_reports_async(app_id: str, queue):
-  """Get report for all task at once with asyncio and aiohttp."""
-  global reports_queue
-  address = get_address()
-  url = address + "/report"
-  t = time.time()
-  async with aiohttp.ClientSession() as session:
-    # ensure_daemon_alive(session)
-    data = {'app_id': app_id}
-    async with session.get(url, json=data) as resp:
-      # text = await resp.text()
-      json_data = await resp.json()
-      if len(json_data)>0:
-        queue.put(json_data)
+class UnixHTTPConnection(HTTPConnection):
+  """HTTP connection over Unix domain socket of the daemon."""
 
-def get_reports(app_id: str):
-  """Get report for all tasks at once."""
+  def __init__(self, *args, socket_path: str = '', **kwargs):
+    self.socket_path = socket_path
+    super().__init__(*args, **kwargs)
 
-  address = get_address()
+  def _new_conn(self) -> socket.socket:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(self.timeout if isinstance(self.timeout, (int, float)) else None)
+    try:
+      sock.connect(self.socket_path)
+    except OSError as e:
+      sock.close()
+      raise NewConnectionError(self, f'Failed to connect to {self.socket_path}: {e}') from e
+    return sock
+
+
+class UnixHTTPConnectionPool(HTTPConnectionPool):
+  ConnectionCls = UnixHTTPConnection
+
+  def __init__(self, socket_path: str, maxsize: int):
+    super().__init__('localhost', maxsize=maxsize, socket_path=socket_path)
+
+
+class UnixSocketAdapter(HTTPAdapter):
+  """Sends requests for the daemon over its Unix domain socket instead of TCP."""
+
+  def __init__(self, socket_path: str, pool_maxsize: int = 4):
+    self.pool = UnixHTTPConnectionPool(socket_path, pool_maxsize)
+    super().__init__(max_retries=0)
+
+  def get_connection(self, url, proxies=None):
+    return self.pool
+
+  def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+    return self.pool
+
+  def close(self):
+    self.pool.close()
+    super().close()
+
+
+class DaemonClient():
+  """Keeps persistent keep-alive connections to the daemon, so requests don't pay a new connection and a liveness probe.
+
+  The daemon is probed (and started) only when a request fails to connect, then the request is retried once.
+  Requests which may have reached the daemon (e.g. a dropped keep-alive connection) are not retried, so a task is not started twice.
+  If the daemon advertises a Unix domain socket (X-Unix-Socket header), further requests use it instead of TCP.
+  """
+
+  def __init__(self, pool_maxsize: int = 4):
+    self.pool_maxsize = pool_maxsize
+    self.session = requests.Session()
+    self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize))
+    self.socket_path = None
+
+  def request(self, method: str, path: str, start_daemon: bool = True, **kwargs) -> requests.Response:
+    """Send request to the daemon, path is relative to its address, e.g. '/report'."""
+
+    url = get_address() + path
+    try:
+      resp = self.session.request(method, url, **kwargs)
+    except requests.exceptions.ConnectionError as e:
+      if not failed_to_connect(e):
+        raise
+      self.use_tcp()
+      if start_daemon:
+        ensure_daemon_alive(self.session)
+      resp = self.session.request(method, url, **kwargs)
+
+    self.update_transport(resp)
+    return resp
+
+  def update_transport(self, resp: requests.Response):
+    socket_path = resp.headers.get('X-Unix-Socket')
+    if socket_path == self.socket_path:
+      return
+    if socket_path is None or not hasattr(socket, 'AF_UNIX') or not path.exists(socket_path):
+      self.use_tcp()
+      return
+    self.session.mount(get_address() + '/', UnixSocketAdapter(socket_path, self.pool_maxsize))
+    self.socket_path = socket_path
+
+  def use_tcp(self):
+    """Stop using the Unix domain socket, e.g. when the daemon restarted without it."""
+
+    if self.socket_path is None:
+      return
+    adapter = self.session.adapters.pop(get_address() + '/', None)
+    if adapter is not None:
+      adapter.close()
+    self.socket_path = None
+
+  def close(self):
+    self.session.close()
+    self.socket_path = None
+
+
+def failed_to_connect(error: requests.exceptions.ConnectionError) -> bool:
+  """Check whether the request failed because the connection could not be opened, so nothing was sent to the daemon."""
+
+  reason = error.args[0] if len(error.args) > 0 else None
+  if isinstance(reason, MaxRetryError):
+    reason = reason.reason
+  return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def get_client() -> DaemonClient:
+  """Get client shared by all requests of the add-on to the daemon."""
+
+  global daemon_client
+  if daemon_client is None:
+    daemon_client = DaemonClient()
+  return daemon_client
+
+async def request_async(method: str, url: str, **kwargs):
+  """Send request to the daemon on the async loop and return its JSON response (None if it is not JSON).
+  If the connection to the daemon can't be established, it is started in the loop's thread pool and the request is retried once.
+  Requests which reached the daemon are never retried, so a task is not started twice.
+  """
+
+  try:
+    async with async_loop.session.request(method, url, **kwargs) as resp:
+      return await read_response(resp)
+  except aiohttp.ClientConnectorError:
+    await asyncio.get_running_loop().run_in_executor(None, start_daemon_if_needed)
+    async with async_loop.session.request(method, url, **kwargs) as resp:
+      return await read_response(resp)
+
+async def read_response(resp: aiohttp.ClientResponse):
+  resp.raise_for_status()
+  if resp.content_type != 'application/json':
+    return None
+  return await resp.json()
+
+def start_daemon_if_needed():
   with requests.Session() as session:
     ensure_daemon_alive(session)
-    url = address + "/report"
-    data = {'app_id': app_id}
-    resp = session.get(url, json=data)
 
-    return resp.json()
+async def post_task_async(url: str, body: str, failed_reports: list, span_name: str = '', span_id: str = ''):
+  """Post new task(s) with client-generated task_ids to the daemon, the span of the request is recorded if span_name is given.
+  The body is serialized on the main thread, so callers may keep changing their data. If the request fails,
+  failed_reports (see get_failed_report()) are handed to the main thread, so the add-on doesn't wait for the tasks forever.
+  """
+
+  start = tracing.now()
+  try:
+    await request_async('POST', url, data=body, headers={'Content-Type': 'application/json'})
+  except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+    for report in failed_reports:
+      report['message'] = f'Request to BlenderKit daemon failed: {e}'
+    report_stream_queue.put(failed_reports)
+    return
+  if span_name != '':
+    tracing.add_span(span_name, start, tracing.now(), span_id)
+
+def get_failed_report(data: dict, task_type: str) -> dict:
+  """Get report of an errored task, handed to the main thread the same way as reports of the daemon if the task never reaches it."""
+
+  task = tasks.Task(data, data['task_id'], os.getpid(), task_type, status='error')
+  return task.to_seriazable_object()
+
+def send_task(path: str, data: dict, task_type: str, span_name: str = '') -> dict:
+  """Send new task to the daemon, returns {'task_id': ...}.
+
+  When the async loop runs, the task_id is generated here and the request is sent without waiting for it,
+  so a stalled network or a starting daemon never blocks the UI. Otherwise the request is sent right away.
+  """
+
+  notify_activity()
+  data['app_id'] = os.getpid()
+  if async_loop.is_running():
+    data['task_id'] = str(uuid.uuid4())
+    failed_reports = [get_failed_report(data, task_type)]
+    async_loop.submit(post_task_async(get_address() + path, json.dumps(data), failed_reports, span_name, data['task_id']))
+    return {'task_id': data['task_id']}
+
+  start = tracing.now()
+  response = get_client().request('POST', path, json=data).json()
+  if span_name != '':
+    tracing.add_span(span_name, start, tracing.now(), response['task_id'])
+  return response
+
+def send_request(method: str, path: str, data: dict):
+  """Send request whose response is not needed, on the async loop if it runs."""
+
+  if async_loop.is_running():
+    async_loop.submit(request_async(method, get_address() + path, json=data))
+    return
+  get_client().request(method, path, json=data)
+
+def request_reports(app_id):
+  """Poll reports on the async loop, the response is handed to the main thread through report_stream_queue."""
+
+  global report_poll_future
+  if report_poll_future is not None and not report_poll_future.done():
+    return
+
+  async def poll(url: str, data: dict):
+    report_stream_queue.put(await request_async('GET', url, json=data))
+
+  report_poll_future = async_loop.submit(poll(get_address() + '/report', {'app_id': app_id, 'ack': report_seq}))
+
+def get_reports(app_id: str):
+  """Get tasks changed since the last call, see merge_reports()."""
+
+  global report_seq
+  resp = get_client().request('GET', '/report', json={'app_id': app_id, 'ack': report_seq})
+  response = resp.json()
+  report_seq = response['seq']
+  return merge_reports(response['tasks'])
+
+def merge_reports(reports: list) -> list[tasks.Task]:
+  """Merge full snapshots and changed fields of tasks from the daemon into tasks.
+
+  Each unfinished task is kept as one tasks.Task updated in place, so reports don't build new objects on every tick.
+  Full snapshots are recognized by having task_type, which never changes.
+  """
+
+  results = list()
+  for report in reports:
+    task = report_cache.get(report['task_id'])
+    if 'task_type' in report:
+      if task is None:
+        task = tasks.Task.from_report(report)
+      else:
+        task.update_from_report(report)
+    elif task is None:
+      continue  # snapshot of the task was missed, e.g. during a reconnect
+    else:
+      task.update_from_report(report)
+    if task.status in tasks.TERMINAL_STATUSES:
+      report_cache.pop(task.task_id, None)
+    else:
+      report_cache[task.task_id] = task
+    results.append(task)
+  return results
+
+def start_report_stream(app_id):
+  """Start a background thread (or a coroutine on the async loop if it runs) which keeps one connection to the daemon's report stream.
+  Received reports are put into report_stream_queue, so the main thread never waits for the network.
+  """
+
+  global report_stream_thread, report_stream_stop, report_stream_future
+  if async_loop.is_running():
+    if report_stream_future is None or report_stream_future.done():
+      report_stream_future = async_loop.submit(consume_report_stream_async(get_address(), app_id))
+    return
+
+  if report_stream_thread is not None and report_stream_thread.is_alive():
+    return
+
+  report_stream_stop = threading.Event()
+  report_stream_thread = threading.Thread(
+    target=consume_report_stream,
+    args=(get_address(), app_id, report_stream_stop),
+    daemon=True,
+  )
+  report_stream_thread.start()
+
+def stop_report_stream():
+  """Stop the report stream. The thread finishes at the latest after the next heartbeat from the daemon, the coroutine right away."""
+
+  global report_stream_thread, report_stream_future
+  if report_stream_stop is not None:
+    report_stream_stop.set()
+  report_stream_thread = None
+  if report_stream_future is not None:
+    report_stream_future.cancel()
+  report_stream_future = None
+  report_stream_connected.clear()
+
+def consume_report_stream(address: str, app_id, stop: threading.Event):
+  """Read reports from the daemon's report stream until stopped. Reconnects (and starts the daemon if needed) when the connection drops."""
+
+  url = address + "/report_stream"
+  while not stop.is_set():
+    try:
+      with requests.Session() as session:
+        ensure_daemon_alive(session)
+        with session.get(url, json={'app_id': app_id, 'delta': True}, stream=True, timeout=(5, STREAM_READ_TIMEOUT)) as resp:
+          report_stream_queue.put(None)
+          report_stream_connected.set()
+          for line in resp.iter_lines():
+            if stop.is_set():
+              break
+            if line:
+              report_stream_queue.put(json.loads(line))
+    except Exception as e:
+      print(f'Report stream from daemon interrupted: {e}')
+    if report_stream_connected.is_set():
+      report_stream_queue.put(None)
+    report_stream_connected.clear()
+    stop.wait(1)
+
+async def consume_report_stream_async(address: str, app_id):
+  """Read reports from the daemon's report stream on the async loop until cancelled, same as consume_report_stream()."""
+
+  url = address + "/report_stream"
+  timeout = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=STREAM_READ_TIMEOUT)
+  while True:
+    try:
+      await asyncio.get_running_loop().run_in_executor(None, start_daemon_if_needed)
+      async with async_loop.session.get(url, json={'app_id': app_id, 'delta': True}, timeout=timeout) as resp:
+        report_stream_queue.put(None)
+        report_stream_connected.set()
+        buffer = b''
+        # lines with search results can be longer than aiohttp allows for readline()
+        async for data in resp.content.iter_any():
+          *lines, buffer = (buffer + data).split(b'\n')
+          for line in lines:
+            if line:
+              report_stream_queue.put(json.loads(line))
+    except asyncio.CancelledError:
+      report_stream_connected.clear()
+      raise
+    except Exception as e:
+      print(f'Report stream from daemon interrupted: {e}')
+    if report_stream_connected.is_set():
+      report_stream_queue.put(None)
+    report_stream_connected.clear()
+    await asyncio.sleep(1)
+
+def get_streamed_reports() -> list:
+  """Get tasks changed in the reports received from the report stream since the last call, see merge_reports()."""
+
+  global report_seq
+  results = list()
+  while not report_stream_queue.empty():
+    reports = report_stream_queue.get()
+    if reports is None:
+      report_cache.clear()
+      report_seq = 0
+      continue
+    if isinstance(reports, dict):
+      # response of a poll on the async loop
+      report_seq = reports['seq']
+      reports = reports['tasks']
+    results.extend(merge_reports(reports))
+  return results
+
+def notify_activity():
+  if on_activity is not None:
+    on_activity()
 
 def search_asset(data):
   """Search for specified asset."""
 
-  address = get_address()
-  data['app_id'] = os.getpid()
-  with requests.Session() as session:
-    ensure_daemon_alive(session)
-    url = address + "/search_asset"
-    resp = session.post(url, json=data)
-    return resp.json()
+  return send_task('/search_asset', data, 'search', 'request_search')
+
+def download_thumbnail(data):
+  """Download single thumbnail right away (used for full size tooltip images)."""
+
+  return send_task('/download_thumbnail', data, 'thumbnail_download')
+
+def set_visible_thumbnails(asset_base_ids: list):
+  """Tell the daemon which assets are visible in the asset bar, so their thumbnails are downloaded first."""
+
+  send_request('POST', '/thumbnails_visible', {'app_id': os.getpid(), 'assetBaseIds': asset_base_ids})
 
 def download_asset(data):
   """Download specified asset."""
 
-  address = get_address()
-  data['app_id'] = os.getpid()
-  with requests.Session() as session:
-    ensure_daemon_alive(session)
-    url = address + "/download_asset"
-    resp = session.post(url, json=data)
-    return resp.json()
+  return send_task('/download_asset', data, 'asset_download', 'request_download')
+
+
+def submit_batch(downloads: list | None = None, searches: list | None = None, shared: dict | None = None) -> dict:
+  """Submit many downloads and searches in one request, e.g. when populating a scene from a manifest.
+
+  Items are the same data as passed to download_asset() and search_asset(), keys of `shared` (e.g. PREFS) are added
+  to every item by the daemon. Downloads have 'background' priority unless they set their own.
+  Returns {'batch_id': ..., 'downloads': [task_id], 'searches': [task_id]} with task_ids in the order of the items.
+  The progress of the batch and results of its searches are kept in `batches`, see get_batch().
+  When the async loop runs, the ids are generated here and the request is sent without waiting for it, like send_task().
+  """
+
+  downloads = downloads if downloads is not None else []
+  searches = searches if searches is not None else []
+  shared = shared if shared is not None else {}
+  notify_activity()
+  data = {'app_id': os.getpid(), 'downloads': downloads, 'searches': searches, 'shared': shared}
+  if async_loop.is_running():
+    data['task_id'] = str(uuid.uuid4())
+    for item in downloads + searches:
+      item['task_id'] = str(uuid.uuid4())
+    response = {
+      'batch_id': data['task_id'],
+      'downloads': [item['task_id'] for item in downloads],
+      'searches': [item['task_id'] for item in searches],
+    }
+    failed_reports = [get_failed_report({'task_id': data['task_id']}, 'batch')]
+    failed_reports.extend(get_failed_report(item, 'asset_download') for item in downloads)
+    failed_reports.extend(get_failed_report(item, 'batch_search') for item in searches)
+    async_loop.submit(post_task_async(get_address() + '/batch', json.dumps(data), failed_reports, 'request_batch', data['task_id']))
+  else:
+    start = tracing.now()
+    resp = get_client().request('POST', '/batch', json=data)
+    resp.raise_for_status()
+    response = resp.json()
+    tracing.add_span('request_batch', start, tracing.now(), response['batch_id'], items=len(downloads) + len(searches))
+  batches[response['batch_id']] = {
+    'status': 'created',
+    'progress': 0,
+    'message': 'Starting batch',
+    'result': {},
+    'searches': {task_id: None for task_id in response['searches']},
+  }
+  return response
+
+
+def get_batch(batch_id: str) -> dict | None:
+  """Get state of the batch: {'status', 'progress', 'message', 'result', 'searches'}.
+  Result counts the finished, errored and cancelled items once the batch is done,
+  searches hold the search responses (None while searching) keyed by task_id.
+  """
+
+  return batches.get(batch_id)
+
+
+def handle_batch_task(task):
+  """Update state of the batch from the report of the batch task or of its search."""
+
+  if task.task_type == 'batch':
+    batch = batches.get(task.task_id)
+    if batch is not None:
+      batch.update(status=task.status, progress=task.progress, message=task.message, result=task.result)
+  elif task.task_type == 'batch_search':
+    batch = batches.get(task.data.get('batch_id'))
+    if batch is not None and task.status == 'finished':
+      batch['searches'][task.task_id] = task.result
 
 
 def kill_download(task_id):
-  """Kill the specified task with ID on the daemon."""
+  """Kill the specified task with ID on the daemon. Killing a batch_id kills all running items of the batch."""
 
-  address = get_address()
-  with requests.Session() as session:
-    ensure_daemon_alive(session)
-    url = address + "/kill_download"
-    resp = session.get(url, json={'task_id':task_id})
-    return resp
+  send_request('GET', '/kill_download', {'task_id':task_id})
+
+
+def export_trace(filepath: str, task_id: str | None = None):
+  """Write spans of the add-on and the daemon into Chrome trace JSON file, open it in chrome://tracing or ui.perfetto.dev.
+  Only spans of one task are exported if task_id is given.
+  """
+
+  events = tracing.get_events(task_id)
+  try:
+    params = {} if task_id is None else {'task_id': task_id}
+    resp = get_client().request('GET', '/trace', start_daemon=False, params=params, timeout=5)
+    events.extend(resp.json()['traceEvents'])
+  except Exception as e:
+    print(f'Could not get trace from daemon, exporting only spans of the add-on: {e}')
+
+  with open(filepath, 'w', encoding='utf-8') as f:
+    json.dump(tracing.to_chrome_trace(events), f)
 
 
 def ensure_daemon_alive(session: requests.Session):
@@ -95,8 +531,40 @@ def ensure_daemon_alive(session: requests.Session):
   if isAlive == True:
     return
 
-  print(f'Starting daemon server on port {get_port()}')
-  start_daemon_server()
+  with daemon_start_lock:
+    # another thread might have started the daemon while this one waited for the lock
+    isAlive, _ = daemon_is_alive(session)
+    if isAlive == True:
+      return
+
+    print(f'Starting daemon server on port {get_port()}')
+    daemon_starting.set()
+    try:
+      daemon_process = start_daemon_server()
+      wait_for_daemon(daemon_process)
+    finally:
+      daemon_starting.clear()
+
+def wait_for_daemon(daemon_process: subprocess.Popen) -> bool:
+  """Wait until the daemon writes its ready file, or exits. Returns True if the daemon is ready."""
+
+  ready_path = get_ready_file_path()
+  deadline = time.time() + DAEMON_START_TIMEOUT
+  while time.time() < deadline:
+    if path.isfile(ready_path):
+      with open(ready_path, 'r', encoding='utf-8') as f:
+        ready = json.load(f)
+      print(f"Daemon server ready, PID: {ready['pid']}, startup phases (seconds): {ready['phases']}")
+      return True
+    if daemon_process.poll() is not None:
+      # e.g. another Blender started a daemon on the port meanwhile, or Python of Blender can't run the daemon
+      print(f'Daemon server exited with code {daemon_process.returncode}, log file located at: {get_log_path()}')
+      check_python()
+      return False
+    time.sleep(0.02)
+
+  print(f'Daemon server not ready after {DAEMON_START_TIMEOUT} seconds, log file located at: {get_log_path()}')
+  return False
 
 def daemon_is_alive(session: requests.Session) -> tuple[bool, str]:
   """Check whether daemon is responding."""
@@ -112,27 +580,25 @@ def daemon_is_alive(session: requests.Session) -> tuple[bool, str]:
     return False, f'EXCEPTION OCCURED:", {err}, {type(err)}'
 
 def report_blender_quit():
-  address = get_address()
-  with requests.Session() as session:
-    url = address + "/report_blender_quit"
-    resp = session.get(url, json={'app_id':os.getpid()})
-    return resp
+  return get_client().request('GET', '/report_blender_quit', start_daemon=False, json={'app_id':os.getpid()})
 
 def kill_daemon_server():
   ''' Request to restart the daemon server.'''
-  address = get_address()
-  with requests.Session() as session:
-    url = address + "/shutdown"
-    resp = session.get(url)
-    return resp
+  return get_client().request('GET', '/shutdown', start_daemon=False)
+
+def get_log_path() -> str:
+  log_dir = bpy.context.preferences.addons['blenderkit'].preferences.global_dir
+  return f'{log_dir}/blenderkit-daemon-{get_port()}.log'
 
-def start_daemon_server():
-  """Start daemon server in separate process."""
+def get_ready_file_path() -> str:
+  """Get path of the file the daemon started by this Blender writes when it is ready to serve."""
 
   log_dir = bpy.context.preferences.addons['blenderkit'].preferences.global_dir
-  log_path = f'{log_dir}/blenderkit-daemon-{get_port()}.log'
-  blenderkit_path = path.dirname(__file__)
-  daemon_path = path.join(blenderkit_path, 'daemon/daemon.py')
+  return f'{log_dir}/blenderkit-daemon-{get_port()}-{os.getpid()}.ready'
+
+def get_daemon_env() -> dict:
+  """Get environment for Python of Blender running the daemon."""
+
   vendor_dir = dependencies.get_vendored_path()
   fallback_dir = dependencies.get_fallback_path()
 
@@ -141,14 +607,15 @@ def start_daemon_server():
 
   python_home = path.abspath(path.dirname(sys.executable) + "/..")
   env['PYTHONHOME'] = python_home
-  
-
 
-  creation_flags = 0
   if platform.system() == "Windows":
     env['PATH'] = env['PATH'] + os.pathsep + path.abspath(path.dirname(sys.executable) + "/../../../blender.crt")
-    creation_flags = subprocess.CREATE_NO_WINDOW
+  return env
+
+def check_python():
+  """Check that Python of Blender runs in the environment of the daemon. Used to diagnose a daemon which failed to start."""
 
+  env = get_daemon_env()
   python_check = subprocess.run(args=[sys.executable, "--version"], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
   if python_check.returncode != 0:
     print(
@@ -158,6 +625,20 @@ def start_daemon_server():
       f"Where Python: {sys.executable}\n"
       f"Environment: {env}"
     )
+    print(f"Due to unsuccessful Python check the daemon server fails to run. Please report a bug at BlenderKit.")
+
+def start_daemon_server() -> subprocess.Popen:
+  """Start daemon server in separate process. Use wait_for_daemon() to wait until it is ready."""
+
+  log_path = get_log_path()
+  ready_path = get_ready_file_path()
+  daemon_path = path.join(path.dirname(__file__), 'daemon/daemon.py')
+  if path.exists(ready_path):
+    os.remove(ready_path)
+
+  creation_flags = 0
+  if platform.system() == "Windows":
+    creation_flags = subprocess.CREATE_NO_WINDOW
 
   with open(log_path, "wb") as log:
     daemon_process = subprocess.Popen(
@@ -168,15 +649,14 @@ def start_daemon_server():
         "--proxy-which", global_vars.PREFS.get('proxy_which'),
         "--proxy-address", global_vars.PREFS.get('proxy_address'),
         "--proxy-ca-certs", global_vars.PREFS.get('proxy_ca_certs'),
+        "--ready-file", ready_path,
+        "--started-at", str(time.time()),
       ],
-      env           = env,
+      env           = get_daemon_env(),
       stdout        = log,
       stderr        = log,
       creationflags = creation_flags,
     )
 
-  if python_check.returncode == 0:
-    print(f'Daemon server started on address {get_address()}, PID: {daemon_process.pid}, log file located at: {log_path}')
-  else:
-    print(f'Tried to start daemon server on address {get_address()}, PID: {daemon_process.pid},\nlog file located at: {log_path}')
-    print(f"Due to unsuccessful Python check the daemon server will probably fail to run. Please report a bug at BlenderKit.")
+  print(f'Daemon server started on address {get_address()}, PID: {daemon_process.pid}, log file located at: {log_path}')
+  return daemon_process
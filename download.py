@@ -39,7 +39,7 @@ from . import (
     ui_panels,
     utils,
 )
-from .daemon import tasks
+from .daemon import tasks, tracing
 
 
 bk_logger = logging.getLogger('blenderkit')
@@ -299,13 +299,12 @@ def udpate_asset_data_in_dicts(asset_data):
     sr = global_vars.DATA['search results']
     if not sr:
         return;
-    for i, r in enumerate(sr):
-        if r['assetBaseId'] == asset_data['assetBaseId']:
-            for f in asset_data['files']:
-                if f.get('url'):
-                    for f1 in r['files']:
-                        if f1['fileType'] == f['fileType']:
-                            f1['url'] = f['url']
+    for r in sr.find_by_base_id(asset_data['assetBaseId']):
+        for f in asset_data['files']:
+            if f.get('url'):
+                for f1 in r['files']:
+                    if f1['fileType'] == f['fileType']:
+                        f1['url'] = f['url']
 
 
 def append_asset(asset_data, **kwargs):  # downloaders=[], location=None,
@@ -605,9 +604,8 @@ def download_timer():
         if t.is_alive():  # set downloader size
             sr = global_vars.DATA.get('search results')
             if sr is not None:
-                for r in sr:
-                    if asset_data['id'] == r['id']:
-                        r['downloaded'] = 0.5  # tcom.progress
+                for r in sr.find_by_id(asset_data['id']):
+                    r['downloaded'] = 0.5  # tcom.progress
         if not t.is_alive():
             if tcom.error:
                 sprops = utils.get_search_props()
@@ -675,9 +673,8 @@ def download_timer():
                         download(asset_data, **tcom.passargs)
 
                     if global_vars.DATA['search results'] is not None and done:
-                        for sres in global_vars.DATA['search results']:
-                            if asset_data['id'] == sres['id']:
-                                sres['downloaded'] = 100
+                        for sres in global_vars.DATA['search results'].find_by_id(asset_data['id']):
+                            sres['downloaded'] = 100
 
                 bk_logger.debug('finished download thread')
     # utils.p('end download timer')
@@ -690,8 +687,10 @@ def handle_download_task(task: tasks.Task):
   """
   if task.status == "finished":
     download_post(task)
-  elif task.progress == "error":
-    reports.add_report(task.message, 15, colors.RED)
+  elif task.status in ("error", "cancelled"):
+    download_tasks.pop(task.task_id, None)
+    if task.status == "error":
+      reports.add_report(task.message, 15, colors.RED)
   else:
     download_write_progress(task.task_id, task)
 
@@ -724,6 +723,7 @@ def download_post(task: tasks.Task):
     if orig_task is None:
         return
 
+    trace_start = orig_task.get('trace_start')
     remove_keys = []
     done = False
 
@@ -792,33 +792,35 @@ def download_post(task: tasks.Task):
             # print(task.data)
             ain, resolution = asset_in_scene(task.data['asset_data'])
 
-            if ain == 'LINKED':
-                replace_resolution_linked(file_paths, task.data['asset_data'])
-
+            with tracing.span('replace_resolution', task.task_id):
+                if ain == 'LINKED':
+                    replace_resolution_linked(file_paths, task.data['asset_data'])
 
-            elif ain == 'APPENDED':
-                replace_resolution_appended(file_paths, task.data['asset_data'], task.data['resolution'])
+                elif ain == 'APPENDED':
+                    replace_resolution_appended(file_paths, task.data['asset_data'], task.data['resolution'])
 
             done = True
 
         else:
             # print(task.data)
             orig_task.update(task.data)
-            done = try_finished_append( **task.data)
+            with tracing.span('append_asset', task.task_id):
+                done = try_finished_append( **task.data)
             # if not done:
                 # TODO add back re-download capability for deamon - used for lost libraries
                 # tcom.passargs['retry_counter'] = tcom.passargs.get('retry_counter', 0) + 1
                 # download(asset_data, **tcom.passargs)
 
             if global_vars.DATA['search results'] is not None and done:
-                for sres in global_vars.DATA['search results']:
-                    if task.data['asset_data']['id'] == sres['id']:
-                        sres['downloaded'] = 100
+                for sres in global_vars.DATA['search results'].find_by_id(task.data['asset_data']['id']):
+                    sres['downloaded'] = 100
 
         bk_logger.debug('finished download thread')
     # utils.p('end download timer')
     for key in remove_keys:
         download_tasks.pop(key)
+    if trace_start is not None and task.task_id in remove_keys:
+        tracing.add_span('click_to_scene', trace_start, tracing.now(), task.task_id, asset=task.data['asset_data']['name'])
     return True
 
 def delete_unfinished_file(file_name):
@@ -937,11 +939,41 @@ def download(asset_data, **kwargs):
     if 'downloaders' in kwargs:
         data['downloaders'] = kwargs['downloaders']
     # print(data)
+    trace_start = tracing.now()
     response = daemon_lib.download_asset(data)
+    data['trace_start'] = trace_start
 
     download_tasks[response['task_id']] = data
 
 
+def download_batch(downloads):
+    '''Request many downloads from daemon in one batch, e.g. for populating a scene from a manifest.
+    Each download is a dict with asset_data and keyword arguments of download().
+    Downloaded assets are appended the same way as single downloads. Returns batch_id, see daemon_lib.get_batch().
+    '''
+
+    prefs = utils.get_prefs_dir()
+    prefs['scene_id'] = utils.get_scene_id()
+    items = []
+    for kwargs in downloads:
+        asset_data = copy.deepcopy(kwargs['asset_data'])
+        data = {
+            'progress': 0,
+            'text': f'downloading {asset_data["name"]}',
+            **kwargs,
+            'asset_data': asset_data,
+            'download_dirs': paths.get_download_dirs(asset_data['assetType']),
+        }
+        items.append(data)
+
+    trace_start = tracing.now()
+    response = daemon_lib.submit_batch(downloads=items, shared={'PREFS': prefs})
+    for task_id, data in zip(response['downloads'], items):
+        data['PREFS'] = prefs
+        data['trace_start'] = trace_start
+        download_tasks[task_id] = data
+    return response['batch_id']
+
 
 def check_downloading(asset_data, **kwargs):
     ''' check if an asset is already downloading, if yes, just make a progress bar with downloader object.'''
@@ -16,11 +16,11 @@
 #
 # ##### END GPL LICENSE BLOCK #####
 import logging
-import threading
 
 import bpy
 
 from . import (
+    async_loop,
     global_vars,
     icons,
     paths,
@@ -79,8 +79,7 @@ def upload_rating(asset):
         tasks_queue.add_task((ratings_utils.send_rating_to_thread_work_hours, (url, ratings, headers)), wait=2.5,
                              only_last=True)
 
-    thread = threading.Thread(target=ratings_utils.upload_rating_thread, args=(url, ratings, headers))
-    thread.start()
+    async_loop.run_in_background(ratings_utils.upload_rating_thread, url, ratings, headers)
 
     url = paths.get_api_url() + 'assets/' + asset['asset_data']['id'] + '/review'
 
@@ -89,8 +88,7 @@ def upload_rating(asset):
         'reviewTextProblems': bkit_ratings.rating_problems,
     }
     if not (bkit_ratings.rating_compliments == '' and bkit_ratings.rating_compliments == ''):
-        thread = threading.Thread(target=upload_review_thread, args=(url, reviews, headers))
-        thread.start()
+        async_loop.run_in_background(upload_review_thread, url, reviews, headers)
 
     # the info that the user rated an item is stored in the scene
     s = bpy.context.scene
@@ -17,14 +17,13 @@
 # ##### END GPL LICENSE BLOCK #####
 
 import logging
-import threading
 
 # mainly update functions and callbacks for ratings properties, here to avoid circular imports.
 import bpy
 import requests
 from bpy.props import EnumProperty, FloatProperty, IntProperty, StringProperty
 
-from . import global_vars, paths, rerequests, tasks_queue, utils
+from . import async_loop, global_vars, paths, rerequests, tasks_queue, utils
 
 
 bk_logger = logging.getLogger('blenderkit')
@@ -50,15 +49,13 @@ def upload_rating_thread(url, ratings, headers):
 def send_rating_to_thread_quality(url, ratings, headers):
     '''Sens rating into thread rating, main purpose is for tasks_queue.
     One function per property to avoid lost data due to stashing.'''
-    thread = threading.Thread(target=upload_rating_thread, args=(url, ratings, headers))
-    thread.start()
+    async_loop.run_in_background(upload_rating_thread, url, ratings, headers)
 
 
 def send_rating_to_thread_work_hours(url, ratings, headers):
     '''Sens rating into thread rating, main purpose is for tasks_queue.
     One function per property to avoid lost data due to stashing.'''
-    thread = threading.Thread(target=upload_rating_thread, args=(url, ratings, headers))
-    thread.start()
+    async_loop.run_in_background(upload_rating_thread, url, ratings, headers)
 
 
 def store_rating_local_empty(asset_id):
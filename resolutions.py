@@ -24,6 +24,7 @@ import sys
 import tempfile
 import threading
 import time
+import traceback
 
 import bpy
 import requests
@@ -39,6 +40,7 @@ from . import (
     upload_bg,
     utils,
 )
+from .daemon import bg_workers
 
 
 resolutions = {
@@ -228,8 +230,6 @@ def unpack_asset(data):
         os.remove(bpy.data.filepath + '1')
     except Exception as e:
         print(e)
-    bpy.ops.wm.quit_blender()
-    sys.exit()
 
 
 def patch_asset_empty(asset_id, api_key):
@@ -710,6 +710,14 @@ def run_bg(datafile):
     print('background file operation')
     with open(datafile, 'r',encoding='utf-8') as f:
         data = json.load(f)
+    run_command(data)
+    if data['command'] == 'unpack':
+        bpy.ops.wm.quit_blender()
+        sys.exit()
+
+
+def run_command(data):
+    '''Run the command on the currently open file.'''
     bpy.app.debug_value = data['debug_value']
     write_data_back(data['asset_data'])
     if data['command'] == 'generate_resolutions':
@@ -719,6 +727,28 @@ def run_bg(datafile):
     elif data['command'] == 'regen_thumbnail':
         regenerate_thumbnail_material(data)
 
+
+def run_worker():
+    '''
+    Job loop of a warm background Blender from the daemon's worker pool.
+    Reads jobs as JSON lines from stdin until it is closed. Each job opens its file, runs the command
+    and resets Blender to an empty factory scene, so nothing leaks into the next job.
+    The result is written to stdout as one line starting with bg_workers.RESULT_PREFIX.
+    '''
+    for line in sys.stdin:
+        data = json.loads(line)
+        result = {'ok': True}
+        if data['command'] != 'ping':
+            try:
+                bpy.ops.wm.open_mainfile(filepath=data['fpath'], load_ui=False)
+                run_command(data)
+            except Exception as e:
+                traceback.print_exc()
+                result = {'ok': False, 'error': str(e)}
+            # preferences (and the add-on) stay loaded, only the scene data are reset
+            bpy.ops.wm.read_homefile(use_empty=True, use_factory_startup=True)
+        print(bg_workers.RESULT_PREFIX + json.dumps(result), flush=True)
+
 # load_assets_list()
 # generate_lower_resolutions()
 # class TestOperator(bpy.types.Operator):
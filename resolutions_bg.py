@@ -6,4 +6,7 @@ from blenderkit import resolutions
 BLENDERKIT_EXPORT_DATA = sys.argv[-1]
 
 if __name__ == "__main__":
-    resolutions.run_bg(sys.argv[-1])
+    if sys.argv[-1] == '--worker':
+        resolutions.run_worker()
+    else:
+        resolutions.run_bg(sys.argv[-1])
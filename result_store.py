@@ -0,0 +1,173 @@
+"""Holds search results of the asset bar in pages, indexed by id and assetBaseId.
+
+Results far from the part of the asset bar the user looks at keep only the fields needed to draw the bar,
+their other fields are kept compressed until the results are accessed again. Only the most recently evicted pages
+are kept compressed in memory, older ones are spilled to a temporary file, so memory doesn't grow with scrolling.
+"""
+
+import pickle
+import tempfile
+import zlib
+
+
+PAGE_SIZE = 50
+"""Results in one page of the store."""
+KEEP_PAGES = 2
+"""Pages before and after the visible results which keep all their fields."""
+MAX_COMPRESSED_PAGES = 8
+"""Evicted pages whose fields are kept compressed in memory, fields of pages evicted earlier are spilled to a temporary file."""
+LIGHT_FIELDS = (
+  'id',
+  'assetBaseId',
+  'assetType',
+  'name',
+  'displayName',
+  'author',
+  'thumbnail',
+  'thumbnail_small',
+  'thumbnailSmallUrl',
+  'thumbnailMiddleUrl',
+  'thumbnailLargeUrlNonsquared',
+  'thumb_small_loaded',
+  'downloaded',
+  'canDownload',
+  'verificationStatus',
+  'isFree',
+)
+"""Fields which are never evicted, these are read for every result when the asset bar is drawn or updated."""
+
+
+class ResultStore:
+  """List of search results with O(1) append and lookups by id and assetBaseId.
+
+  Supports the list operations the add-on uses on search results: len(), indexing, iteration, append and extend.
+  Accessing a result by index or iteration restores fields evicted from its page, so callers always get complete results.
+  Callers which need only LIGHT_FIELDS, e.g. thumbnails or ids, should use iter_light() which doesn't restore anything.
+  Results are the same dicts which were added, evicting and restoring changes them in place.
+  """
+
+  def __init__(self, results=()):
+    self.pages = []
+    self.evicted = {}  # page number: compressed pickle of {position: evicted fields}, least recently evicted first
+    self.spilled = {}  # page number: (offset, length) of its compressed pickle in spill_file
+    self.slots = {}  # page number: (offset, capacity) in spill_file, reused when the page is spilled again
+    self.spill_file = None
+    self.by_id = {}
+    self.by_base_id = {}
+    self.length = 0
+    self.extend(results)
+
+  def __len__(self):
+    return self.length
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self[i] for i in range(*index.indices(self.length))]
+    if index < 0:
+      index += self.length
+    if not 0 <= index < self.length:
+      raise IndexError('search result index out of range')
+    page_number = index // PAGE_SIZE
+    if self.is_evicted(page_number):
+      self.restore_page(page_number)
+    return self.pages[page_number][index % PAGE_SIZE]
+
+  def __iter__(self):
+    for i in range(self.length):
+      yield self[i]
+
+  def iter_light(self):
+    """Iterate over results without restoring evicted fields, only LIGHT_FIELDS are guaranteed to be present."""
+    for page in self.pages:
+      yield from page
+
+  def append(self, result):
+    if len(self.pages) == 0 or len(self.pages[-1]) == PAGE_SIZE:
+      self.pages.append([])
+    self.pages[-1].append(result)
+    self.by_id.setdefault(result['id'], []).append(self.length)
+    self.by_base_id.setdefault(result['assetBaseId'], []).append(self.length)
+    self.length += 1
+
+  def extend(self, results):
+    for result in results:
+      self.append(result)
+
+  def find_by_id(self, asset_id):
+    """Get all results of the asset version."""
+    return [self[i] for i in self.by_id.get(asset_id, [])]
+
+  def find_by_base_id(self, asset_base_id):
+    """Get all results of the asset. Infinite scroll may get the same asset twice, when results shift between pages."""
+    return [self[i] for i in self.by_base_id.get(asset_base_id, [])]
+
+  def index_of_base_id(self, asset_base_id):
+    """Get indices of results of the asset, without restoring evicted fields."""
+    return self.by_base_id.get(asset_base_id, [])
+
+  def set_viewport(self, first, last):
+    """Keep all fields of results near the visible results from `first` to `last`, evict heavy fields from the others."""
+    first_page = max(first // PAGE_SIZE - KEEP_PAGES, 0)
+    last_page = last // PAGE_SIZE + KEEP_PAGES
+    for page_number in range(len(self.pages)):
+      if first_page <= page_number <= last_page:
+        if self.is_evicted(page_number):
+          self.restore_page(page_number)
+      elif not self.is_evicted(page_number):
+        self.evict_page(page_number)
+
+  def is_evicted(self, page_number):
+    return page_number in self.evicted or page_number in self.spilled
+
+  def evict_page(self, page_number):
+    heavy = {}
+    for position, result in enumerate(self.pages[page_number]):
+      fields = {key: result.pop(key) for key in list(result.keys()) if key not in LIGHT_FIELDS}
+      if fields:
+        heavy[position] = fields
+    self.evicted[page_number] = zlib.compress(pickle.dumps(heavy))
+    while len(self.evicted) > MAX_COMPRESSED_PAGES:
+      if not self.spill_page(next(iter(self.evicted))):
+        break
+
+  def spill_page(self, page_number):
+    """Move compressed fields of the evicted page from memory to the spill file. Returns False if the file can't be written."""
+
+    data = self.evicted[page_number]
+    try:
+      if self.spill_file is None:
+        self.spill_file = tempfile.TemporaryFile(prefix='blenderkit_results_')
+      offset, capacity = self.slots.get(page_number, (None, 0))
+      if len(data) > capacity:
+        offset = self.spill_file.seek(0, 2)
+        capacity = len(data)
+      self.spill_file.seek(offset)
+      self.spill_file.write(data)
+    except OSError as e:
+      print(f'Could not spill search results to disk: {e}')
+      return False
+    self.slots[page_number] = (offset, capacity)
+    self.spilled[page_number] = (offset, len(data))
+    del self.evicted[page_number]
+    return True
+
+  def restore_page(self, page_number):
+    if page_number in self.spilled:
+      offset, length = self.spilled.pop(page_number)
+      self.spill_file.seek(offset)
+      data = self.spill_file.read(length)
+    else:
+      data = self.evicted.pop(page_number)
+    heavy = pickle.loads(zlib.decompress(data))
+    page = self.pages[page_number]
+    for position, fields in heavy.items():
+      page[position].update(fields)
+
+  def get_stats(self):
+    return {
+      'results': self.length,
+      'pages': len(self.pages),
+      'evicted_pages': len(self.evicted) + len(self.spilled),
+      'evicted_bytes': sum(len(data) for data in self.evicted.values()),
+      'spilled_pages': len(self.spilled),
+    }
@@ -37,6 +37,7 @@ from bpy.types import Operator
 from . import (
     addon_updater_ops,
     asset_bar_op,
+    async_loop,
     bkit_oauth,
     categories,
     colors,
@@ -47,14 +48,14 @@ from . import (
     paths,
     ratings_utils,
     reports,
+    result_store,
     rerequests,
-    resolutions,
     tasks_queue,
     ui,
     utils,
     version_checker,
 )
-from .daemon import tasks
+from .daemon import search_results, tasks
 
 
 bk_logger = logging.getLogger('blenderkit')
@@ -82,6 +83,9 @@ def check_errors(rdata):
 
 search_tasks = {}
 all_thumbs_loaded = True
+last_visible_assets = []
+full_thumbnail_requests = {}  # image_path: time of the request, for full size thumbnails not downloaded yet
+FULL_THUMBNAIL_RETRY = 30
 
 rtips_string = """You can disable tips in the add-on preferences.
 Ratings help us distribute funds to creators.
@@ -258,119 +262,43 @@ def check_clipboard():
         bpy.context.window_manager.clipboard = ''
 
 
-def parse_result(r):
+def set_downloaded(asset_data):
   '''
-  needed to generate some extra data in the result(by now)
+  Sets the scene dependent 'downloaded' flag of the record and transcribes urls already fetched from the server.
   Parameters
   ----------
-  r - search result, also called asset_data
+  asset_data - search result parsed by search_results.parse_result
   '''
   scene = bpy.context.scene
+  au = scene.get('assets used', {})
+  if au == {}:
+    scene['assets used'] = au
+  if asset_data['assetBaseId'] in au.keys():
+    asset_data['downloaded'] = 100
+    # transcribe all urls already fetched from the server
+    r_previous = au[asset_data['assetBaseId']]
+    if r_previous.get('files'):
+      for f in r_previous['files']:
+        if f.get('url'):
+          for f1 in asset_data['files']:
+            if f1['fileType'] == f['fileType']:
+              f1['url'] = f['url']
 
-  # TODO remove this fix when filesSize is fixed.
-  # this is a temporary fix for too big numbers from the server.
-  # try:
-  #     r['filesSize'] = int(r['filesSize'] / 1024)
-  # except:
-  #     utils.p('asset with no files-size')
-  asset_type = r['assetType']
-  if len(r['files']) > 0:  # TODO remove this condition so all assets are parsed.
-    get_author(r)
-
-    r['available_resolutions'] = []
-    allthumbs = []
-    durl, tname, small_tname = '', '', ''
-
-    if r['assetType'] == 'hdr':
-      tname = paths.extract_filename_from_url(r['thumbnailLargeUrlNonsquared'])
-    else:
-      tname = paths.extract_filename_from_url(r['thumbnailMiddleUrl'])
-    small_tname = paths.extract_filename_from_url(r['thumbnailSmallUrl'])
-    allthumbs.append(tname)  # TODO just first thumb is used now.
-    # if r['fileType'] == 'thumbnail':
-    #     tname = paths.extract_filename_from_url(f['fileThumbnailLarge'])
-    #     small_tname = paths.extract_filename_from_url(f['fileThumbnail'])
-    #     allthumbs.append(tname)  # TODO just first thumb is used now.
-
-    for f in r['files']:
-      # if f['fileType'] == 'thumbnail':
-      #     tname = paths.extract_filename_from_url(f['fileThumbnailLarge'])
-      #     small_tname = paths.extract_filename_from_url(f['fileThumbnail'])
-      #     allthumbs.append(tname)  # TODO just first thumb is used now.
-
-      if f['fileType'] == 'blend':
-        durl = f['downloadUrl'].split('?')[0]
-        # fname = paths.extract_filename_from_url(f['filePath'])
-
-      if f['fileType'].find('resolution') > -1:
-        r['available_resolutions'].append(resolutions.resolutions[f['fileType']])
-
-    # code for more thumbnails
-    # tdict = {}
-    # for i, t in enumerate(allthumbs):
-    #     tdict['thumbnail_%i'] = t
-
-    r['max_resolution'] = 0
-    if r['available_resolutions']:  # should check only for non-empty sequences
-      r['max_resolution'] = max(r['available_resolutions'])
-
-    # tooltip = generate_tooltip(r)
-    # for some reason, the id was still int on some occurances. investigate this.
-    r['author']['id'] = str(r['author']['id'])
-
-    # some helper props, but generally shouldn't be renaming/duplifiying original properties,
-    # so blender's data is same as on server.
-    asset_data = {'thumbnail': tname,
-                  'thumbnail_small': small_tname,
-                  # 'tooltip': tooltip,
-
-                  }
-    asset_data['downloaded'] = 0
-
-    # parse extra params needed for blender here
-    params = r['dictParameters']  # utils.params_to_dict(r['parameters'])
-
-    if asset_type == 'model':
-      if params.get('boundBoxMinX') != None:
-        bbox = {
-          'bbox_min': (
-            float(params['boundBoxMinX']),
-            float(params['boundBoxMinY']),
-            float(params['boundBoxMinZ'])),
-          'bbox_max': (
-            float(params['boundBoxMaxX']),
-            float(params['boundBoxMaxY']),
-            float(params['boundBoxMaxZ']))
-        }
-
-      else:
-        bbox = {
-          'bbox_min': (-.5, -.5, 0),
-          'bbox_max': (.5, .5, 1)
-        }
-      asset_data.update(bbox)
-    if asset_type == 'material':
-      asset_data['texture_size_meters'] = params.get('textureSizeMeters', 1.0)
-
-    # asset_data.update(tdict)
-
-    au = scene.get('assets used', {})
-    if au == {}:
-      scene['assets used'] = au
-    if r['assetBaseId'] in au.keys():
-      asset_data['downloaded'] = 100
-      # transcribe all urls already fetched from the server
-      r_previous = au[r['assetBaseId']]
-      if r_previous.get('files'):
-        for f in r_previous['files']:
-          if f.get('url'):
-            for f1 in r['files']:
-              if f1['fileType'] == f['fileType']:
-                f1['url'] = f['url']
-
-    # attempt to switch to use original data gradually, since the parsing as itself should become obsolete.
-    asset_data.update(r)
-    return asset_data
+
+def parse_result(r):
+  '''
+  needed to generate some extra data in the result(by now).
+  Results of searches are parsed by the daemon already, this is for results fetched by the add-on itself.
+  Parameters
+  ----------
+  r - search result, also called asset_data
+  '''
+  asset_data = search_results.parse_result(r)
+  if asset_data is None:  # TODO parse also assets without files.
+    return None
+  get_author(asset_data)
+  set_downloaded(asset_data)
+  return asset_data
 
 
 def clear_searches():
@@ -430,24 +358,22 @@ def handle_search_task(task: tasks.Task) -> bool:
   props = utils.get_search_props()
   search_name = f'bkit {asset_type} search'
 
-  if not task.data.get('get_next'):
-    result_field = []
+  if not task.data.get('get_next') or global_vars.DATA.get(search_name) is None:
+    result_field = result_store.ResultStore()
   else:
-    result_field = []
-    for r in global_vars.DATA[search_name]:
-      result_field.append(r)
+    # infinite scroll appends to the results in place
+    result_field = global_vars.DATA[search_name]
 
   global all_thumbs_loaded
   ok, error = check_errors(task.result)
   if ok:
     ui_props = bpy.context.window_manager.blenderkitUI
-    orig_len = len(result_field)
 
-    for ri, r in enumerate(task.result['results']):
-      asset_data = parse_result(r)
-      if asset_data != None:
-        result_field.append(asset_data)
-        # all_thumbs_loaded = all_thumbs_loaded and load_preview(asset_data, ri + orig_len)
+    # results are parsed by the daemon, only the scene dependent data is added here
+    for asset_data in task.result['results']:
+      get_author(asset_data)
+      set_downloaded(asset_data)
+      result_field.append(asset_data)
 
     # Get ratings from BlenderKit server
     user_preferences = bpy.context.preferences.addons['blenderkit'].preferences
@@ -456,9 +382,7 @@ def handle_search_task(task: tasks.Task) -> bool:
     if utils.profile_is_validator():
       for r in task.result['results']:
         if ratings_utils.get_rating_local(r['id']) is None:
-          rating_thread = threading.Thread(target=ratings_utils.get_rating, args=([r['id'], headers]),
-                                           daemon=True)
-          rating_thread.start()
+          async_loop.run_in_background(ratings_utils.get_rating, r['id'], headers)
 
     global_vars.DATA[search_name] = result_field
     global_vars.DATA[search_name + ' orig'] = task.result
@@ -493,6 +417,17 @@ def handle_search_task(task: tasks.Task) -> bool:
   return True
 
 
+def handle_search_error(task: tasks.Task):
+  '''forget the failed search, so the add-on doesn't wait for its results.'''
+  if search_tasks.pop(task.task_id, None) is None:
+    return
+  props = utils.get_search_props()
+  props.report = task.message
+  props.search_error = True
+  if len(search_tasks) == 0:
+    props.is_searching = False
+
+
 # @bpy.app.handlers.persistent
 def search_timer():
   # this makes a first search after opening blender. showing latest assets.
@@ -539,10 +474,50 @@ def search_timer():
   return .5
 
 
+def request_full_thumbnail(asset_data):
+  """Ask daemon for the full size thumbnail of the asset, unless it is downloaded or requested already.
+  Full size thumbnails are downloaded only on demand, when the tooltip is shown.
+  """
+
+  directory = paths.get_temp_dir('%s_search' % asset_data['assetType'])
+  image_path = os.path.join(directory, asset_data['thumbnail'])
+  if global_vars.DATA['images available'].get(image_path):
+    return
+  # a request without any answer (e.g. lost when the daemon restarted) is sent again after a while
+  requested = full_thumbnail_requests.get(image_path)
+  if requested is not None and time.time() - requested < FULL_THUMBNAIL_RETRY:
+    return
+
+  global_vars.DATA['images available'][image_path] = False
+  full_thumbnail_requests[image_path] = time.time()
+  if asset_data['assetType'] == 'hdr':
+    image_url = asset_data['thumbnailLargeUrlNonsquared']
+  else:
+    image_url = asset_data['thumbnailMiddleUrl']
+  data = {
+    "image_path": image_path,
+    "image_url": image_url,
+    "assetBaseId": asset_data['assetBaseId'],
+    "thumbnail_type": "full",
+  }
+  daemon_lib.download_thumbnail(data)
+
+
+def report_visible_assets(asset_base_ids: list):
+  """Send assets visible in the asset bar to daemon, so their thumbnails are downloaded first. Sends only changes."""
+
+  global last_visible_assets
+  if asset_base_ids == last_visible_assets:
+    return
+  last_visible_assets = asset_base_ids
+  daemon_lib.set_visible_thumbnails(asset_base_ids)
+
+
 def handle_preview_task(task: tasks.Task) -> bool:
   """Parse search results, try to load all available previews."""
 
   global_vars.DATA['images available'][task.data['image_path']] = True
+  full_thumbnail_requests.pop(task.data['image_path'], None)
   if asset_bar_op.asset_bar_operator is not None:
     if task.data['thumbnail_type'] =='small':
       asset_bar_op.asset_bar_operator.update_image(task.data['assetBaseId'])
@@ -551,6 +526,15 @@ def handle_preview_task(task: tasks.Task) -> bool:
   return True
 
 
+def handle_preview_failed(task: tasks.Task):
+  """Forget the failed or cancelled thumbnail download, so the thumbnail is requested again when needed."""
+
+  image_path = task.data.get('image_path')
+  if global_vars.DATA['images available'].get(image_path) is False:
+    del global_vars.DATA['images available'][image_path]
+  full_thumbnail_requests.pop(image_path, None)
+
+
 def load_preview(asset):
   # FIRST START SEARCH
   props = bpy.context.window_manager.blenderkitUI
@@ -605,7 +589,7 @@ def load_preview(asset):
 def load_previews():
   results = global_vars.DATA.get('search results')
   if results is not None:
-    for i, result in enumerate(results):
+    for result in results.iter_light():
       load_preview(result)
 
 
@@ -1097,8 +1081,7 @@ def add_search_process(query, params):
 
   while (len(search_tasks) > 0):
     # just remove all running search tasks.
-    # we can also kill them in daemon, but not so urgent now
-    # TODO stop tasks in daemon?
+    # daemon drops thumbnails of the superseded search itself when the new one starts.
     print('removing search tasks')
     search_tasks = dict()
   tempdir = paths.get_temp_dir('%s_search' % query['asset_type'])
@@ -17,8 +17,11 @@
 # ##### END GPL LICENSE BLOCK #####
 
 
+import heapq
+import itertools
 import logging
-import queue
+import threading
+import time
 
 import bpy
 from bpy.app.handlers import persistent
@@ -28,6 +31,21 @@ from . import utils
 
 bk_logger = logging.getLogger('blenderkit')
 
+TIME_BUDGET = 0.02
+"""Seconds the queue worker may spend running tasks in one tick, the rest waits for the next tick so the UI doesn't freeze."""
+IDLE_INTERVAL = 2.0
+"""Interval of ticks while the queue is empty, added tasks wake the worker up earlier with wake_up()."""
+BUSY_INTERVAL = 0.001
+"""Interval of the next tick when due tasks were left over because the time budget ran out."""
+
+worker_running = False
+"""True while the queue worker runs tasks, tasks added meanwhile are picked up in the same tick."""
+next_tick = None
+"""Monotonic time of the next tick of the queue worker, None until the worker scheduled it."""
+wake_requested = threading.Event()
+"""Set when a task is added from another thread, the add-on's timer then calls wake_up() on the main thread."""
+
+
 @persistent
 def scene_load(context):
     user_preferences = bpy.context.preferences.addons['blenderkit'].preferences
@@ -36,14 +54,93 @@ def scene_load(context):
             bpy.app.timers.register(queue_worker)
 
 
+class TaskQueue:
+    """Tasks ordered by the time they are due, safe to add to from any thread.
+
+    Tasks added with only_last are coalesced by their command and first argument:
+    a newer task replaces the waiting one, the replaced heap entry is skipped when it comes up.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.heap = []  # (due, order, task)
+        self.order = itertools.count()
+        self.last = {}  # only_last key: the task which runs
+        self.stats = {
+            'added': 0,
+            'executed': 0,
+            'coalesced': 0,
+            'failed': 0,
+            'over_budget_ticks': 0,
+            'latency_total': 0.0,
+            'latency_max': 0.0,
+        }
+
+    def put(self, task):
+        with self.lock:
+            if task.only_last:
+                if task.key in self.last:
+                    self.stats['coalesced'] += 1
+                self.last[task.key] = task
+            heapq.heappush(self.heap, (task.due, next(self.order), task))
+            self.stats['added'] += 1
+
+    def pop_due(self, now):
+        """Get the next task due at `now`, None if there is none."""
+        with self.lock:
+            while len(self.heap) > 0 and self.heap[0][0] <= now:
+                task = heapq.heappop(self.heap)[2]
+                if not task.only_last:
+                    return task
+                if self.last.get(task.key) is task:
+                    del self.last[task.key]
+                    return task
+        return None
+
+    def next_due(self):
+        """Get time the first task is due, None if the queue is empty. Replaced only_last tasks may be reported too early, which only costs an extra tick."""
+        with self.lock:
+            if len(self.heap) == 0:
+                return None
+            return self.heap[0][0]
+
+    def record(self, task, now, failed=False):
+        """Record latency of the executed task."""
+        latency = now - task.due
+        with self.lock:
+            self.stats['executed'] += 1
+            self.stats['latency_total'] += latency
+            self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+            if failed:
+                self.stats['failed'] += 1
+
+    def over_budget(self):
+        with self.lock:
+            self.stats['over_budget_ticks'] += 1
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['depth'] = sum(1 for _, _, task in self.heap if not task.only_last or self.last.get(task.key) is task)
+        executed = max(stats['executed'], 1)
+        stats['latency_avg'] = stats['latency_total'] / executed
+        return stats
+
+
 def get_queue():
     # we pick just a random one of blender types, to try to get a persistent queue
     t = bpy.types.Scene
 
-    if not hasattr(t, 'task_queue'):
-        t.task_queue = queue.Queue()
+    if not isinstance(getattr(t, 'task_queue', None), TaskQueue):
+        t.task_queue = TaskQueue()
     return t.task_queue
 
+
+def get_stats():
+    """Get queue depth and latency of executed tasks (seconds between the time a task was due and the time it ran)."""
+    return get_queue().get_stats()
+
+
 class task_object:
     def __init__(self, command = '', arguments = (), wait = 0, only_last = False, fake_context = False, fake_context_area = 'VIEW_3D'):
         self.command = command
@@ -52,71 +149,86 @@ class task_object:
         self.only_last = only_last
         self.fake_context = fake_context
         self.fake_context_area = fake_context_area
+        self.due = time.monotonic() + wait
+        # coalescing key, not only by task, but also first argument.
+        # by now stashing is used for ratings, where the first argument is url.
+        # This enables fast rating of multiple assets while allowing larger delay for uploading of ratings.
+        # this avoids a duplicate request error on the server
+        self.key = str(command) + str(arguments[0]) if only_last and len(arguments) > 0 else str(command)
 
 def add_task(task, wait = 0, only_last = False, fake_context = False, fake_context_area = 'VIEW_3D'):
     q = get_queue()
     taskob = task_object(task[0],task[1], wait = wait, only_last = only_last, fake_context = fake_context, fake_context_area = fake_context_area)
     q.put(taskob)
+    wake_up()
+
+def wake_up():
+    """Move the next tick of the queue worker to the time the first task is due, if it is scheduled later.
+    Timers can be changed only on the main thread, other threads request the wake up through wake_requested.
+    """
+    global next_tick
+    if bpy.app.background:
+        return
+    if threading.current_thread() is not threading.main_thread():
+        wake_requested.set()
+        return
+    wake_requested.clear()
+    if worker_running or not bpy.app.timers.is_registered(queue_worker):
+        return
+    due = get_queue().next_due()
+    if due is None or (next_tick is not None and due >= next_tick):
+        return
+    interval = max(due - time.monotonic(), BUSY_INTERVAL)
+    bpy.app.timers.unregister(queue_worker)
+    bpy.app.timers.register(queue_worker, first_interval=interval)
+    next_tick = time.monotonic() + interval
+
+def run_task(task):
+    bk_logger.debug('task queue task:'+ str( task.command) +str( task.arguments))
+    if task.fake_context:
+        fc = utils.get_fake_context(bpy.context, area_type = task.fake_context_area)
+        task.command(fc,*task.arguments)
+    else:
+        task.command(*task.arguments)
 
 # @bpy.app.handlers.persistent
 def queue_worker():
-    # utils.p('start queue worker timer')
-
-    #bk_logger.debug('timer queue worker')
-    time_step = 2.0
+    """Run tasks which are due, in order of their due time, until the time budget of the tick is used up.
+    Returns the interval to the next tick: right away if due tasks are left, otherwise until the next task is due,
+    or IDLE_INTERVAL when the queue is empty.
+    """
+    global worker_running, next_tick
     q = get_queue()
-
-    back_to_queue = [] #delayed events
-    stashed = {}
-    # first round we get all tasks that are supposed to be stashed and run only once (only_last option)
-    # stashing finds tasks with the property only_last and same command and executes only the last one.
-    while not q.empty():
-        # print('queue while 1')
-
-        task = q.get()
-        if task.only_last:
-            #this now makes the keys not only by task, but also first argument.
-            # by now stashing is only used for ratings, where the first argument is url.
-            # This enables fast rating of multiple assets while allowing larger delay for uploading of ratings.
-            # this avoids a duplicate request error on the server
-            stashed[str(task.command)+str(task.arguments[0])] = task
-        else:
-            back_to_queue.append(task)
-    if len(stashed.keys())>1:
-        bk_logger.debug('task queue stashed task:' +str(stashed))
-    #return tasks to que except for stashed
-    for task in back_to_queue:
-        q.put(task)
-    #return stashed tasks to queue
-    for k in stashed.keys():
-        q.put(stashed[k])
-    #second round, execute or put back waiting tasks.
-    back_to_queue = []
-    while not q.empty():
-        # print('window manager', bpy.context.window_manager)
-        task = q.get()
-
-        if task.wait>0:
-            task.wait-=time_step
-            back_to_queue.append(task)
-        else:
-            bk_logger.debug('task queue task:'+ str( task.command) +str( task.arguments))
+    start = time.monotonic()
+    worker_running = True
+    try:
+        while True:
+            now = time.monotonic()
+            if now - start > TIME_BUDGET:
+                q.over_budget()
+                next_tick = now + BUSY_INTERVAL
+                return BUSY_INTERVAL
+            task = q.pop_due(now)
+            if task is None:
+                break
+            failed = False
             try:
-                if task.fake_context:
-                    fc = utils.get_fake_context(bpy.context, area_type = task.fake_context_area)
-                    task.command(fc,*task.arguments)
-                else:
-                    task.command(*task.arguments)
+                run_task(task)
             except Exception as e:
+                failed = True
                 bk_logger.error('task queue failed task:'+ str(task.command)+str(task.arguments)+ str(e))
-                # bk_logger.exception('Got exception on main handler')
-                # raise
-        # print('queue while 2')
-    for task in back_to_queue:
-        q.put(task)
-    # utils.p('end queue worker timer')
-
-    return 2.0
+            q.record(task, now, failed)
+    finally:
+        worker_running = False
+
+    next_due = q.next_due()
+    now = time.monotonic()
+    if next_due is None:
+        interval = IDLE_INTERVAL
+    else:
+        interval = max(next_due - now, BUSY_INTERVAL)
+    next_tick = now + interval
+    return interval
 
 
 def register():
@@ -1,27 +1,29 @@
-import asyncio
-import concurrent.futures
 import logging
 import os
-import queue
-import sys
 import threading
 import time
 
 import bpy
 import requests
 
-from . import colors, daemon_lib, download, reports, search
-from .daemon import tasks
+from . import async_loop, colors, daemon_lib, download, reports, search, tasks_queue
+from .daemon import tasks, tracing
 
 
 logger = logging.getLogger(__name__)
 
 # pending tasks are tasks that were not parsed correclty and should be tried to be parsed later.
 pending_tasks = list()
-reader_loop = None
-ENABLE_ASYNC_LOOP =False
+ENABLE_ASYNC_LOOP = True
+"""Run requests to the daemon (and ratings and comments) on the async loop of the add-on, so the UI never waits for the network."""
 
-reports_queue = queue.Queue()
+FAST_INTERVAL = .2
+"""Seconds between ticks of the timer while downloads run or reports keep coming."""
+PENDING_INTERVAL = .5
+"""Seconds between ticks while the daemon still works on tasks of this Blender, e.g. thumbnails."""
+MAX_INTERVAL = 2.0
+"""Longest pause between ticks when nothing is pending, the interval doubles up to it while idle."""
+poll_interval = FAST_INTERVAL
 
 
 @bpy.app.handlers.persistent
@@ -32,44 +34,60 @@ def timer():
   global pending_tasks
 
   search.check_clipboard()
+  async_loop.handle_results()
+  if tasks_queue.wake_requested.is_set():
+    tasks_queue.wake_up()  # tasks were added from other threads
+  if daemon_lib.daemon_starting.is_set():
+    # don't block the UI waiting for the daemon, its reports are collected once it is ready
+    reports.add_report('Starting BlenderKit daemon...', 1)
+    return .5
 
   app_id = os.getpid()
-  results = list()
-
-  if ENABLE_ASYNC_LOOP:
-    global reports_queue
-    # print('checking queue', daemon_lib.reports_queue.empty())
-    while not reports_queue.empty():
-      queue_result = reports_queue.get()
-      # print('from queue', queue_result)
-      results.extend(queue_result)
-    kick_async_loop()
-    asyncio.ensure_future(daemon_lib.get_reports_async(app_id, reports_queue))
-  else:
-    results = daemon_lib.get_reports(app_id)
+  results = daemon_lib.get_streamed_reports()
+  # fall back to polling while the report stream is (re)connecting
+  if not daemon_lib.report_stream_connected.is_set():
+    if async_loop.is_running():
+      daemon_lib.request_reports(app_id)  # reports come with the next tick
+    else:
+      results.extend(daemon_lib.get_reports(app_id))
 
   results.extend(pending_tasks)
   logger.debug(f'timer before {mt-time.time()}')
   pending_tasks.clear()
   for task in results:
-    task = tasks.Task(
-      data = task['data'],
-      task_id = task['task_id'],
-      app_id = task['app_id'],
-      task_type = task['task_type'],
-      message = task['message'],
-      progress = task['progress'],
-      status = task['status'],
-      result = task['result'],
-      )
-    handle_task(task)
+    if task.status == 'finished':
+      with tracing.span(f'{task.task_type}_post', task.task_id):
+        handle_task(task)
+    else:
+      handle_task(task)
     
 
   # print('timer',time.time()-mt)
   logger.debug(f'timer {mt-time.time()}')
-  if len(download.download_tasks) > 0:
-    return .2
-  return .5
+  return get_next_interval(len(results) > 0)
+
+def get_next_interval(had_reports: bool) -> float:
+  """Poll fast while something happens, back off exponentially while nothing is pending."""
+
+  global poll_interval
+  if had_reports or len(download.download_tasks) > 0:
+    poll_interval = FAST_INTERVAL
+  elif len(daemon_lib.report_cache) > 0 or not daemon_lib.report_stream_connected.is_set():
+    poll_interval = PENDING_INTERVAL
+  else:
+    poll_interval = min(poll_interval * 2, MAX_INTERVAL)
+  return poll_interval
+
+def wake_up():
+  """Poll fast again right away, called when a search or download is requested."""
+
+  global poll_interval
+  poll_interval = FAST_INTERVAL
+  if threading.current_thread() is not threading.main_thread() or bpy.app.background:
+    return
+  if bpy.app.timers.is_registered(timer):
+    bpy.app.timers.unregister(timer)
+  bpy.app.timers.register(timer, persistent=True, first_interval=FAST_INTERVAL)
 
 @bpy.app.handlers.persistent
 def timer_image_cleanup():
@@ -86,6 +104,9 @@ def cancel_all_tasks(self, context):
   pending_tasks.clear()
   download.clear_downloads()
   search.clear_searches()
+  # the port might have changed, reconnect the report stream
+  daemon_lib.stop_report_stream()
+  daemon_lib.start_report_stream(os.getpid())
 
 def handle_task(task: tasks.Task):
   """Handle incomming task information. Sort tasks by type and call apropriate functions."""
@@ -99,52 +120,35 @@ def handle_task(task: tasks.Task):
     if task.status == 'finished':
       search.handle_search_task(task)
     elif task.status == 'error':
+      search.handle_search_error(task)
       reports.add_report(task.message, 15, colors.RED)
 
+  #HANDLE BATCH
+  if task.task_type in ('batch', 'batch_search'):
+    daemon_lib.handle_batch_task(task)
+
   #HANDLE THUMBNAIL DOWNLOAD (candidate to be a function)
   if task.task_type == 'thumbnail_download':
     if task.status == 'finished':
       search.handle_preview_task(task)
-    elif task.status == 'error':
+    elif task.status in ('error', 'cancelled'):
+      search.handle_preview_failed(task)
+    if task.status == 'error':
       reports.add_report(task.message, 3, colors.RED)
 
 
-def setup_asyncio_executor():
-  """Set up AsyncIO to run properly on each platform."""
-
-  if sys.platform == 'win32':
-    asyncio.get_event_loop().close()
-    # On Windows, the default event loop is SelectorEventLoop, which does
-    # not support subprocesses. ProactorEventLoop should be used instead.
-    # Source: https://docs.python.org/3/library/asyncio-subprocess.html
-    loop = asyncio.ProactorEventLoop()
-    asyncio.set_event_loop(loop)
-  else:
-    loop = asyncio.get_event_loop()
-
-  executor = concurrent.futures.ThreadPoolExecutor(max_workers=10)
-  loop.set_default_executor(executor)
-  # loop.set_debug(True)
-
-
-def kick_async_loop(*args) -> bool:
-  """Perform a single iteration of the asyncio event loop."""
-
-  loop = asyncio.get_event_loop()
-  loop.stop()
-  loop.run_forever()
-
-  return True#stop_after_this_kick
-
 def start_server_thread():
   with requests.Session() as session:
     daemon_lib.ensure_daemon_alive(session)
+  if not bpy.app.background:
+    daemon_lib.start_report_stream(os.getpid())
 
 
 def register_timer():
   if ENABLE_ASYNC_LOOP:
-    setup_asyncio_executor()
+    async_loop.start()
   if not bpy.app.background:
+    daemon_lib.on_activity = wake_up
     bpy.app.timers.register(timer, persistent=True, first_interval=3)
     bpy.app.timers.register(timer_image_cleanup, persistent=True, first_interval=60)
 
@@ -152,8 +156,11 @@ def register_timer():
   thread.start()
 
 def unregister_timer():
+  daemon_lib.on_activity = None
+  daemon_lib.stop_report_stream()
   try:
     daemon_lib.report_blender_quit()
   except Exception as e:
     print(e)
+  async_loop.stop()
 
@@ -31,6 +31,7 @@ from . import (
     autothumb,
     categories,
     comments_utils,
+    daemon_lib,
     download,
     global_vars,
     icons,
@@ -2655,6 +2656,33 @@ def draw_panel_categories(self, context):
                 #         op.category = c1['slug']
 
 
+class ExportDaemonTrace(bpy.types.Operator):
+    """Export timing of recent tasks of the add-on and the daemon into Chrome trace JSON file for chrome://tracing or ui.perfetto.dev"""
+    bl_idname = "wm.blenderkit_export_trace"
+    bl_label = "Export BlenderKit trace"
+    bl_options = {'REGISTER', 'INTERNAL'}
+
+    filepath: StringProperty(
+        name="File Path",
+        description="Trace file to write",
+        subtype='FILE_PATH',
+        default="blenderkit_trace.json")
+
+    def invoke(self, context, event):
+        context.window_manager.fileselect_add(self)
+        return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        filepath = bpy.path.ensure_ext(bpy.path.abspath(self.filepath), '.json')
+        try:
+            daemon_lib.export_trace(filepath)
+        except OSError as e:
+            self.report({'ERROR'}, f'Could not write trace: {e}')
+            return {'CANCELLED'}
+        self.report({'INFO'}, f'Trace exported to {filepath}')
+        return {'FINISHED'}
+
+
 class VIEW3D_PT_blenderkit_downloads(Panel):
     bl_category = "BlenderKit"
     bl_idname = "VIEW3D_PT_blenderkit_downloads"
@@ -2784,6 +2812,7 @@ classes = (
     ShowNotifications,
     NotificationOpenTarget,
     MarkAllNotificationsRead,
+    ExportDaemonTrace,
 )
 
 
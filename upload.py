@@ -1323,9 +1323,9 @@ class AssetDebugPrint(Operator):
         sr =global_vars.DATA['search results']
 
         result = None
-        for r in sr:
-            if r['id'] == self.asset_id:
-                result = r
+        results = sr.find_by_id(self.asset_id)
+        if results:
+            result = results[-1]
         if not result:
             ad = bpy.context.active_object.get('asset_data')
             if ad:
@@ -1372,7 +1372,7 @@ class AssetVerificationStatusChange(Operator):
         # update status in search results for validator's clarity
         sr =global_vars.DATA['search results']
 
-        for r in sr:
+        for r in sr.iter_light():
             if r['id'] == self.asset_id:
                 r['verificationStatus'] = self.state
 